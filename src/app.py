@@ -1,53 +1,137 @@
+import os
 import random
-from flask import Flask, abort, render_template, send_from_directory
+import time
+from datetime import datetime, timezone
+from flask import Flask, abort, g, jsonify, make_response, render_template, request, send_from_directory, url_for
 import webbrowser
+import threading
 from threading import Timer
 
 import config_manager
+import custom_pages_index
 import custom_pages_util
 import app_logger
+import asset_fingerprints
+import caption_renderer
+import compression
+import image_metadata
+import markdown_engine
+import metrics
 import path_util
+import portfolio_api
+import portfolio_index
+import portfolio_watcher
+import render_cache
+import template_cache
+import thumbnails
 from portfolio import Portfolio
 from portfolio_element import PortfolioElement
 
 app = Flask(__name__)  # Create the Flask app instance
+app.context_processor(config_manager.inject_config)  # Registered now, the environment may be set up during the first request
+
+# Every custom page is rendered from these, on top of its own markdown file
+TEXT_PAGE_DEPENDENCIES = [("config",), ("fingerprints",), ("template", "base.jinja"), ("template", "text_page.jinja")]
+
+# Served when there is no home.md or gallery.md in the custom_pages folder
+DEFAULT_HOME_MARKDOWN = "# Welcome to Pyfolio!\n\nThis is the default home page. You can customize it by creating a `home.md` file in the `custom_pages` folder.\n\n{{pyfolio-carousel}}"
+DEFAULT_GALLERY_MARKDOWN = "# Gallery\n\n{{pyfolio-gallery}}"
+
+compression_enabled = True  # See setup_environment()
+is_environment_set_up = False  # Importing the app has no side effects, see setup_environment() and ensure_environment()
+background_tasks = []  # Threads of the builds setup_environment() started in the background
+_setup_lock = threading.Lock()
+
+TEMPLATES_BY_ASSET_TYPE = {"image": "image_page.jinja", "video": "video_page.jinja", "audio": "audio_page.jinja"}
 
 
 @app.route("/")
 def serve_home():
     # Special case for the home page, has a default if no custom page is found
-    if path_util.file_exists_relative("custom_pages/home.md"):
+    if custom_pages_index.get_snapshot().has_page("home"):
         app_logger.debug("app.server_home: Found home.md file. Serving custom home page.")
         return serve_custom_page("home")
     else:
         app_logger.warning("app.server_home: No home.md file found. Serving default.")
-        return custom_pages_util.render_custom_page_from_markdown_text(
-            "# Welcome to Pyfolio!\n\nThis is the default home page. You can customize it by creating a `home.md` file in the `custom_pages` folder.\n\n{{pyfolio-carousel}}"
+        return serve_cached_page(
+            ("default", "home", custom_pages_util.get_requested_gallery_page()),
+            TEXT_PAGE_DEPENDENCIES,
+            lambda: custom_pages_util.render_custom_page_from_markdown_text(DEFAULT_HOME_MARKDOWN, expand_carousel=False),
         )
 
 
 @app.route("/gallery")
 def serve_gallery():
     # Special case for the gallery page, has a default if no custom page is found
-    if path_util.file_exists_relative("custom_pages/gallery.md"):
+    if custom_pages_index.get_snapshot().has_page("gallery"):
         app_logger.debug("app.serve_gallery: Found gallery.md file. Serving custom gallery page.")
         return serve_custom_page("gallery")
     else:
         app_logger.info("app.serve_gallery: No gallery.md file found. Serving default.")
-        return custom_pages_util.render_custom_page_from_markdown_text("# Gallery\n\n{{pyfolio-gallery}}")
+        return serve_cached_page(
+            ("default", "gallery", custom_pages_util.get_requested_gallery_page()),
+            TEXT_PAGE_DEPENDENCIES,
+            lambda: custom_pages_util.render_custom_page_from_markdown_text(DEFAULT_GALLERY_MARKDOWN, expand_carousel=False),
+        )
 
 
 @app.route("/<path:page>")
 def serve_custom_page(page):
-    markdown_file = path_util.resolve_path(f"custom_pages/{page}.md")
-    app_logger.debug(f"Requesting custom page: {page}. Resolved markdown file path: {markdown_file}")
-    rendered_page = custom_pages_util.render_custom_page_from_markdown_file(markdown_file)
+    custom_page = custom_pages_index.get_snapshot().get_page(page)
+    if custom_page is None:
+        app_logger.warning("Custom page not found: %s.", page)
+        abort(404)
+    app_logger.debug("Requesting custom page: %s. Resolved markdown file path: %s", page, custom_page.path)
+    rendered_page = serve_cached_page(
+        ("custom", page, custom_pages_util.get_requested_gallery_page()),
+        [("page", page)] + TEXT_PAGE_DEPENDENCIES,
+        lambda: custom_pages_util.render_custom_page_from_markdown_file(custom_page.path, expand_carousel=False),
+    )
     if rendered_page is None:
-        app_logger.warning(f"Custom page not found: {page}.")
         abort(404)
     return rendered_page
 
 
+@app.route("/sitemap.xml")
+def serve_sitemap():
+    """Lists the URLs of the home, gallery, custom and portfolio element pages for search engines, see get_sitemap_entries()."""
+    base_url = config_manager.get_config().get("general", {}).get("site_url") or request.host_url
+    return serve_cached_page(
+        ("sitemap", base_url),
+        [("pages",), ("portfolio",), ("config",), ("template", "sitemap.jinja")],
+        lambda: render_sitemap(base_url, get_sitemap_entries()),
+        mimetype="application/xml",
+    )
+
+
+def get_sitemap_entries() -> list[tuple[str, float | None]]:
+    """
+    Returns the (path, modification time or None) of every page of the site, answered from the custom pages index and the portfolio
+    snapshot without touching the filesystem. Needs a request context.
+    """
+    pages_snapshot = custom_pages_index.get_snapshot()
+    home_page = pages_snapshot.get_page("home")
+    gallery_page = pages_snapshot.get_page("gallery")
+    entries = [
+        (url_for("serve_home"), home_page.get_mtime() if home_page else None),
+        (url_for("serve_gallery"), gallery_page.get_mtime() if gallery_page else None),
+    ]
+    # home.md and gallery.md are already listed under their special URLs
+    entries += [(url_for("serve_custom_page", page=page.name), page.get_mtime()) for page in pages_snapshot.get_pages() if page.name not in ("home", "gallery")]
+    entries += [(url_for("serve_portfolio", path=element.get_identifier()), None) for element in Portfolio.get_instance().get_elements()]
+    return entries
+
+
+def render_sitemap(base_url: str, entries: list[tuple[str, float | None]]) -> str:
+    """Renders sitemap.xml from (path, modification time or None) entries, the paths being relative to base_url."""
+    base_url = base_url.rstrip("/")
+    urls = [
+        (base_url + path, datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%d") if mtime is not None else None)
+        for path, mtime in entries
+    ]
+    return render_template("sitemap.jinja", urls=urls)
+
+
 @app.route("/portfolio/<path:path>")
 def serve_portfolio(path):
     if "." in path:
@@ -66,50 +150,431 @@ def serve_portfolio_file(path):
 
 def serve_portfolio_page(asset_identifier):
     """Render a single portfolio element's page."""
-    app_logger.debug(f"Requesting portfolio element's page: {asset_identifier}")
-    portfolio_element: PortfolioElement = Portfolio.get_instance().get_element_by_identifier(asset_identifier)
+    app_logger.debug("Requesting portfolio element's page: %s", asset_identifier)
+    portfolio_snapshot = Portfolio.get_instance().get_snapshot()  # Single snapshot so the neighbours are consistent
+    portfolio_element: PortfolioElement = portfolio_snapshot.get_element_by_identifier(asset_identifier)
 
     if portfolio_element is None:
         abort(404)
 
     asset_type = portfolio_element.get_asset_type()
+    template = get_template_for_asset_type(asset_type)
 
-    if asset_type == "image":
-        template = "image_page.jinja"
-    elif asset_type == "video":
-        template = "video_page.jinja"
-    elif asset_type == "audio":
-        template = "audio_page.jinja"
-    else:
-        template = "text_page.jinja"
+    app_logger.debug("Client requesting asset type: %s. Using template: %s", asset_type, template)
+
+    return serve_cached_page(
+        # The asset path rather than the identifier alone, renaming "clip.mp4" to "clip.webm" keeps the identifier and neighbours
+        ("portfolio", portfolio_element.get_absolute_asset_path()),
+        [
+            ("file", portfolio_element.get_caption_file_path()),
+            ("neighbours", asset_identifier),
+            ("config",),
+            ("fingerprints",),
+            ("image_metadata",),
+            ("template", "base.jinja"),
+            ("template", "base_asset_page.jinja"),
+            ("template", template),
+        ],
+        lambda: render_portfolio_page(portfolio_snapshot, portfolio_element),
+    )
+
+
+def render_portfolio_page(portfolio_snapshot, portfolio_element: PortfolioElement) -> str:
+    """Renders the page of a portfolio element, with links to its neighbours in the given snapshot. Needs a request context."""
+    portfolio_element.get_caption_html()  # Renders the caption if needed, so that its phases are not counted as template rendering
+    with metrics.time_phase("template_render"):
+        return render_template(
+            get_template_for_asset_type(portfolio_element.get_asset_type()),
+            portfolio_element=portfolio_element,
+            previous_element=portfolio_snapshot.get_element_before(portfolio_element),
+            next_element=portfolio_snapshot.get_element_after(portfolio_element),
+        )
+
+
+@app.route("/api/portfolio")
+def serve_portfolio_api():
+    """
+    Returns a page of portfolio elements metadata as JSON.
+    Query parameters: "limit" (defaults to the gallery page size), and either "offset" or "cursor", the identifier of the
+    last element of the previous page. Cursors keep paging stable when elements are added or removed in the meantime.
+    """
+    portfolio_snapshot = Portfolio.get_instance().get_snapshot()
+    try:
+        limit = int(request.args.get("limit", portfolio_api.get_page_size() or portfolio_api.MAX_LIMIT))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        abort(400)
+    if not 0 < limit <= portfolio_api.MAX_LIMIT or offset < 0:
+        abort(400)
+
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        cursor_element = portfolio_snapshot.get_element_by_identifier(cursor)
+        if cursor_element is None:
+            abort(404)
+        offset = portfolio_snapshot.get_element_position(cursor_element) + 1
 
-    app_logger.debug(f"Client requesting asset type: {asset_type}. Using template: {template}")
+    listing = portfolio_api.build_listing(portfolio_snapshot.get_elements(), offset, limit)
+    if listing["next_cursor"] is not None:
+        listing["next_url"] = url_for("serve_portfolio_api", cursor=listing["next_cursor"], limit=limit)
+    return jsonify(listing)
 
-    return render_template(
-        template,
-        portfolio_element=portfolio_element,
-        previous_element=Portfolio.get_instance().get_element_before(portfolio_element),
-        next_element=Portfolio.get_instance().get_element_after(portfolio_element),
+
+@app.route("/api/portfolio/page-<int:page_number>.json")
+def serve_portfolio_api_page(page_number):
+    """Returns a gallery page of portfolio elements metadata as JSON, these are also baked as static files."""
+    portfolio_snapshot = Portfolio.get_instance().get_snapshot()
+    if not 1 <= page_number <= portfolio_api.get_page_count(portfolio_snapshot.get_elements()):
+        abort(404)
+    return jsonify(portfolio_api.build_page_listing(portfolio_snapshot.get_elements(), page_number))
+
+
+@app.route("/api/portfolio/query")
+def serve_portfolio_query():
+    """
+    Returns the portfolio elements matching facet filters as JSON, see portfolio_index.py for the facets.
+    Query parameters: any of "tag", "type", "folder" and "date", repeatable, all of them must match, e.g. "?tag=night&type=image".
+    Also "offset" and "limit" as for /api/portfolio. Custom pages matching the filters are listed under "pages".
+    """
+    try:
+        limit = int(request.args.get("limit", portfolio_api.get_page_size() or portfolio_api.MAX_LIMIT))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        abort(400)
+    if not 0 < limit <= portfolio_api.MAX_LIMIT or offset < 0:
+        abort(400)
+
+    filters = {facet: request.args.getlist(facet) for facet in portfolio_index.FACETS if facet in request.args}
+    elements = portfolio_index.get_element_index().query(filters)
+    listing = portfolio_api.build_listing(elements, offset, limit)
+    listing["filters"] = filters
+    listing["pages"] = [
+        {"name": name, "title": title, "url": url_for("serve_custom_page", page=name)} for name, title in portfolio_index.get_page_index().query(filters)
+    ]
+    if listing["next_offset"] is not None:
+        listing["next_url"] = url_for("serve_portfolio_query", **filters, offset=listing["next_offset"], limit=limit)
+    return jsonify(listing)
+
+
+@app.route("/api/portfolio/facets")
+def serve_portfolio_facets():
+    """Returns every value of every facet with its number of elements and custom pages, e.g. to build a tag cloud."""
+    return jsonify(
+        {
+            "elements": portfolio_index.get_element_index().get_facet_counts(),
+            "pages": portfolio_index.get_page_index().get_facet_counts(),
+        }
     )
 
 
+def get_template_for_asset_type(asset_type: str) -> str:
+    """Returns the template used to render the page of an element of the given asset type."""
+    return TEMPLATES_BY_ASSET_TYPE.get(asset_type, "text_page.jinja")
+
+
+def serve_cached_page(cache_key, dependencies, render_function, mimetype: str = "text/html"):
+    """
+    Serves a page from the render cache, rendering it with render_function only if one of its dependencies changed.
+    Fully cached pages get a strong ETag so that repeat visitors receive a 304 Not Modified.
+    Returns None if the page could not be rendered.
+    """
+    cached_render = render_cache.get_render_cache().get_or_render(cache_key, dependencies, render_function)
+    if cached_render is None:
+        return None
+
+    if cached_render.has_deferred_tags:
+        # The page differs on every request (e.g. random carousel), so it cannot be validated with an ETag
+        return custom_pages_util.expand_carousel_tags(cached_render.html)
+
+    response = make_response(cached_render.html)
+    response.mimetype = mimetype
+    response.set_etag(cached_render.etag)
+    return response.make_conditional(request)
+
+
+@app.route("/theme.css")
+def serve_theme_css():
+    """Serve the stylesheet compiled from the [style] section of config.toml, cached forever when requested with its fingerprint."""
+    response = make_response(config_manager.get_theme_css())
+    response.content_type = "text/css; charset=utf-8"
+    response.cache_control.no_cache = True  # Like static files, unless requested with the fingerprint (see set_fingerprinted_cache_headers())
+    response.set_etag(config_manager.get_theme_fingerprint())
+    return response.make_conditional(request)
+
+
+@app.route("/thumbnails/<path:filename>")
+def serve_thumbnail(filename):
+    """Serve the generated thumbnails, their file names change with the content of the source image so they can be cached forever."""
+    response = send_from_directory(thumbnails.get_cache_directory(), filename, max_age=asset_fingerprints.IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route("/metrics")
+def serve_metrics():
+    """
+    Returns the request, cache and rendering metrics in the Prometheus text format, see metrics.py.
+    When disabled, and to clients outside the allowed addresses, this is the custom page named "metrics" if there is one.
+    """
+    if not metrics.is_enabled() or not metrics.is_allowed_address(request.remote_addr):
+        return serve_custom_page("metrics")
+    response = make_response(metrics.render())
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+@app.before_request
+def ensure_environment():
+    """
+    Sets the environment up if nothing did yet, e.g. when a WSGI server imports the app directly ("gunicorn app:app").
+    The entry points (app.py, serve.py, bake_website.py) set it up explicitly, before serving or baking anything.
+    """
+    if not is_environment_set_up:
+        with _setup_lock:
+            if not is_environment_set_up:
+                setup_environment()
+
+
+@app.route("/healthz")
+def serve_health():
+    """Liveness probe for load balancers and process supervisors: answers as long as the process handles requests."""
+    response = make_response("ok\n")
+    response.content_type = "text/plain; charset=utf-8"
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/readyz")
+def serve_readiness():
+    """
+    Readiness probe: the environment is set up and no startup build (captions, fingerprints, thumbnails) is still running in the background.
+    Service Unavailable until then, pages are served in the meantime but may be slower or miss their thumbnails.
+    """
+    pending_tasks = get_pending_background_tasks()
+    is_ready = is_environment_set_up and not pending_tasks
+    response = jsonify(ready=is_ready, pending_tasks=pending_tasks, portfolio_generation=Portfolio.get_instance().get_generation(), pid=os.getpid())
+    response.status_code = 200 if is_ready else 503
+    response.cache_control.no_store = True
+    return response
+
+
+def get_pending_background_tasks() -> list[str]:
+    """Returns the names of the startup builds still running in the background, e.g. ["thumbnail-build"]."""
+    return [thread.name for thread in background_tasks if thread.is_alive()]
+
+
+def wait_for_background_tasks():
+    """Blocks until the builds setup_environment() started in the background are done, e.g. before forking server workers."""
+    for thread in background_tasks:
+        thread.join()
+
+
+@app.before_request
+def start_request_timer():
+    if metrics.is_enabled():
+        g.request_start_time = time.perf_counter()
+
+
+@app.after_request
+def record_request_duration(response):
+    """Registered before the other after_request functions, so it runs last and times them too (e.g. compression)."""
+    start_time = g.get("request_start_time")
+    if start_time is not None:
+        metrics.observe_request(time.perf_counter() - start_time, request.endpoint or "unmatched", request.method, response.status_code)
+    return response
+
+
+def get_cache_request_counts() -> dict:
+    render_cache_instance = render_cache.get_render_cache()
+    compressed_body_cache = compression.get_compressed_body_cache()
+    return {
+        ("render", "hit"): render_cache_instance.hits,
+        ("render", "miss"): render_cache_instance.misses,
+        ("compressed_body", "hit"): compressed_body_cache.hits,
+        ("compressed_body", "miss"): compressed_body_cache.misses,
+    }
+
+
+def get_cache_entry_counts() -> dict:
+    return {("render",): len(render_cache.get_render_cache()), ("compressed_body",): len(compression.get_compressed_body_cache())}
+
+
+def get_scan_duration_seconds() -> float | None:
+    scan_result = Portfolio.get_instance().get_scan_result()
+    return scan_result.duration_seconds if scan_result is not None else None
+
+
+metrics.register_callback("cache_requests_total", "counter", "Cache lookups, by cache and result.", get_cache_request_counts, ("cache", "result"))
+metrics.register_callback("cache_entries", "gauge", "Entries held by each cache.", get_cache_entry_counts, ("cache",))
+metrics.register_callback("portfolio_elements", "gauge", "Elements in the portfolio.", lambda: len(Portfolio.get_instance().get_elements()))
+metrics.register_callback("portfolio_generation", "gauge", "Changes applied to the portfolio since startup.", lambda: Portfolio.get_instance().get_generation())
+metrics.register_callback("portfolio_scan_duration_seconds", "gauge", "Duration of the initial portfolio folder scan.", get_scan_duration_seconds)
+metrics.register_callback("custom_pages", "gauge", "Custom pages in the custom_pages folder.", lambda: len(custom_pages_index.get_snapshot().get_pages()))
+
+
+@app.url_defaults
+def add_url_fingerprint(endpoint, values):
+    """Appends the content fingerprint to the URLs of static files and portfolio assets, see asset_fingerprints.py."""
+    fingerprint = get_requested_file_fingerprint(endpoint, values)
+    if fingerprint is not None:
+        values.setdefault(asset_fingerprints.QUERY_PARAMETER, fingerprint)
+
+
+@app.after_request
+def set_fingerprinted_cache_headers(response):
+    """
+    Lets browsers cache static files and portfolio assets forever when they are requested with their current fingerprint.
+    Other requests of these files keep the default "no-cache", revalidated with their ETag and Last-Modified.
+    """
+    requested_fingerprint = request.args.get(asset_fingerprints.QUERY_PARAMETER)
+    if requested_fingerprint is None or response.status_code not in (200, 206, 304) or request.view_args is None:
+        return response
+    if requested_fingerprint == get_requested_file_fingerprint(request.endpoint, request.view_args):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = asset_fingerprints.IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compresses text responses according to the client's Accept-Encoding, see compression.py."""
+    if compression_enabled:
+        return compression.compress_response(request, response)
+    return response
+
+
+def get_requested_file_fingerprint(endpoint, values) -> str | None:
+    """Returns the fingerprint of the file targeted by a static, theme or portfolio asset URL, None for any other URL."""
+    if endpoint == "serve_theme_css":
+        return config_manager.get_theme_fingerprint()
+    if endpoint == "static":
+        return asset_fingerprints.get_static_fingerprint(values.get("filename", ""))
+    if endpoint == "serve_portfolio" and "." in values.get("path", ""):
+        return asset_fingerprints.get_asset_fingerprint(os.path.join(Portfolio.get_instance().get_scan_directory(), values["path"]))
+    return None
+
+
 def open_browser():
     webbrowser.open_new("http://127.0.0.1:5000/")
 
 
+def check_link_targets():
+    """Warns about the navbar and footer links pointing to custom pages that do not exist."""
+    pages_snapshot = custom_pages_index.get_snapshot()
+    config = config_manager.get_config()
+    for link_dict in config.get("top_link", []) + config.get("footer_link", []):
+        target = link_dict.get("target", "")
+        if "://" in target or target in ("/", "/gallery"):
+            continue
+        if not pages_snapshot.has_page(target):
+            app_logger.warning(f"Link [{link_dict.get('label')}] points to a missing custom page: custom_pages/{target}.md")
+
+
+def start_portfolio_watcher():
+    """Starts watching the portfolio folder for changes if enabled in config.toml. Forked server workers start their own, see serve.py."""
+    portfolio_config = config_manager.get_config().get("portfolio", {})
+    if portfolio_config.get("watch_for_changes", False):
+        portfolio_watcher.start_watching(
+            Portfolio.get_instance(),
+            poll_interval_seconds=portfolio_config.get("watch_poll_interval_seconds", portfolio_watcher.DEFAULT_POLL_INTERVAL_SECONDS),
+        )
+
+
+def reload_environment():
+    """
+    Reloads config.toml and scans the portfolio and custom pages folders again, e.g. on SIGHUP (see serve.py).
+    Requests keep being served from the previous state while the new one is built.
+    """
+    app_logger.info("Reloading environment...")
+    Portfolio.get_instance().rescan()
+    setup_environment()
+
+
 def setup_environment():
+    global compression_enabled, is_environment_set_up, background_tasks
     app_logger.debug("Loading configs.")
     config_manager.load_configs(app)
+    app_logger.configure(config_manager.get_config().get("logging", {}).get("level"))
+    metrics_config = config_manager.get_config().get("metrics", {})
+    metrics.configure(metrics_config.get("enabled", False), metrics_config.get("allowed_addresses", metrics.DEFAULT_ALLOWED_ADDRESSES))
+
+    cache_config = config_manager.get_config().get("cache", {})
+    render_cache.configure(cache_config.get("render_cache_max_entries", render_cache.DEFAULT_MAX_ENTRIES))
+    compression_enabled = cache_config.get("compress_responses", True)
+    compression.configure(int(cache_config.get("compressed_cache_max_mb", compression.DEFAULT_CACHE_MAX_BYTES // (1024 * 1024)) * 1024 * 1024))
+    # Compiled templates are loaded from disk rather than from source, and all loaded upfront so that forked workers inherit them
+    template_cache.configure(app.jinja_env, cache_config.get("template_bytecode_cache", True))
+    if cache_config.get("precompile_templates", True):
+        template_cache.precompile_templates(app.jinja_env)
+    # Before the portfolio is built, caption pre-rendering workers inherit the engine
+    markdown_engine.configure(config_manager.get_config().get("markdown", {}).get("engine", "python-markdown"))
+
+    # Pages are then checked for, linked and listed from memory, see custom_pages_index.py
+    custom_pages_index.refresh()
+    check_link_targets()
 
     app_logger.debug("Building portfolio structure.")
     Portfolio.get_instance()  # Not needed but it pre-generates the portfolio
+    portfolio_index.get_element_index()  # Same for the facet index, rebuilt on demand when the portfolio changes
+
+    started_tasks = []
+    portfolio_config = config_manager.get_config().get("portfolio", {})
+    prerender_captions_mode = portfolio_config.get("prerender_captions", "off")
+    if prerender_captions_mode not in caption_renderer.PRERENDER_MODES:
+        app_logger.error(f"Invalid prerender_captions value [{prerender_captions_mode}], expected one of {caption_renderer.PRERENDER_MODES}.")
+    elif prerender_captions_mode != "off":
+        started_tasks.append(
+            Portfolio.get_instance().prerender_captions(
+                in_background=prerender_captions_mode == "background",
+                max_workers=portfolio_config.get("caption_workers"),
+            )
+        )
+
+    start_portfolio_watcher()
+
+    fingerprint_mode = cache_config.get("fingerprint_urls", "background")
+    if fingerprint_mode not in asset_fingerprints.BUILD_MODES:
+        app_logger.error(f"Invalid fingerprint_urls value [{fingerprint_mode}], expected one of {asset_fingerprints.BUILD_MODES}.")
+    elif fingerprint_mode != "off":
+        asset_fingerprints.build_static_fingerprints(path_util.resolve_path("static"))
+        build_asset_fingerprints = (
+            asset_fingerprints.start_background_build if fingerprint_mode == "background" else asset_fingerprints.build_asset_fingerprints
+        )
+        started_tasks.append(build_asset_fingerprints(Portfolio.get_instance().get_elements()))
+
+    image_metadata_mode = portfolio_config.get("image_metadata", "background")
+    if image_metadata_mode not in image_metadata.BUILD_MODES:
+        app_logger.error(f"Invalid image_metadata value [{image_metadata_mode}], expected one of {image_metadata.BUILD_MODES}.")
+    elif image_metadata_mode != "off":
+        build_image_metadata = image_metadata.start_background_build if image_metadata_mode == "background" else image_metadata.build_image_metadata
+        started_tasks.append(build_image_metadata(Portfolio.get_instance().get_elements()))
+
+    thumbnails_config = config_manager.get_config().get("thumbnails", {})
+    thumbnails_build_mode = thumbnails_config.get("build", "background")
+    if thumbnails_build_mode not in thumbnails.BUILD_MODES:
+        app_logger.error(f"Invalid thumbnails build value [{thumbnails_build_mode}], expected one of {thumbnails.BUILD_MODES}.")
+    elif thumbnails_build_mode != "off":
+        build_thumbnails = thumbnails.start_background_build if thumbnails_build_mode == "background" else thumbnails.build_thumbnails
+        started_tasks.append(
+            build_thumbnails(
+                Portfolio.get_instance().get_elements(),
+                widths=thumbnails_config.get("widths", thumbnails.DEFAULT_WIDTHS),
+                quality=thumbnails_config.get("quality", thumbnails.DEFAULT_QUALITY),
+                max_workers=thumbnails_config.get("workers"),
+            )
+        )
 
+    # The synchronous builds return None, the background ones their thread
+    background_tasks = [thread for thread in started_tasks if thread is not None]
+    is_environment_set_up = True
 
-app_logger.info("Application starting. Setting up environment...")
-setup_environment()
 
 if __name__ == "__main__":
     app_logger.info("Application rnnning directly. Assuming local server.")
+    app_logger.info("Application starting. Setting up environment...")
+    setup_environment()
 
     # app_logger.warning("This is a local server. Schedule browser to open in 1 second.")
     # Timer(1, open_browser).start()  # Non-blocking delay before opening the page to let the server start, since the server itself is blocking
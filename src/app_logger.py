@@ -1,6 +1,20 @@
+"""
+This module provides the application's logger.
+
+Request threads never write to the log file or the console themselves: records are put on a queue by a QueueHandler,
+and a QueueListener thread formats and writes them. Messages can be given lazily as a %-style format string and its
+arguments, e.g. debug("Requesting page: %s", page), which are only formatted, on the listener thread, if the level is enabled.
+
+The level defaults to DEBUG, and can be set with "level" in the [logging] section of config.toml,
+or the PYFOLIO_LOG_LEVEL environment variable, which takes precedence.
+"""
+
+import atexit
 import datetime
 import logging
+import logging.handlers
 import os
+import queue
 
 from colorama import Back
 
@@ -15,10 +29,14 @@ except ImportError:
 import path_util
 
 __logger = None
+__listener = None
+__handlers = []
 
 LOG_TO_FILE = True
 LOG_TO_CONSOLE = True
 LOG_LEVEL = logging.DEBUG
+LOG_LEVEL_ENVIRONMENT_VARIABLE = "PYFOLIO_LOG_LEVEL"
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 
 
 class ColoredFormatter(logging.Formatter):
@@ -48,15 +66,25 @@ def get_logger():
     return __logger
 
 
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler for a listener of the same process: records are queued as they are, leaving all the formatting to the listener thread.
+    The default one formats the message beforehand so that records can be pickled to another process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
 def setup_logger():
-    """Sets up the custom logger and attaches handlers."""
-    global __logger
+    """Sets up the custom logger, its handlers and the listener thread writing their records."""
+    global __logger, __handlers
     if __logger is not None:
         return  # Prevent re-initializing the logger
 
     # Create a custom logger
     __logger = logging.getLogger("pyfolio")
-    __logger.setLevel(LOG_LEVEL)
+    __logger.setLevel(get_level_from_environment() or LOG_LEVEL)
     __logger.propagate = False  # Ensure logs do not propagate to the root logger
 
     # Create handlers
@@ -76,36 +104,106 @@ def setup_logger():
         console_handler.setFormatter(ColoredFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
         handlers.append(console_handler)
 
-    # Add handlers to the custom logger
-    for handler in handlers:
+    # The handlers are run by the listener thread, the logger only queues records
+    __handlers = handlers
+    _start_listener()
+    atexit.register(shutdown)
+
+
+def _start_listener():
+    global __listener
+    log_queue = queue.SimpleQueue()
+    __listener = logging.handlers.QueueListener(log_queue, *__handlers, respect_handler_level=True)
+    __listener.start()
+    for handler in list(__logger.handlers):
+        __logger.removeHandler(handler)
+    __logger.addHandler(_InProcessQueueHandler(log_queue))
+
+
+def shutdown():
+    """Stops the listener thread once it wrote every queued record."""
+    global __listener
+    if __listener is not None:
+        __listener.stop()
+        __listener = None
+
+
+def _log_synchronously_in_child():
+    """
+    Forked processes (e.g. process pool workers) do not inherit the listener thread, so their records would never leave the queue.
+    They write to the inherited handlers directly instead.
+    """
+    global __listener
+    if __logger is None:
+        return
+    __listener = None
+    for handler in list(__logger.handlers):
+        __logger.removeHandler(handler)
+    for handler in __handlers:
         __logger.addHandler(handler)
 
 
-def __log(level, message):
-    """Helper function to log a message at a specific level."""
-    get_logger().log(level, message)
+if hasattr(os, "register_at_fork"):  # POSIX only, spawned processes (e.g. on Windows) set their logger up from scratch
+    os.register_at_fork(after_in_child=_log_synchronously_in_child)
+
+
+def start_listener():
+    """
+    Starts a listener thread again in a forked process that keeps running, e.g. a server worker (see serve.py),
+    so that its request threads do not write records themselves either.
+    """
+    if __logger is not None and __listener is None:
+        _start_listener()
+
+
+def get_level_from_environment() -> int | None:
+    """Returns the level set by the environment variable, None if it is not set or invalid."""
+    level_name = os.environ.get(LOG_LEVEL_ENVIRONMENT_VARIABLE, "").upper()
+    return logging.getLevelName(level_name) if level_name in LOG_LEVELS else None
+
+
+def configure(level_name: str | None):
+    """Sets the level from the configuration, unless the environment variable overrides it."""
+    if os.environ.get(LOG_LEVEL_ENVIRONMENT_VARIABLE):
+        level_name = os.environ[LOG_LEVEL_ENVIRONMENT_VARIABLE]
+    if level_name is None:
+        return
+    if level_name.upper() not in LOG_LEVELS:
+        error("Invalid logging level [%s], expected one of %s.", level_name, LOG_LEVELS)
+        return
+    get_logger().setLevel(logging.getLevelName(level_name.upper()))
+
+
+def is_enabled_for(level: int) -> bool:
+    """Cheap check to guard the building of expensive log messages, e.g. is_enabled_for(logging.DEBUG)."""
+    return get_logger().isEnabledFor(level)
+
+
+def __log(level, message, args):
+    """Helper function to log a message at a specific level, formatted with its arguments only if the level is enabled."""
+    get_logger().log(level, message, *args)
 
 
-def debug(message):
+def debug(message, *args):
     """Logs a debug message."""
-    __log(logging.DEBUG, message)
+    __log(logging.DEBUG, message, args)
 
 
-def info(message):
+def info(message, *args):
     """Logs an info message."""
-    __log(logging.INFO, message)
+    __log(logging.INFO, message, args)
 
 
-def warning(message):
+def warning(message, *args):
     """Logs a warning message."""
-    __log(logging.WARNING, message)
+    __log(logging.WARNING, message, args)
 
 
-def error(message):
+def error(message, *args):
     """Logs an error message."""
-    __log(logging.ERROR, message)
+    __log(logging.ERROR, message, args)
 
 
-def critical(message):
+def critical(message, *args):
     """Logs a critical message."""
-    __log(logging.CRITICAL, message)
+    __log(logging.CRITICAL, message, args)
@@ -0,0 +1,209 @@
+"""
+This module computes content fingerprints of the static files and portfolio assets, appended to their URLs as "?v=<hash>".
+
+A fingerprinted URL changes whenever the file's content does, so responses to requests carrying the current fingerprint
+can be cached by browsers forever (see app.py), while plain URLs keep being revalidated with ETag and Last-Modified.
+Static files are few and small, they are hashed once at startup. Portfolio assets can be large (e.g. videos), their hashes
+are kept in a manifest keyed by mtime and size, so unchanged files are never read again, and computed in the background by default.
+Until an asset is hashed, and as soon as it is modified, its URL is simply plain.
+Assets added or modified while the server runs are hashed by the portfolio watcher (see Portfolio.apply_changes()).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app_logger
+import path_util
+
+MANIFEST_PATH = "cache/fingerprints.json"
+QUERY_PARAMETER = "v"
+IMMUTABLE_MAX_AGE = 31536000  # One year, the longest lifetime browsers honour
+BUILD_MODES = ["off", "startup", "background"]
+
+_static_fingerprints = {}  # path relative to the static folder, with "/" separators -> fingerprint
+_asset_fingerprints = {}  # absolute asset path -> (mtime_ns, size, fingerprint), replaced as a whole once a build completes
+_generation = 0  # Incremented every time the fingerprints change, lets caches of rendered pages pick up the new URLs
+_has_built_assets = False  # Whether build_asset_fingerprints() ran, fingerprint_urls may be "off"
+_is_changes_watched = False  # See set_changes_watched()
+_build_lock = threading.Lock()
+
+
+def get_static_fingerprint(filename: str) -> str | None:
+    """Returns the fingerprint of a file of the static folder, as passed to url_for("static", filename=...), or None."""
+    return _static_fingerprints.get(filename)
+
+
+def get_static_fingerprints() -> dict[str, str]:
+    """Returns the fingerprints of all the files of the static folder, by path relative to it."""
+    return _static_fingerprints
+
+
+def get_asset_fingerprint(absolute_asset_path: str) -> str | None:
+    """Returns the fingerprint of a portfolio asset, or None if it was not hashed yet or was modified since."""
+    entry = _asset_fingerprints.get(absolute_asset_path)
+    if entry is None:
+        return None
+    if _is_changes_watched:
+        return entry[2]
+    try:
+        stat_result = os.stat(absolute_asset_path)
+    except OSError:
+        return None
+    mtime_ns, size, fingerprint = entry
+    if stat_result.st_mtime_ns != mtime_ns or stat_result.st_size != size:
+        return None
+    return fingerprint
+
+
+def get_generation() -> int:
+    return _generation
+
+
+def set_changes_watched(is_watched: bool):
+    """
+    Set while the portfolio watcher reports every modified asset (with inotify) and they are hashed again right away,
+    lookups then skip checking whether the asset was modified.
+    """
+    global _is_changes_watched
+    _is_changes_watched = is_watched
+
+
+def build_static_fingerprints(static_folder: str):
+    """Hashes every file of the static folder."""
+    global _static_fingerprints, _generation
+    start_time = time.perf_counter()
+    fingerprints = {}
+    for directory, _, file_names in os.walk(static_folder):
+        for file_name in file_names:
+            file_path = os.path.join(directory, file_name)
+            fingerprints[os.path.relpath(file_path, static_folder).replace(os.sep, "/")] = _hash_file(file_path)
+    _static_fingerprints = fingerprints
+    _generation += 1
+    app_logger.info(f"Fingerprints: Hashed {len(fingerprints)} static files in {(time.perf_counter() - start_time) * 1000:.1f} ms.")
+
+
+def build_asset_fingerprints(elements, max_workers: int | None = None):
+    """
+    Makes sure every element has an up to date fingerprint, hashing the new and modified assets across a thread pool
+    (hashlib releases the GIL on large buffers, reading files is I/O bound).
+    """
+    global _asset_fingerprints, _generation, _has_built_assets
+
+    with _build_lock:
+        start_time = time.perf_counter()
+        manifest = _load_manifest()
+        fingerprints = {}
+        jobs = []
+        for element in elements:
+            asset_path = element.get_absolute_asset_path()
+            try:
+                stat_result = os.stat(asset_path)
+            except OSError:
+                continue
+            entry = manifest.get(asset_path)
+            if entry is not None and entry[0] == stat_result.st_mtime_ns and entry[1] == stat_result.st_size:
+                fingerprints[asset_path] = tuple(entry)
+            else:
+                jobs.append((asset_path, stat_result.st_mtime_ns, stat_result.st_size))
+
+        failed_count = 0
+        if jobs:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asset-fingerprint") as executor:
+                for (asset_path, mtime_ns, size), fingerprint in zip(jobs, executor.map(_hash_file_or_none, (job[0] for job in jobs))):
+                    if fingerprint is None:
+                        failed_count += 1
+                        continue
+                    fingerprints[asset_path] = (mtime_ns, size, fingerprint)
+
+        _save_manifest(fingerprints)
+        _asset_fingerprints = fingerprints
+        _generation += 1
+        _has_built_assets = True
+
+    app_logger.info(
+        f"Fingerprints: {len(fingerprints)} assets fingerprinted, {len(jobs) - failed_count} hashed, {failed_count} failed "
+        f"in {(time.perf_counter() - start_time) * 1000:.1f} ms."
+    )
+
+
+def start_background_build(elements, max_workers: int | None = None) -> threading.Thread:
+    """Runs build_asset_fingerprints() on a daemon thread, assets keep plain URLs in the meantime."""
+
+    def build():
+        try:
+            build_asset_fingerprints(elements, max_workers)
+        except Exception as e:
+            app_logger.error(f"Fingerprints: Background hashing failed: {e}")
+
+    thread = threading.Thread(target=build, name="asset-fingerprints", daemon=True)
+    thread.start()
+    return thread
+
+
+def update_asset_fingerprints(elements):
+    """
+    Hashes a few added or modified assets, e.g. reported by the portfolio watcher, without saving the manifest:
+    the next build hashes them again otherwise. Does nothing until a build has run, which will hash them anyway.
+    """
+    global _asset_fingerprints, _generation
+
+    with _build_lock:
+        if not _has_built_assets:
+            return
+        fingerprints = dict(_asset_fingerprints)
+        for element in elements:
+            asset_path = element.get_absolute_asset_path()
+            try:
+                stat_result = os.stat(asset_path)
+            except OSError:
+                continue
+            fingerprint = _hash_file_or_none(asset_path)
+            if fingerprint is None:
+                fingerprints.pop(asset_path, None)
+            else:
+                fingerprints[asset_path] = (stat_result.st_mtime_ns, stat_result.st_size, fingerprint)
+        _asset_fingerprints = fingerprints
+        _generation += 1
+
+
+def _hash_file(path: str) -> str:
+    file_hash = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _hash_file_or_none(path: str) -> str | None:
+    try:
+        return _hash_file(path)
+    except OSError as e:
+        app_logger.warning(f"Fingerprints: Could not hash [{path}]: {e}")
+        return None
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(path_util.resolve_path(MANIFEST_PATH), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        app_logger.warning(f"Fingerprints: Ignoring unreadable manifest, all assets will be hashed again: {e}")
+        return {}
+
+
+def _save_manifest(fingerprints: dict):
+    manifest_path = path_util.resolve_path(MANIFEST_PATH)
+    temporary_path = f"{manifest_path}.{os.getpid()}.tmp"  # Other processes (e.g. a bake) may save at the same time
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(fingerprints, file)
+        os.replace(temporary_path, manifest_path)
+    except OSError as e:
+        app_logger.warning(f"Fingerprints: Could not save the manifest [{manifest_path}]: {e}")
@@ -1,101 +1,593 @@
 """
 Launch the app from this module instead of app.py to instead bake the website into a static site.
+
+Bakes are incremental: a build manifest saved in the output folder records, for every output file, a hash of the inputs
+it was built from (markdown, caption, asset list, thumbnails, image dimensions, config, templates and the site's code).
+Outputs whose inputs did not change are neither rendered nor rewritten, and outputs whose sources vanished are deleted.
+
+Pages are rendered directly within request contexts of the app, one after the other, or across worker processes
+with "--jobs N", each worker writing the files it rendered.
+Text outputs finally get precompressed ".gz" and ".br" (if the Brotli package is installed) siblings.
 """
 
+import argparse
+import hashlib
+import json
 import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import app as main_app_module
+import asset_fingerprints
+import compression
+import custom_pages_index
+import image_metadata
+import thumbnails
 from portfolio import Portfolio
 
 OUTPUT_DIR = "bake_website_output"
+MANIFEST_FILE_NAME = ".bake_manifest.json"
+SITEMAP_FILE_NAME = "sitemap.xml"
+THEME_FILE_NAME = "theme.css"  # See config_manager.compile_theme_css()
+MANIFEST_VERSION = 1
+
+
+class BuildManifest:
+    """
+    Maps each output file (relative to OUTPUT_DIR) to the hash of its inputs and the hash of its content, as of the last bake.
+    Outputs that are not recorded again during a bake are considered stale and deleted by remove_stale_outputs().
+    """
+
+    def __init__(self, output_dir: str):
+        self._path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self._output_dir = output_dir
+        self._previous_outputs = self._load()
+        self._outputs = {}
+        self.rendered_count = 0
+        self.skipped_count = 0
+
+    def _load(self) -> dict:
+        try:
+            with open(self._path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            main_app_module.app_logger.warning(f"Bake: Ignoring unreadable build manifest, the whole site will be baked: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("outputs", {})
+
+    def is_up_to_date(self, internal_file_path: str, inputs_hash: str) -> bool:
+        """Returns True, and keeps the output, if it exists and was built from the same inputs."""
+        entry = self._previous_outputs.get(internal_file_path)
+        if entry is None or entry["inputs"] != inputs_hash or not os.path.isfile(os.path.join(self._output_dir, internal_file_path)):
+            return False
+        self._outputs[internal_file_path] = entry
+        self.skipped_count += 1
+        return True
+
+    def get_previous_output_hash(self, internal_file_path: str) -> str | None:
+        """Returns the hash of the content of an output as of the last bake, None if unknown."""
+        entry = self._previous_outputs.get(internal_file_path)
+        return entry["output"] if entry is not None else None
+
+    def record(self, internal_file_path: str, inputs_hash: str, output_hash: str | None = None):
+        """Records an output built from the given inputs, output_hash is None for files that are copied rather than rendered."""
+        self.rendered_count += 1
+        self._outputs[internal_file_path] = {"inputs": inputs_hash, "output": output_hash}
+
+    def get_recorded_outputs(self) -> list[tuple[str, dict]]:
+        """Returns the (internal_file_path, entry) pairs of the outputs recorded so far during this bake."""
+        return list(self._outputs.items())
+
+    def remove_stale_outputs(self) -> int:
+        """Deletes the outputs of the previous bake that were not produced by this one, returns how many were deleted."""
+        removed_count = 0
+        for internal_file_path in self._previous_outputs.keys() - self._outputs.keys():
+            try:
+                os.remove(os.path.join(self._output_dir, internal_file_path))
+                removed_count += 1
+            except FileNotFoundError:
+                pass
+        return removed_count
+
+    def save(self):
+        os.makedirs(self._output_dir, exist_ok=True)
+        with open(self._path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"version": MANIFEST_VERSION, "outputs": self._outputs}, file)
+        os.replace(self._path + ".tmp", self._path)
+
+
+def hash_inputs(*inputs) -> str:
+    """Returns a hash of the given inputs, which can be bytes, strings or None (e.g. a missing file)."""
+    inputs_hash = hashlib.blake2b(digest_size=16)
+    for value in inputs:
+        if value is None:
+            value = b"\x00missing"
+        elif isinstance(value, str):
+            value = value.encode("utf-8")
+        inputs_hash.update(len(value).to_bytes(8, "little"))  # Length prefix so that ("ab", "c") and ("a", "bc") differ
+        inputs_hash.update(value)
+    return inputs_hash.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """Returns the hash of a file's content, or of None if it does not exist."""
+    try:
+        with open(path, "rb") as file:
+            return hash_inputs(file.read())
+    except FileNotFoundError:
+        return hash_inputs(None)
+
+
+class SiteInputs:
+    """The hashes of the inputs shared by many outputs, computed once per bake."""
 
+    def __init__(self, snapshot):
+        templates_folder = main_app_module.path_util.resolve_path("templates")
+        self.templates = {name: hash_file(os.path.join(templates_folder, name)) for name in os.listdir(templates_folder)}
+        self.config = hash_file(main_app_module.path_util.resolve_path("config.toml"))
+        # Changes to the site's code (e.g. link fixing) must invalidate the outputs too
+        code_folder = main_app_module.path_util.resolve_path("")
+        self.code = hash_inputs(*(hash_file(os.path.join(code_folder, name)) for name in sorted(os.listdir(code_folder)) if name.endswith(".py")))
+        # Elements are hashed by path rather than identifier, renaming "a.jpg" to "a.jpeg" changes the asset URLs
+        self.assets = hash_inputs(*(element.get_path_relative_to_portfolio() + "\n" + element.get_asset_type() for element in snapshot.get_elements()))
+        self.images = hash_inputs(*(element.get_path_relative_to_portfolio() for element in snapshot.get_elements_by_asset_type("image")))
+        self.thumbnails = hash_inputs(
+            *(
+                f"{element.get_path_relative_to_portfolio()}:{thumbnail.content_hash}:{thumbnail.widths}"
+                for element in snapshot.get_elements()
+                if (thumbnail := thumbnails.get_thumbnail(element.get_absolute_asset_path())) is not None
+            )
+        )
+        self.image_metadata = hash_inputs(*(get_image_metadata_input(element) for element in snapshot.get_elements_by_asset_type("image")))
+        self.asset_fingerprints = hash_inputs(*(get_asset_fingerprint_input(element) for element in snapshot.get_elements()))
+        self.static_fingerprints = hash_inputs(*(f"{name}:{fingerprint}" for name, fingerprint in sorted(asset_fingerprints.get_static_fingerprints().items())))
 
-def bake_site():
+    def get_common_inputs(self, *template_names) -> list[str]:
+        """Returns the inputs every page depends on, plus the given templates."""
+        return [self.config, self.code, self.static_fingerprints] + [self.templates.get(name) for name in template_names]
+
+
+def get_asset_fingerprint_input(element) -> str:
+    return f"{element.get_path_relative_to_portfolio()}:{asset_fingerprints.get_asset_fingerprint(element.get_absolute_asset_path())}"
+
+
+def get_image_metadata_input(element) -> str:
+    metadata = element.get_image_metadata()
+    path = element.get_path_relative_to_portfolio()
+    return f"{path}:{metadata.width}x{metadata.height}" if metadata is not None else path
+
+
+class BakeJob:
+    """
+    An output to render: kind is "text" (a custom page), "listing" (a gallery page as JSON), "element" (a portfolio element page), "sitemap" or "theme",
+    arguments are the picklable kind-specific arguments of render_job().
+    """
+
+    __slots__ = ("kind", "internal_file_path", "inputs_hash", "previous_output_hash", "arguments")
+
+    def __init__(self, kind: str, internal_file_path: str, inputs_hash: str, previous_output_hash: str | None, arguments: tuple):
+        self.kind = kind
+        self.internal_file_path = internal_file_path
+        self.inputs_hash = inputs_hash
+        self.previous_output_hash = previous_output_hash
+        self.arguments = arguments
+
+
+def bake_site(jobs: int = 1):
     """
-    Generates static HTML files for the entire Flask app.
+    Generates static HTML files for the entire Flask app, only rendering the outputs whose inputs changed since the last bake.
+    With jobs > 1 the pages are rendered across that many worker processes, 0 meaning one per CPU.
     """
+    phase_durations = {}
+    phase_start_time = start_time = time.perf_counter()
+
+    def end_phase(name):
+        nonlocal phase_start_time
+        now = time.perf_counter()
+        phase_durations[name] = now - phase_start_time
+        phase_start_time = now
+
     main_app_module.setup_environment()
+    end_phase("setup")
+
+    # Thumbnails must all be ready before the gallery is rendered, waits for the app's background build if there is one
+    thumbnails_config = main_app_module.config_manager.get_config().get("thumbnails", {})
+    if thumbnails_config.get("build", "background") != "off":
+        thumbnails.build_thumbnails(
+            Portfolio.get_instance().get_elements(),
+            widths=thumbnails_config.get("widths", thumbnails.DEFAULT_WIDTHS),
+            quality=thumbnails_config.get("quality", thumbnails.DEFAULT_QUALITY),
+            max_workers=thumbnails_config.get("workers"),
+        )
+    # Same for the fingerprints of the asset URLs and the image dimensions
+    if main_app_module.config_manager.get_config().get("cache", {}).get("fingerprint_urls", "background") != "off":
+        asset_fingerprints.build_asset_fingerprints(Portfolio.get_instance().get_elements())
+    if main_app_module.config_manager.get_config().get("portfolio", {}).get("image_metadata", "background") != "off":
+        image_metadata.build_image_metadata(Portfolio.get_instance().get_elements())
+    end_phase("thumbnails")
+
+    snapshot = Portfolio.get_instance().get_snapshot()
+    manifest = BuildManifest(OUTPUT_DIR)
+    site_inputs = SiteInputs(snapshot)
+
+    # Copy the static folder, the portfolio folder and the generated thumbnails to the output directory
+    sync_folder(manifest, main_app_module.path_util.resolve_path("static"), "static")
+    sync_folder(manifest, main_app_module.path_util.resolve_path("portfolio"), "portfolio")
+    sync_folder(manifest, thumbnails.get_cache_directory(), "thumbnails", ignored_file_names={thumbnails.MANIFEST_FILE_NAME}, ignored_suffixes=(".tmp",))
+    end_phase("copy")
+
+    # List the site's pages whose inputs changed, which include home, gallery, all custom pages, and all portfolio elements pages
+    bake_jobs = []
+    pages_snapshot = custom_pages_index.get_snapshot()
+
+    # Special pages with defaults, the custom page of the same name replaces them
+    if not pages_snapshot.has_page("home"):
+        bake_jobs += plan_text_page(manifest, site_inputs, "/", "index.html", main_app_module.DEFAULT_HOME_MARKDOWN, None)
+    if not pages_snapshot.has_page("gallery"):
+        bake_jobs += plan_text_page(manifest, site_inputs, "/gallery", "gallery.html", main_app_module.DEFAULT_GALLERY_MARKDOWN, None)
+
+    for custom_page in pages_snapshot.get_pages():
+        with open(custom_page.path, "r", encoding="utf-8") as file:
+            markdown_text = file.read()
+        bake_jobs += plan_text_page(manifest, site_inputs, f"/{custom_page.name}", f"{custom_page.name}.html", markdown_text, custom_page.path)
+        if custom_page.name == "home":
+            bake_jobs += plan_text_page(manifest, site_inputs, "/", "index.html", markdown_text, custom_page.path)
 
+    # The stylesheet compiled from the [style] section of config.toml, linked by every page
+    inputs_hash = hash_inputs(main_app_module.config_manager.get_theme_css(), site_inputs.code)
+    if not manifest.is_up_to_date(THEME_FILE_NAME, inputs_hash):
+        bake_jobs.append(BakeJob("theme", THEME_FILE_NAME, inputs_hash, manifest.get_previous_output_hash(THEME_FILE_NAME), ()))
+
+    # A sitemap needs absolute URLs, so only when the site's URL is known
+    site_url = main_app_module.config_manager.get_config().get("general", {}).get("site_url")
+    if site_url:
+        inputs_hash = hash_inputs(
+            site_url,
+            *(f"{page.name}:{page.state[0]}" for page in pages_snapshot.get_pages()),
+            *(element.get_identifier() for element in snapshot.get_elements()),
+            *site_inputs.get_common_inputs("sitemap.jinja"),
+        )
+        if not manifest.is_up_to_date(SITEMAP_FILE_NAME, inputs_hash):
+            bake_jobs.append(BakeJob("sitemap", SITEMAP_FILE_NAME, inputs_hash, manifest.get_previous_output_hash(SITEMAP_FILE_NAME), (site_url,)))
+    else:
+        main_app_module.app_logger.info("Bake: No site_url in the [general] section of config.toml, skipping sitemap.xml.")
+
+    # Gallery pages as static JSON files, loaded by the gallery as the visitor scrolls
+    page_count = main_app_module.portfolio_api.get_page_count(snapshot.get_elements())
+    for page_number in range(1, page_count + 1):
+        internal_file_path = f"api/portfolio/page-{page_number}.json"
+        inputs_hash = hash_inputs(
+            site_inputs.assets,
+            site_inputs.thumbnails,
+            site_inputs.image_metadata,
+            site_inputs.asset_fingerprints,
+            str(page_number),
+            *site_inputs.get_common_inputs(),
+        )
+        if not manifest.is_up_to_date(internal_file_path, inputs_hash):
+            bake_jobs.append(BakeJob("listing", internal_file_path, inputs_hash, manifest.get_previous_output_hash(internal_file_path), (page_number,)))
+
+    element_jobs = []
+    for element in snapshot.get_elements():
+        internal_file_path = "portfolio/" + element.get_identifier() + ".html"
+        inputs_hash = get_element_page_inputs_hash(snapshot, site_inputs, element)
+        if not manifest.is_up_to_date(internal_file_path, inputs_hash):
+            element_jobs.append(BakeJob("element", internal_file_path, inputs_hash, manifest.get_previous_output_hash(internal_file_path), (element.get_identifier(),)))
+    bake_jobs += element_jobs
+    end_phase("plan")
+
+    # Render then save the pages
+    worker_count = (jobs or os.cpu_count() or 1) if len(bake_jobs) > 1 else 1
+    failed_count = 0
+    if worker_count > 1:
+        # Workers render their element's captions themselves. Forked workers inherit the portfolio, thumbnails and config already loaded,
+        # spawned ones (the default on Windows and macOS) set the app up again, see _initialize_worker()
+        chunk_size = max(1, len(bake_jobs) // (worker_count * 4))
+        with ProcessPoolExecutor(max_workers=worker_count, initializer=_initialize_worker) as executor:
+            for job, output_hash in zip(bake_jobs, executor.map(_render_job_in_worker, bake_jobs, chunksize=chunk_size)):
+                if output_hash is None:
+                    failed_count += 1
+                else:
+                    manifest.record(job.internal_file_path, job.inputs_hash, output_hash)
+    else:
+        # Only the element pages to render again need their caption, render those upfront in parallel rather than one page at a time
+        if element_jobs:
+            portfolio_config = main_app_module.config_manager.get_config().get("portfolio", {})
+            main_app_module.caption_renderer.prerender_captions(
+                [snapshot.get_element_by_identifier(job.arguments[0]) for job in element_jobs],
+                Portfolio.get_instance().get_scan_result().caption_paths,
+                max_workers=portfolio_config.get("caption_workers"),
+            )
+        for job in bake_jobs:
+            output_hash = render_job(job)
+            if output_hash is None:
+                failed_count += 1
+            else:
+                manifest.record(job.internal_file_path, job.inputs_hash, output_hash)
+    end_phase("render")
+
+    if main_app_module.config_manager.get_config().get("cache", {}).get("compress_responses", True):
+        compress_outputs(manifest, max_workers=jobs or None)
+    end_phase("compress")
+
+    removed_count = manifest.remove_stale_outputs()
+    manifest.save()
+    end_phase("cleanup")
+
+    main_app_module.app_logger.info(
+        f"Bake: {manifest.rendered_count} outputs built, {manifest.skipped_count} up to date, {failed_count} failed, "
+        f"{removed_count} stale outputs deleted in {(time.perf_counter() - start_time) * 1000:.1f} ms with {worker_count} worker(s)."
+    )
+    main_app_module.app_logger.info("Bake timings: " + ", ".join(f"{name} {duration * 1000:.1f} ms" for name, duration in phase_durations.items()))
+
+
+def render_job(job: BakeJob) -> str | None:
+    """
+    Renders an output within a request context of the app, then writes it unless the file already holds exactly that content.
+    Returns the hash of the output's content, or None if it could not be rendered.
+    """
     flask_app = main_app_module.app
+    try:
+        if job.kind == "text":
+            url, markdown_text, markdown_file_path, page_number, gallery_file_path = job.arguments
+            with flask_app.test_request_context(url, query_string={"page": page_number} if page_number > 1 else None):
+                rendered_page = main_app_module.custom_pages_util.render_custom_page_from_markdown_text(markdown_text, markdown_file_path)
+            content = process_page(rendered_page, job.internal_file_path, gallery_file_path) if rendered_page is not None else None
+        elif job.kind == "theme":
+            content = main_app_module.config_manager.get_theme_css()
+        elif job.kind == "sitemap":
+            (site_url,) = job.arguments
+            with flask_app.test_request_context("/sitemap.xml"):
+                entries = [(fix_sitemap_path(path), mtime) for path, mtime in main_app_module.get_sitemap_entries()]
+                content = main_app_module.render_sitemap(site_url, entries)
+        elif job.kind == "listing":
+            (page_number,) = job.arguments
+            with flask_app.test_request_context(f"/api/portfolio/page-{page_number}.json"):
+                listing = main_app_module.portfolio_api.build_page_listing(Portfolio.get_instance().get_elements(), page_number)
+            content = json.dumps(fix_listing_links(listing), sort_keys=True)
+        else:
+            (asset_identifier,) = job.arguments
+            snapshot = Portfolio.get_instance().get_snapshot()
+            with flask_app.test_request_context("/portfolio/" + asset_identifier):
+                rendered_page = main_app_module.render_portfolio_page(snapshot, snapshot.get_element_by_identifier(asset_identifier))
+            content = process_page(rendered_page, job.internal_file_path)
+    except Exception as e:
+        main_app_module.app_logger.error(f"Bake: Could not render [{job.internal_file_path}]: {e}")
+        return None
+
+    if content is None:
+        main_app_module.app_logger.error(f"Bake: Could not render [{job.internal_file_path}].")
+        return None
+    return write_output(job.internal_file_path, content, job.previous_output_hash)
+
+
+def _initialize_worker():
+    """
+    Process pool initializer. A worker started with spawn imports the app afresh, it sets it up and waits for its builds
+    (thumbnails, fingerprints, image metadata) like the bake did, reading them back from their caches. Forked workers are already set up.
+    """
+    if not main_app_module.is_environment_set_up:
+        main_app_module.setup_environment()
+        main_app_module.wait_for_background_tasks()
+
+
+def _render_job_in_worker(job: BakeJob) -> str | None:
+    """Process pool entry point, has to be a module level function to be picklable."""
+    return render_job(job)
+
+
+def compress_outputs(manifest, max_workers=None):
+    """
+    Writes a compressed sibling of every compressible output in each available encoding, e.g. "gallery.html.gz",
+    unless it is up to date with the content of its output. Files are compressed across a thread pool, zlib and brotli release the GIL.
+    """
+    compression_jobs = []
+    for internal_file_path, entry in manifest.get_recorded_outputs():
+        if not internal_file_path.endswith(compression.COMPRESSIBLE_EXTENSIONS):
+            continue
+        source_state = entry["output"] or entry["inputs"]  # Content hash of rendered outputs, mtime and size of copied files
+        for encoding in compression.get_available_encodings():
+            compressed_file_path = internal_file_path + compression.FILE_EXTENSIONS[encoding]
+            if not manifest.is_up_to_date(compressed_file_path, source_state):
+                compression_jobs.append((internal_file_path, compressed_file_path, encoding, source_state))
+
+    if not compression_jobs:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bake-compress") as executor:
+        for (_, compressed_file_path, _, source_state), is_written in zip(compression_jobs, executor.map(_compress_output, compression_jobs)):
+            if is_written:
+                manifest.record(compressed_file_path, source_state)
+
+
+def _compress_output(compression_job) -> bool:
+    """Writes the compressed sibling of an output, returns False if the output is too small or does not compress."""
+    internal_file_path, compressed_file_path, encoding, _ = compression_job
+    with open(get_absolute_Path_from_internal_path(internal_file_path), "rb") as file:
+        data = file.read()
+    if len(data) < compression.MINIMUM_SIZE:
+        return False
+    compressed_data = compression.compress(data, encoding, compression.BAKE_LEVELS[encoding])
+    if len(compressed_data) >= len(data):
+        return False
+    save_to_output_folder(compressed_file_path, compressed_data)
+    return True
+
+
+def write_output(internal_file_path, content, previous_output_hash) -> str:
+    """Writes an output unless it already exists with the same content (which leaves its mtime alone), returns the content's hash."""
+    content_bytes = content.encode("utf-8")
+    output_hash = hash_inputs(content_bytes)
+    if output_hash != previous_output_hash or not os.path.isfile(get_absolute_Path_from_internal_path(internal_file_path)):
+        save_to_output_folder(internal_file_path, content_bytes)
+    return output_hash
+
+
+def plan_text_page(manifest, site_inputs, url, file_path, markdown_text, markdown_file_path) -> list[BakeJob]:
+    """
+    Returns the jobs rendering a custom page whose inputs changed. If it contains a paginated gallery, every other gallery page
+    is rendered too, as "<name>-page-<number>.html" next to it.
+    """
+    custom_pages_util = main_app_module.custom_pages_util
+    inputs = [markdown_text] + site_inputs.get_common_inputs("base.jinja", "text_page.jinja")
+    page_count = 1
+    gallery_filters = custom_pages_util.get_gallery_filters_in_text(markdown_text)
+    if gallery_filters:
+        inputs += [
+            site_inputs.assets,
+            site_inputs.thumbnails,
+            site_inputs.image_metadata,
+            site_inputs.asset_fingerprints,
+            site_inputs.templates.get("gallery_component.jinja"),
+        ]
+        for filters in gallery_filters:
+            gallery_elements = custom_pages_util.get_gallery_elements(filters)
+            page_count = max(page_count, main_app_module.portfolio_api.get_page_count(gallery_elements))
+            if filters:
+                inputs += [element.get_path_relative_to_portfolio() for element in gallery_elements]  # Depends on the captions' frontmatter too
+    if custom_pages_util.CAROUSEL_TAG in markdown_text:
+        inputs += [
+            site_inputs.images,
+            site_inputs.thumbnails,
+            site_inputs.image_metadata,
+            site_inputs.asset_fingerprints,
+            site_inputs.templates.get("carousel_component.jinja"),
+        ]
+
+    jobs = []
+    for page_number in range(1, page_count + 1):
+        page_file_path = get_gallery_page_file_path(file_path, page_number)
+        inputs_hash = hash_inputs(*inputs, str(page_number))
+        if not manifest.is_up_to_date(page_file_path, inputs_hash):
+            arguments = (url, markdown_text, markdown_file_path, page_number, file_path)
+            jobs.append(BakeJob("text", page_file_path, inputs_hash, manifest.get_previous_output_hash(page_file_path), arguments))
+    return jobs
+
 
-    # copy the static folder to the output directory
-    import shutil
+def get_element_page_inputs_hash(snapshot, site_inputs, element) -> str:
+    """Returns the hash of everything an element's page is rendered from, see serve_portfolio_page() in app.py."""
+    previous_element = snapshot.get_element_before(element)
+    next_element = snapshot.get_element_after(element)
+    return hash_inputs(
+        element.get_path_relative_to_portfolio(),
+        element.get_asset_type(),
+        hash_file(element.get_caption_file_path()),
+        get_asset_fingerprint_input(element),
+        get_image_metadata_input(element),
+        previous_element.get_identifier() if previous_element else None,
+        next_element.get_identifier() if next_element else None,
+        *site_inputs.get_common_inputs("base.jinja", "base_asset_page.jinja", main_app_module.get_template_for_asset_type(element.get_asset_type())),
+    )
 
-    static_folder = main_app_module.path_util.resolve_path("static")
-    output_static_folder = get_absolute_Path_from_internal_path("static")
-    shutil.copytree(static_folder, output_static_folder, dirs_exist_ok=True)
 
-    # copy the portfolio folder to the output directory
-    portfolio_folder = main_app_module.path_util.resolve_path("portfolio")
-    output_portfolio_folder = get_absolute_Path_from_internal_path("portfolio")
-    shutil.copytree(portfolio_folder, output_portfolio_folder, dirs_exist_ok=True)
+def sync_folder(manifest, source_folder, internal_folder_path, ignored_file_names=frozenset(), ignored_suffixes=()):
+    """
+    Copy a folder to the output directory, skipping the files whose size and modification time did not change.
+    Files deleted from the source folder are deleted from the output directory along with the stale outputs.
+    """
+    if not os.path.isdir(source_folder):
+        return
+    for directory, _, file_names in os.walk(source_folder):
+        for file_name in file_names:
+            if file_name in ignored_file_names or file_name.endswith(ignored_suffixes):
+                continue
+            source_path = os.path.join(directory, file_name)
+            internal_file_path = os.path.join(internal_folder_path, os.path.relpath(source_path, source_folder))
+            stat_result = os.stat(source_path)
+            inputs_hash = f"{stat_result.st_mtime_ns}-{stat_result.st_size}"
+            if manifest.is_up_to_date(internal_file_path, inputs_hash):
+                continue
+            output_path = get_absolute_Path_from_internal_path(internal_file_path)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            shutil.copy2(source_path, output_path)  # Keeps the mtime, which makes the copy recognizable on the next bake
+            manifest.record(internal_file_path, inputs_hash)
 
-    # Render then save all of the site's pages, which include home, gallery, all custom pages, and all portfolio elements pages
-    # Special pages with defaults
-    with flask_app.test_client() as client:
-        home = client.get("/").data.decode("utf-8")
-        process_and_save_file("index.html", home)
-        gallery = client.get("/gallery").data.decode("utf-8")
-        process_and_save_file("gallery.html", gallery)
 
-    # Get all ".md" files in the custom_pages folder via os
-    md_files = [f for f in os.listdir(main_app_module.path_util.resolve_path("custom_pages")) if f.endswith(".md")]
+def get_gallery_page_file_path(file_path, page_number) -> str:
+    """e.g. ("gallery.html", 2) -> "gallery-page-2.html", page 1 being the page itself."""
+    if page_number == 1:
+        return file_path
+    return f"{os.path.splitext(file_path)[0]}-page-{page_number}.html"
 
-    for md_file in md_files:
-        with flask_app.test_client() as client:
-            page_name = md_file.split(".")[0]
-            custom_page = client.get(f"/{page_name}").data.decode("utf-8")
-            process_and_save_file(f"{page_name}.html", custom_page)
 
-    # Get all portfolio elements
-    portfolio_elements = Portfolio.get_instance().get_elements()
-    for element in portfolio_elements:
-        with flask_app.test_client() as client:
-            portfolio_element_page = client.get("portfolio/" + element.get_identifier()).data.decode("utf-8")
-            process_and_save_file("portfolio/" + element.get_identifier() + ".html", portfolio_element_page)
+# Every attribute holding URLs to fix, matched in a single pass over the page
+LINK_ATTRIBUTE_PATTERN = re.compile(r'(href|src|srcset|data-next-url)="([^"<>]*)"')
+GALLERY_PAGE_LINK_PATTERN = re.compile(r"\?page=(\d+)")
+BASE_TAG_PATTERN = re.compile(r'<base href="[^"<>]*">')
 
 
-def process_and_save_file(file_path, rendered_page):
+def process_page(rendered_page, internal_file_path, gallery_file_path=None) -> str:
     """
-    Fix links and other particularities, then save to the output folder.
+    Fix links and other particularities for the static site, in a single pass over the page.
+    Links are missing the relative path to the root of the site or the ".html" needed for static sites, srcset attributes list several URLs,
+    and gallery_file_path, the first page of the gallery when the page contains one, is where pagination links ("?page=2") point to.
+    Pages in subfolders (e.g. "travels/japan.html") link "../" once per level, or point their <base> (see base_asset_page.jinja) to the root.
     """
-    rendered_page_with_fixed_links = fix_relative_links(rendered_page)
-    save_to_output_folder(file_path, rendered_page_with_fixed_links)
+    page_base_name = os.path.basename(gallery_file_path) if gallery_file_path is not None else None
+    root_prefix = "../" * internal_file_path.count("/") or "./"
+    if BASE_TAG_PATTERN.search(rendered_page):
+        rendered_page = BASE_TAG_PATTERN.sub(f'<base href="{root_prefix}">', rendered_page, count=1)
+        root_prefix = "./"  # Links are then resolved against the root
 
+    def fix_link(match):
+        attribute, value = match.groups()
+        if attribute == "srcset":
+            fixed_value = fix_srcset(value, root_prefix)
+        elif attribute == "data-next-url" and "?" in value:
+            return ""  # Filtered galleries load their next pages from the query API, which a static site does not have
+        elif attribute == "href" and page_base_name is not None and (gallery_page_match := GALLERY_PAGE_LINK_PATTERN.fullmatch(value)):
+            fixed_value = "./" + get_gallery_page_file_path(page_base_name, int(gallery_page_match.group(1)))
+        else:
+            fixed_value = fix_relative_url(value, root_prefix)
+        return f'{attribute}="{fixed_value}"'
 
-def fix_relative_links(content) -> str:
+    return LINK_ATTRIBUTE_PATTERN.sub(fix_link, rendered_page)
+
+
+def fix_relative_url(url, root_prefix="./") -> str:
     """
-    Fix links that are missing the "./" or ".html" in the href or src attributes needed for static sites.
+    Fix a URL relative to the root of the site, e.g. "/portfolio/a" -> "./portfolio/a.html" and "/" -> "./index.html".
+    root_prefix is the path from the page to the root, e.g. "../" for "travels/japan.html".
+    Hash, query, already relative and external (any scheme, e.g. "mailto:") URLs are left alone.
     """
-    import re
+    if url == "/":
+        return root_prefix + "index.html"
+    if not url or ":" in url or url.startswith(("#", "?", ".")):
+        return url
+    path = url.lstrip("/")
+    if "." not in path.rsplit("/", 1)[-1]:
+        path += ".html"
+    return root_prefix + path
+
 
-    # Start by finding all relative links matches
-    matches = re.findall('((href|src)="([^\.\#\?"][^:"<>]*?)")', content, flags=re.MULTILINE)
+def fix_sitemap_path(path) -> str:
+    """Same as fix_relative_url, but keeping the path absolute for the sitemap, e.g. "/about" -> "/about.html" and "/" -> "/"."""
+    if path == "/":
+        return path
+    return fix_relative_url(path)[1:]
 
-    # Remove duplicates to not replace the same string multiple times
-    matches = list(set(matches))
 
-    content_with_fixed_links = content
+def fix_srcset(srcset, root_prefix="./") -> str:
+    """Same as fix_relative_url, for every URL of a srcset attribute, e.g. "/a-200.webp 200w, /a-400.webp 400w"."""
+    candidates = [candidate.strip().partition(" ") for candidate in srcset.split(",") if candidate.strip()]
+    return ", ".join(f"{fix_relative_url(url, root_prefix)} {descriptor}".strip() for url, _, descriptor in candidates)
 
-    for match in matches:
-        # if match has no extension, add .html
-        processed_match = match[0]
-        if match[2] == "/":
-            # Special case for home, aka index.html
-            processed_match = processed_match.replace('="/', '="./index.html')
-        if "." not in processed_match:
-            # add ".html" to the match before the closing quote
-            processed_match = processed_match[:-1] + '.html"'
-        # if match is relative, add "./"
-        if '="/' in processed_match:
-            # replace '="/' with '="./'
-            processed_match = processed_match.replace('="/', '="./')
-        # If the link is not a hash, query, or protocol, add "./"
-        if all(sub not in processed_match for sub in ['="#', '="?', '=".']):
-            processed_match = processed_match.replace('="', '="./')
-        # replace the match in the content
-        content_with_fixed_links = content_with_fixed_links.replace(match[0], processed_match)
 
-    return content_with_fixed_links
+def fix_listing_links(listing) -> dict:
+    """
+    Fix the URLs of a portfolio listing (see portfolio_api.py) for the static site.
+    """
+    for element in listing["elements"]:
+        for key in ("page_url", "asset_url", "thumbnail_url"):
+            element[key] = fix_relative_url(element[key])
+        element["thumbnail_srcset"] = fix_srcset(element["thumbnail_srcset"])
+    if listing["next_url"]:
+        listing["next_url"] = fix_relative_url(listing["next_url"])
+    return listing
 
 
 def save_to_output_folder(internal_file_path, content):
@@ -109,7 +601,9 @@ def save_to_output_folder(internal_file_path, content):
     internal_file_path = os.path.join(OUTPUT_DIR, internal_file_path)
     os.makedirs(os.path.dirname(internal_file_path), exist_ok=True)
 
-    with open(internal_file_path, "w", encoding="utf-8") as file:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    with open(internal_file_path, "wb") as file:
         file.write(content)
 
 
@@ -118,5 +612,8 @@ def get_absolute_Path_from_internal_path(internal_path):
 
 
 if __name__ == "__main__":
-    bake_site()
+    parser = argparse.ArgumentParser(description="Bake the website into a static site.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes rendering pages, 0 for one per CPU (default: 1)")
+    arguments = parser.parse_args()
+    bake_site(jobs=arguments.jobs)
     print("Site baked successfully!")
@@ -0,0 +1,125 @@
+"""
+Benchmarks the markdown rendering of markdown_engine.py against calling markdown.markdown() directly, as Pyfolio used to.
+
+Renders synthetic documents, small ones like captions and large ones like long custom pages, with every available backend
+and prints their throughput. Also checks that the pooled Python-Markdown instances render exactly what markdown.markdown() does.
+
+Usage: python benchmark_markdown.py [--page-size-kb 200] [--iterations 20]
+"""
+
+import argparse
+import random
+import time
+
+import markdown
+
+import markdown_engine
+
+WORDS = "the quick brown fox jumps over a lazy dog while light falls on old stone and water under grey skies".split()
+
+
+def generate_document(target_size: int, seed: int = 0) -> str:
+    """Generates a markdown document of about target_size characters mixing the usual syntax of captions and pages."""
+    random_generator = random.Random(seed)
+
+    def sentence() -> str:
+        words = random_generator.choices(WORDS, k=random_generator.randint(6, 16))
+        if random_generator.random() < 0.3:
+            words[random_generator.randrange(len(words))] = f"**{random_generator.choice(WORDS)}**"
+        if random_generator.random() < 0.2:
+            words[random_generator.randrange(len(words))] = f"[{random_generator.choice(WORDS)}](https://example.com/{random_generator.choice(WORDS)})"
+        if random_generator.random() < 0.2:
+            words[random_generator.randrange(len(words))] = f"`{random_generator.choice(WORDS)}`"
+        return " ".join(words).capitalize() + "."
+
+    blocks = []
+    size = 0
+    while size < target_size:
+        kind = random_generator.random()
+        if kind < 0.1:
+            block = "#" * random_generator.randint(1, 3) + " " + sentence()
+        elif kind < 0.25:
+            block = "\n".join(f"- {sentence()}" for _ in range(random_generator.randint(2, 6)))
+        elif kind < 0.3:
+            block = "\n".join(f"    {sentence()}" for _ in range(random_generator.randint(2, 4)))
+        elif kind < 0.35:
+            block = f"![{random_generator.choice(WORDS)}](/portfolio/{random_generator.choice(WORDS)}.jpg)"
+        else:
+            block = "\n".join(sentence() for _ in range(random_generator.randint(1, 4)))
+        blocks.append(block)
+        size += len(block) + 2
+    return "\n\n".join(blocks)
+
+
+def render_page_per_call(markdown_text: str) -> str:
+    """How custom pages were rendered before markdown_engine.py."""
+    return markdown.markdown(markdown_text.replace("\n\n", "<br>\n"), extensions=["nl2br"])
+
+
+def get_backends() -> dict:
+    backends = {
+        "markdown.markdown() per call": (markdown.markdown, render_page_per_call),
+        "python-markdown pooled": ("python-markdown", "python-markdown"),
+    }
+    if markdown_engine.MISTUNE_AVAILABLE:
+        backends["mistune"] = ("mistune", "mistune")
+    return backends
+
+
+def run_benchmark(documents: list[str], render, iterations: int) -> float:
+    """Returns the best time in seconds to render all the documents once, over the iterations."""
+    best_time = float("inf")
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        for document in documents:
+            render(document)
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time
+
+
+def get_renderer(backend, kind: str):
+    if not isinstance(backend, str):
+        return backend
+    markdown_engine.configure(backend)
+    return markdown_engine.render_caption if kind == "caption" else markdown_engine.render_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the markdown rendering backends.")
+    parser.add_argument("--caption-size", type=int, default=400, help="characters per synthetic caption (default: 400)")
+    parser.add_argument("--caption-count", type=int, default=500, help="captions rendered per iteration (default: 500)")
+    parser.add_argument("--page-size-kb", type=int, default=200, help="kilobytes per synthetic page (default: 200)")
+    parser.add_argument("--page-count", type=int, default=5, help="pages rendered per iteration (default: 5)")
+    parser.add_argument("--iterations", type=int, default=20, help="iterations, the best one is reported (default: 20)")
+    arguments = parser.parse_args()
+
+    workloads = {
+        "caption": [generate_document(arguments.caption_size, seed) for seed in range(arguments.caption_count)],
+        "page": [generate_document(arguments.page_size_kb * 1024, seed) for seed in range(arguments.page_count)],
+    }
+
+    markdown_engine.configure("python-markdown")
+    for document in workloads["caption"]:
+        assert markdown_engine.render_caption(document) == markdown.markdown(document), "Pooled caption output differs"
+    for document in workloads["page"]:
+        assert markdown_engine.render_page(document) == render_page_per_call(document), "Pooled page output differs"
+    print("Pooled Python-Markdown output is identical to markdown.markdown().")
+    if not markdown_engine.MISTUNE_AVAILABLE:
+        print("mistune is not installed, skipping it (pip install mistune).")
+
+    for kind, documents in workloads.items():
+        total_size = sum(len(document.encode("utf-8")) for document in documents)
+        print(f"\n{len(documents)} {kind}s of {total_size / len(documents) / 1024:.1f} KB, best of {arguments.iterations} iterations:")
+        reference_time = None
+        for name, (caption_backend, page_backend) in get_backends().items():
+            render = get_renderer(caption_backend if kind == "caption" else page_backend, kind)
+            elapsed_time = run_benchmark(documents, render, arguments.iterations)
+            reference_time = reference_time or elapsed_time
+            print(
+                f"  {name:<30} {elapsed_time / len(documents) * 1000:8.2f} ms/doc {len(documents) / elapsed_time:9.1f} docs/s "
+                f"{total_size / elapsed_time / (1024 * 1024):7.2f} MB/s  x{reference_time / elapsed_time:.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
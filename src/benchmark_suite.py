@@ -0,0 +1,332 @@
+"""
+Benchmarks Pyfolio end to end on synthetic portfolios, to catch regressions in scanning, rendering and baking.
+
+For each size, a site is generated in a temporary folder: assets of mixed types in nested folders, half of them with a
+caption, and custom pages including a large one and galleries. The site is then benchmarked in a fresh Python process
+per phase (the app loads its portfolio and configuration once per process), which time:
+- startup (importing the app and setup_environment), then a restart in a new process, reusing the scan snapshot,
+  the caption frontmatter cache and the compiled templates saved by the first start, and its first request
+- portfolio discovery (scan and element creation)
+- element lookups by identifier
+- the home, gallery, a large custom page and an element page rendered through the Flask app, with the render cache
+  cleared ("cold") and served from it ("warm")
+- a full bake, then an incremental bake with nothing to do
+
+Results are written as JSON, and compared against a previously saved baseline when one is given.
+
+Usage:
+    python benchmark_suite.py --sizes 100,1000,10000 --output results.json
+    python benchmark_suite.py --sizes 100,1000,10000 --baseline results.json  # Exits with 1 if a timing regressed
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import toml
+
+import benchmark_markdown
+
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_REGRESSION_THRESHOLD = 0.10  # Timings more than 10% slower than the baseline are reported as regressions
+LOOKUP_COUNT = 10000
+WARM_REQUEST_COUNT = 20
+LARGE_PAGE_SIZE = 256 * 1024
+TAGS = ["landscape", "night", "portrait", "city", "black and white", "travel", "street", "nature"]
+ASSET_KINDS = [(".png", 0.8), (".mp4", 0.1), (".mp3", 0.1)]  # Extension and share of the assets
+
+# A valid 1x1 PNG, so that image tools (e.g. thumbnails) can open the generated images
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+def generate_site(root: str, element_count: int, seed: int = 0):
+    """Generates a site folder with a portfolio of element_count assets, custom pages and a config.toml."""
+    random_generator = random.Random(seed)
+    source_folder = os.path.dirname(os.path.abspath(__file__))
+
+    portfolio_folder = os.path.join(root, "portfolio")
+    extensions, weights = zip(*ASSET_KINDS)
+    for index in range(element_count):
+        # 50 assets per folder, 10 folders per set, e.g. "set-3/group-7/item-3512.png"
+        folder = os.path.join(portfolio_folder, f"set-{index // 500}", f"group-{index // 50 % 10}")
+        if index % 50 == 0:
+            os.makedirs(folder, exist_ok=True)
+        extension = random_generator.choices(extensions, weights)[0]
+        with open(os.path.join(folder, f"item-{index}{extension}"), "wb") as file:
+            file.write(PNG_BYTES if extension == ".png" else random_generator.randbytes(512))
+        if index % 2 == 0:
+            with open(os.path.join(folder, f"item-{index}.md"), "w", encoding="utf-8") as file:
+                file.write(generate_caption(random_generator, index))
+
+    custom_pages_folder = os.path.join(root, "custom_pages")
+    os.makedirs(custom_pages_folder)
+    custom_pages = {
+        "home": "# Home\n\nWelcome to a synthetic portfolio.\n\n{{pyfolio-carousel}}",
+        "gallery": "# Gallery\n\n{{pyfolio-gallery}}",
+        "about": "---\ntitle: About\ntags: [about]\n---\n# About\n\n" + benchmark_markdown.generate_document(4 * 1024, seed),
+        "night": '---\ntitle: Night\ntags: [night]\n---\n# Night shots\n\n{{pyfolio-gallery tag="night" type=image}}',
+        "large": "---\ntitle: Large page\n---\n" + benchmark_markdown.generate_document(LARGE_PAGE_SIZE, seed),
+    }
+    for name, markdown_text in custom_pages.items():
+        with open(os.path.join(custom_pages_folder, name + ".md"), "w", encoding="utf-8") as file:
+            file.write(markdown_text)
+
+    # Templates and static files are the app's own
+    for folder_name in ("templates", "static"):
+        os.symlink(os.path.join(source_folder, folder_name), os.path.join(root, folder_name))
+
+    config = toml.load(os.path.join(source_folder, "config.toml"))
+    config.setdefault("general", {})["site_url"] = "https://example.com/"
+    config.setdefault("portfolio", {}).update(watch_for_changes=False, prerender_captions="off")
+    config.setdefault("thumbnails", {})["build"] = "off"  # Generating thumbnails would dominate every other timing
+    config.setdefault("cache", {})["fingerprint_urls"] = "startup"  # Deterministic, no background thread racing the benchmark
+    config.setdefault("logging", {})["level"] = "WARNING"
+    config["top_link"] = [{"label": "Home", "target": "[home]"}, {"label": "Gallery", "target": "[gallery]"}, {"label": "About", "target": "about.md"}]
+    config["footer_link"] = [{"label": "About", "target": "about.md"}]
+    with open(os.path.join(root, "config.toml"), "w", encoding="utf-8") as file:
+        toml.dump(config, file)
+
+    # Like an existing portfolio: folders modified just before a scan are listed again by the next one, see portfolio_scanner
+    one_day_ago = time.time() - 24 * 3600
+    for folder, _, _ in os.walk(portfolio_folder):
+        os.utime(folder, (one_day_ago, one_day_ago))
+
+
+def generate_caption(random_generator: random.Random, index: int) -> str:
+    tags = ", ".join(random_generator.sample(TAGS, k=random_generator.randint(1, 3)))
+    date = f"20{random_generator.randint(10, 24)}-{random_generator.randint(1, 12):02d}-{random_generator.randint(1, 28):02d}"
+    return f"---\ntags: [{tags}]\ndate: {date}\n---\n### Item {index}\n\n" + benchmark_markdown.generate_document(300, index)
+
+
+def run_worker(root: str, phase: str, repeat: int, jobs: int) -> dict:
+    """
+    Benchmarks a phase ("serve", "restart" or "bake") on the site at root, in the current process which must not have imported the app yet.
+    Returns the timings.
+    """
+    import path_util
+
+    path_util.PROJECT_ROOT = root  # Every site folder (portfolio, custom pages, config, caches) is resolved from there
+    os.chdir(root)  # The bake writes to a folder relative to the working directory
+
+    if phase == "bake":
+        results = run_bake_phase(jobs)
+    elif phase == "restart":
+        results = run_restart_phase()
+    else:
+        results = run_serve_phase(repeat)
+    if sys.platform != "win32":
+        import resource
+
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results[f"{phase}_max_rss_megabytes"] = max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return results
+
+
+def run_serve_phase(repeat: int) -> dict:
+    results = {}
+    start_time = time.perf_counter()
+    import app
+    import custom_pages_util
+    import render_cache
+    from portfolio import Portfolio
+
+    app.setup_environment()
+    results["startup_seconds"] = time.perf_counter() - start_time
+
+    portfolio = Portfolio.get_instance()
+    elements = portfolio.get_elements()
+    results["element_count"] = len(elements)
+    results["discovery_seconds"] = best_time(repeat, portfolio._discover_portfolio_elements)
+
+    random_generator = random.Random(0)
+    identifiers = [random_generator.choice(elements).get_identifier() for _ in range(LOOKUP_COUNT)]
+
+    def look_up_elements():
+        for identifier in identifiers:
+            portfolio.get_element_by_identifier(identifier)
+
+    results["lookup_seconds"] = best_time(repeat, look_up_elements) / LOOKUP_COUNT
+
+    client = app.app.test_client()
+    middle_element = elements[len(elements) // 2].get_identifier()
+    for name, url in (("home", "/"), ("gallery", "/gallery"), ("large_page", "/large"), ("element_page", f"/portfolio/{middle_element}")):
+
+        def request_cold():
+            render_cache.get_render_cache().clear()
+            custom_pages_util._gallery_fragment_cache = (None, {})
+            response = client.get(url)
+            assert response.status_code == 200, f"{url} returned {response.status_code}"
+
+        def request_warm():
+            for _ in range(WARM_REQUEST_COUNT):
+                client.get(url)
+
+        results[f"{name}_cold_seconds"] = best_time(repeat, request_cold)
+        results[f"{name}_warm_seconds"] = best_time(repeat, request_warm) / WARM_REQUEST_COUNT
+    return results
+
+
+def run_restart_phase() -> dict:
+    """
+    Times starting again on the same site, after the serve phase saved the scan snapshot, the caption frontmatter cache
+    and the compiled templates, then the first request of the new process.
+    """
+    results = {}
+    start_time = time.perf_counter()
+    import app
+
+    app.setup_environment()
+    results["restart_seconds"] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    response = app.app.test_client().get("/")
+    assert response.status_code == 200, f"/ returned {response.status_code}"
+    results["restart_first_request_seconds"] = time.perf_counter() - start_time
+    return results
+
+
+def run_bake_phase(jobs: int) -> dict:
+    """Times a full bake then an incremental one, the app's setup being part of the bake as with bake_website.py."""
+    import bake_website
+
+    results = {}
+    start_time = time.perf_counter()
+    bake_website.bake_site(jobs=jobs)
+    results["bake_seconds"] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    bake_website.bake_site(jobs=jobs)
+    results["bake_incremental_seconds"] = time.perf_counter() - start_time
+    return results
+
+
+def best_time(repeat: int, function) -> float:
+    """Returns the shortest of repeat runs of function, in seconds, the least disturbed by the rest of the machine."""
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+def run_size(element_count: int, repeat: int, bake: bool, jobs: int, keep: bool) -> dict:
+    """Generates a site of element_count assets and benchmarks it in a new process."""
+    root = tempfile.mkdtemp(prefix=f"pyfolio-benchmark-{element_count}-")
+    try:
+        start_time = time.perf_counter()
+        generate_site(root, element_count)
+        print(f"Generated {element_count} elements in [{root}] in {time.perf_counter() - start_time:.1f} s, benchmarking...", file=sys.stderr)
+
+        results = {}
+        result_file_path = os.path.join(root, "benchmark_results.json")  # Rather than stdout, which the app may print to
+        for phase in ("serve", "restart", "bake") if bake else ("serve", "restart"):
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", root, "--phase", phase, "--repeat", str(repeat), "--jobs", str(jobs)],
+                check=True,
+            )
+            with open(result_file_path, "r", encoding="utf-8") as file:
+                results.update(json.load(file))
+        return results
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints every timing next to its baseline, returns the descriptions of the regressions."""
+    regressions = []
+    for size, metrics in results["results"].items():
+        baseline_metrics = baseline["results"].get(size)
+        if baseline_metrics is None:
+            print(f"\n{size} elements: not in the baseline")
+            continue
+        print(f"\n{size} elements:")
+        for name, value in metrics.items():
+            baseline_value = baseline_metrics.get(name)
+            if not name.endswith(("_seconds", "_megabytes")) or not baseline_value:
+                continue
+            ratio = value / baseline_value
+            status = "REGRESSION" if ratio > 1 + threshold else ("improved" if ratio < 1 - threshold else "")
+            print(f"  {name:<28} {format_value(name, baseline_value):>12} -> {format_value(name, value):>12}  x{ratio:.2f} {status}")
+            if status == "REGRESSION":
+                regressions.append(f"{size} elements: {name} x{ratio:.2f}")
+    return regressions
+
+
+def print_results(results: dict):
+    for size, metrics in results["results"].items():
+        print(f"\n{size} elements:")
+        for name, value in metrics.items():
+            print(f"  {name:<28} {format_value(name, value):>12}")
+
+
+def format_value(name: str, value: float) -> str:
+    if name.endswith("_seconds"):
+        if value < 0.001:
+            return f"{value * 1e6:.3f} us"
+        return f"{value * 1000:.3f} ms" if value < 1 else f"{value:.2f} s"
+    if name.endswith("_megabytes"):
+        return f"{value:.1f} MB"
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Pyfolio on synthetic portfolios.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated element counts (default: 100,1000,10000)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each timing, the best one is kept (default: 5)")
+    parser.add_argument("--jobs", type=int, default=1, help="bake worker processes, as bake_website.py --jobs (default: 1)")
+    parser.add_argument("--skip-bake", action="store_true", help="do not time the bake, the slowest part on large sizes")
+    parser.add_argument("--output", help="JSON file to write the results to, e.g. to be used as a baseline later")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help="slowdown ratio reported as a regression (default: 0.1)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated sites instead of deleting them")
+    parser.add_argument("--worker", metavar="ROOT", help=argparse.SUPPRESS)  # Internal, benchmarks a phase on a generated site
+    parser.add_argument("--phase", choices=["serve", "restart", "bake"], default="serve", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.worker:
+        results = run_worker(arguments.worker, arguments.phase, arguments.repeat, arguments.jobs)
+        with open(os.path.join(arguments.worker, "benchmark_results.json"), "w", encoding="utf-8") as file:
+            json.dump(results, file)
+        return
+
+    results = {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": arguments.repeat,
+            "jobs": arguments.jobs,
+        },
+        "results": {},
+    }
+    for size in (int(size) for size in arguments.sizes.split(",")):
+        results["results"][str(size)] = run_size(size, arguments.repeat, not arguments.skip_bake, arguments.jobs, arguments.keep)
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare_with_baseline(results, baseline, arguments.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {arguments.threshold:.0%}:\n- " + "\n- ".join(regressions))
+            sys.exit(1)
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
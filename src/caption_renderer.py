@@ -0,0 +1,115 @@
+"""
+This module renders the markdown caption files of portfolio elements to HTML.
+
+Rendered captions are stored on their PortfolioElement along with the caption file's mtime and size, so that they are
+only rendered again when the file changes. Captions can also be pre-rendered in batch across a process pool, either
+while the portfolio is being built or in the background once the server started, so that requests only touch memory.
+
+NOTE: Kept free of Flask imports, it is imported by every process pool worker.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import app_logger
+import frontmatter_util
+import markdown_engine
+import metrics
+
+PRERENDER_MODES = ["off", "startup", "background"]
+
+
+class RenderedCaption:
+    """An immutable rendered caption, along with the (mtime_ns, size) state of the caption file it was rendered from."""
+
+    __slots__ = ("html", "file_state")
+
+    def __init__(self, html: str, file_state: tuple[int, int] | None):
+        self.html = html
+        self.file_state = file_state
+
+
+def get_caption_file_state(caption_file_path: str) -> tuple[int, int] | None:
+    """Returns the (mtime_ns, size) of a caption file, or None if there is no caption file."""
+    try:
+        stat_result = os.stat(caption_file_path)
+    except OSError:
+        return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+def read_caption_markdown(caption_file_path: str, default_title: str) -> str:
+    """Returns the content of the caption file if present, a heading with the default title otherwise."""
+    try:
+        with open(caption_file_path, "r", encoding="utf-8") as file:
+            return file.read()
+    except FileNotFoundError:
+        return "### " + default_title
+
+
+def render_caption(caption_file_path: str, default_title: str) -> RenderedCaption:
+    """Reads and renders a caption file to HTML, without its frontmatter (see portfolio_index.py)."""
+    file_state = get_caption_file_state(caption_file_path)
+    with metrics.time_phase("file_read"):
+        markdown_text = read_caption_markdown(caption_file_path, default_title)
+    with metrics.time_phase("frontmatter_parse"):
+        _, content = frontmatter_util.split_frontmatter(markdown_text)
+    with metrics.time_phase("markdown_conversion"):
+        html = markdown_engine.render_caption(content)
+    return RenderedCaption(html, file_state)
+
+
+def _initialize_worker(markdown_engine_name: str):
+    """Process pool initializer, workers started with spawn (the default on Windows and macOS) do not inherit the configured engine."""
+    markdown_engine.configure(markdown_engine_name)
+
+
+def _render_caption_in_worker(arguments: tuple[str, str]) -> RenderedCaption:
+    """Process pool entry point, has to be a module level function to be picklable."""
+    caption_file_path, default_title = arguments
+    return render_caption(caption_file_path, default_title)
+
+
+def prerender_captions(elements, caption_file_paths: set[str] | None = None, max_workers: int | None = None) -> int:
+    """
+    Renders the captions of the given PortfolioElements across a process pool and stores them on the elements.
+    caption_file_paths, when known (e.g. from the portfolio scan), avoids checking every element for a caption file.
+    Elements without a caption file are skipped, their default caption is only a heading and is rendered on demand.
+    Returns the number of caption files rendered.
+    """
+    start_time = time.perf_counter()
+
+    if caption_file_paths is None:
+        elements_with_caption = [element for element in elements if os.path.isfile(element.get_caption_file_path())]
+    else:
+        elements_with_caption = [element for element in elements if element.get_caption_file_path() in caption_file_paths]
+
+    if elements_with_caption:
+        worker_arguments = [(element.get_caption_file_path(), element.get_file_name_without_extension()) for element in elements_with_caption]
+        worker_count = max_workers or os.cpu_count() or 1
+        chunk_size = max(1, len(worker_arguments) // (worker_count * 4))  # Large chunks, captions are small and IPC is not
+        with ProcessPoolExecutor(max_workers=worker_count, initializer=_initialize_worker, initargs=(markdown_engine.get_engine(),)) as executor:
+            for element, rendered_caption in zip(elements_with_caption, executor.map(_render_caption_in_worker, worker_arguments, chunksize=chunk_size)):
+                element.store_rendered_caption(rendered_caption)
+
+    app_logger.info(
+        f"Captions: Pre-rendered {len(elements_with_caption)} caption files for {len(elements)} elements "
+        f"in {(time.perf_counter() - start_time) * 1000:.1f} ms."
+    )
+    return len(elements_with_caption)
+
+
+def start_background_prerender(elements, caption_file_paths: set[str] | None = None, max_workers: int | None = None) -> threading.Thread:
+    """Runs prerender_captions() on a daemon thread, elements requested in the meantime render their caption on demand."""
+
+    def prerender():
+        try:
+            prerender_captions(elements, caption_file_paths, max_workers)
+        except Exception as e:
+            app_logger.error(f"Captions: Background pre-rendering failed: {e}")
+
+    thread = threading.Thread(target=prerender, name="caption-prerender", daemon=True)
+    thread.start()
+    return thread
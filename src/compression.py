@@ -0,0 +1,145 @@
+"""
+This module compresses text responses (HTML, CSS, JS, SVG, JSON, XML) with gzip, and brotli when available.
+
+The live app negotiates the encoding with each client's Accept-Encoding header, and keeps compressed bodies in a bounded
+LRU cache keyed by a hash of the uncompressed body, so that a page or file is compressed once rather than on every request.
+The bake writes precompressed ".gz" and ".br" siblings next to its outputs instead, for web servers to serve as-is.
+
+Brotli requires the optional Brotli package, without it only gzip is used.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "image/svg+xml",
+}
+COMPRESSIBLE_EXTENSIONS = (".html", ".css", ".js", ".json", ".webmanifest", ".svg", ".xml")
+MINIMUM_SIZE = 512  # Smaller bodies barely shrink and are not worth the Content-Encoding
+FILE_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+DEFAULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Responses are compressed on the request path, once per body thanks to the cache, the bake has time for the best ratios
+LIVE_LEVELS = {"br": 5, "gzip": 6}
+BAKE_LEVELS = {"br": 11, "gzip": 9}
+
+
+def get_available_encodings() -> list[str]:
+    """Returns the supported encodings, best first."""
+    return ["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"]
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)  # mtime=0 keeps the output identical for identical input
+
+
+class CompressedBodyCache:
+    """
+    Thread-safe LRU cache of compressed bodies, bounded by their total size in bytes.
+    A max_bytes of 0 disables the cache, every call then compresses.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compress(self, data: bytes, encoding: str) -> bytes:
+        key = (hashlib.blake2b(data, digest_size=16).digest(), encoding)
+        with self._lock:
+            compressed_data = self._entries.get(key)
+            if compressed_data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed_data
+        self.misses += 1
+
+        compressed_data = compress(data, encoding, LIVE_LEVELS[encoding])
+        if 0 < len(compressed_data) <= self._max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = compressed_data
+                    self._size += len(compressed_data)
+                while self._size > self._max_bytes:
+                    _, evicted_data = self._entries.popitem(last=False)
+                    self._size -= len(evicted_data)
+        return compressed_data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_compressed_body_cache = CompressedBodyCache()
+
+
+def get_compressed_body_cache() -> CompressedBodyCache:
+    return _compressed_body_cache
+
+
+def configure(max_bytes: int):
+    """Replaces the compressed body cache with an empty one of the given size, 0 disables caching."""
+    global _compressed_body_cache
+    _compressed_body_cache = CompressedBodyCache(max_bytes)
+
+
+def compress_response(request, response):
+    """
+    Compresses a Flask response in place with the best encoding the client accepts, if it is worth it.
+    File responses (e.g. static CSS and JS) are read into memory to be compressed, other streamed responses are left alone.
+    Only bodies with an ETag are cached. The ETag is made weak since the bytes sent differ from the identity representation
+    it was computed for, conditional requests still match it.
+    """
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+
+    if response.status_code != 200 or "Content-Encoding" in response.headers or (response.is_streamed and not response.direct_passthrough):
+        return response
+    encoding = request.accept_encodings.best_match(get_available_encodings())
+    if encoding is None:
+        return response
+
+    response.direct_passthrough = False  # Lets get_data() read send_file responses
+    data = response.get_data()
+    if len(data) < MINIMUM_SIZE:
+        return response
+    etag, is_weak = response.get_etag()
+    if etag is None:
+        # Without an ETag the body is likely different on every request (e.g. a random carousel), caching it would only evict the others
+        compressed_data = compress(data, encoding, LIVE_LEVELS[encoding])
+    else:
+        compressed_data = _compressed_body_cache.get_or_compress(data, encoding)
+    if len(compressed_data) >= len(data):
+        return response
+
+    response.set_data(compressed_data)
+    response.headers["Content-Encoding"] = encoding
+    if etag is not None and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response
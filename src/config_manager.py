@@ -1,8 +1,10 @@
 """
 This module reads the TOML configuration file and provides the configuration to the application.
-It also injects relevant configuration into the Jinja2 templates.
+It also injects relevant configuration into the Jinja2 templates, and compiles the [style] section into the theme stylesheet.
 """
 
+import hashlib
+
 from flask import Flask, url_for
 import toml
 
@@ -10,6 +12,9 @@ import app_logger
 import path_util
 
 _config_dict = None
+_config_generation = 0  # Incremented on every load, lets caches detect configuration changes
+_theme_css = ""
+_theme_fingerprint = None
 
 
 def load_configs(app: Flask):
@@ -23,6 +28,9 @@ def load_configs(app: Flask):
             _config_dict = toml.load(config_file)
             resolve_config_link_targets()
             parse_style_configs()
+            compile_theme_css()
+            global _config_generation
+            _config_generation += 1
     except FileNotFoundError:
         raise FileNotFoundError(f"Configuration file not found at path: {config_path}")
     except toml.TomlDecodeError as e:
@@ -30,13 +38,16 @@ def load_configs(app: Flask):
     except Exception as e:
         raise e
 
-    # NOTE: Has to be inside the function because of temporal coupling with the app context having to be instantiated
-    @app.context_processor
-    def inject_config():
-        """
-        Injects the configuration into the Jinja2 templates.
-        """
-        return dict(config=_config_dict)
+    # NOTE: Registered once only, as the configuration can be reloaded after the app served requests (see app.reload_environment())
+    if inject_config not in app.template_context_processors[None]:
+        app.context_processor(inject_config)
+
+
+def inject_config():
+    """
+    Injects the configuration into the Jinja2 templates.
+    """
+    return dict(config=_config_dict)
 
 
 def get_config():
@@ -46,6 +57,13 @@ def get_config():
     return _config_dict
 
 
+def get_config_generation() -> int:
+    """
+    Returns a counter incremented every time the configuration is loaded.
+    """
+    return _config_generation
+
+
 def parse_style_configs():
     """
     Parses the style configurations from the configuration dictionary to make it adequate for the Jinja2 templates and/or add extra behaviors
@@ -56,13 +74,34 @@ def parse_style_configs():
         # Make None all empty strings or values of "default" as they are explicit "non-overrides"
         for key, value in _config_dict["style"].items():
             if value == "" or value == "default":
-                _config_dict["style"] = None
+                _config_dict["style"][key] = None
     except KeyError:
         app_logger.warning("No style configuration found in the configuration file. All deleted/disabled?")
         # create an empty style configuration dictionary
         _config_dict["style"] = {}
 
 
+def compile_theme_css():
+    """
+    Compiles the style configurations into the theme stylesheet, CSS variables overriding the defaults of static/css/styles.css,
+    e.g. accent_color = "#252a2b" -> --accent-color: #252a2b;
+    Pages link it rather than inlining it, with the fingerprint of its content so that browsers cache it until the style changes (see app.py).
+    """
+    global _theme_css, _theme_fingerprint
+    declarations = [f"  --{key.replace('_', '-')}: {value};" for key, value in _config_dict["style"].items() if value is not None]
+    _theme_css = ":root {\n" + "\n".join(declarations) + "\n}\n"
+    _theme_fingerprint = hashlib.blake2b(_theme_css.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def get_theme_css() -> str:
+    return _theme_css
+
+
+def get_theme_fingerprint() -> str | None:
+    """Returns the fingerprint of the theme stylesheet, None until the configuration is loaded."""
+    return _theme_fingerprint
+
+
 def resolve_config_link_targets():
     """
     Resolves the link targets in the configuration to the correct URL (e.g. relative and special targets)
@@ -0,0 +1,176 @@
+"""
+This module keeps an in-memory index of the custom pages, the markdown files of the custom_pages folder and its subfolders.
+
+Only the frontmatter header of each page is read, for its title and facets (see portfolio_index.py), along with its mtime and size.
+Requests then check that a page exists, link to it or list it (e.g. in sitemap.xml) without touching the filesystem,
+and the bake enumerates the pages from the same index.
+
+The index is built at startup (see app.setup_environment()). Afterwards, the folder is checked for added, removed and modified pages
+at most once every REVALIDATE_INTERVAL_SECONDS, with a single directory scan on a background thread, and only the headers of
+new or modified pages are read again. Requests are answered from the current snapshot meanwhile, they never touch the filesystem.
+
+NOTE: Kept free of Flask imports, like frontmatter_util.py.
+"""
+
+import os
+import threading
+import time
+
+import app_logger
+import frontmatter_util
+import path_util
+
+CUSTOM_PAGES_FOLDER = "custom_pages"
+MARKDOWN_EXTENSION = ".md"
+REVALIDATE_INTERVAL_SECONDS = 1.0
+
+_snapshot = None
+_last_validation_time = 0.0
+_refresh_lock = threading.Lock()
+
+
+class CustomPage:
+    """The metadata of a custom page. The name is its path relative to the custom_pages folder, without extension, e.g. "about"."""
+
+    __slots__ = ("name", "path", "title", "frontmatter", "state")
+
+    def __init__(self, name: str, path: str, frontmatter: dict[str, str], state: tuple[int, int]):
+        self.name = name
+        self.path = path
+        self.title = frontmatter.get("title") or get_default_title(name)
+        self.frontmatter = frontmatter
+        self.state = state  # (mtime_ns, size) of the markdown file
+
+    def get_mtime(self) -> float:
+        return self.state[0] / 1e9
+
+
+class CustomPagesSnapshot:
+    """An immutable view of the custom pages, replaced as a whole whenever a page is added, removed or modified."""
+
+    __slots__ = ("_pages", "_pages_by_name", "_generation")
+
+    def __init__(self, pages: list[CustomPage], generation: int = 0):
+        self._pages = tuple(sorted(pages, key=lambda page: page.name))
+        self._pages_by_name = {page.name: page for page in self._pages}
+        self._generation = generation
+
+    def get_generation(self) -> int:
+        """Returns a counter incremented every time a custom page is added, removed or modified."""
+        return self._generation
+
+    def get_pages(self) -> tuple[CustomPage, ...]:
+        """Returns the custom pages, sorted by name."""
+        return self._pages
+
+    def get_page(self, name: str) -> CustomPage | None:
+        return self._pages_by_name.get(name)
+
+    def has_page(self, name: str) -> bool:
+        return name in self._pages_by_name
+
+
+def get_default_title(name: str) -> str:
+    """Returns the title of a page without one in its frontmatter, e.g. "travels/my_trip" -> "My Trip"."""
+    return name.rsplit("/", 1)[-1].replace("_", " ").title()
+
+
+def get_snapshot() -> CustomPagesSnapshot:
+    """
+    Returns the current custom pages. If the folder was not checked recently, a background thread checks it for changes,
+    the next calls then get the new snapshot. Only the very first call, when nothing set the index up, scans the folder itself.
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        return refresh()
+    if time.monotonic() - _last_validation_time >= REVALIDATE_INTERVAL_SECONDS and _refresh_lock.acquire(blocking=False):
+        threading.Thread(target=_refresh_in_background, name="custom-pages-refresh", daemon=True).start()
+    return snapshot
+
+
+def refresh() -> CustomPagesSnapshot:
+    """Checks the custom_pages folder for changes now, unless another thread just did, and returns the up to date snapshot."""
+    requested_time = time.monotonic()
+    with _refresh_lock:
+        if _snapshot is not None and _last_validation_time >= requested_time:
+            return _snapshot  # Checked by another thread while this one waited for the lock
+        return _refresh_locked()
+
+
+def _refresh_in_background():
+    """Checks the folder for changes with the refresh lock already acquired by get_snapshot(), and releases it."""
+    try:
+        _refresh_locked()
+    except Exception as e:
+        app_logger.error(f"Custom pages: Could not check the folder for changes: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def _reset_refresh_lock():
+    """A process forked during a background check would inherit the lock held forever."""
+    global _refresh_lock
+    _refresh_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_refresh_lock)
+
+
+def _refresh_locked() -> CustomPagesSnapshot:
+    """Scans the folder, the refresh lock being held, and swaps in a new snapshot if any page changed."""
+    global _snapshot, _last_validation_time
+    validation_time = time.monotonic()  # Changes made after the scan started are picked up by the next one
+    start_time = time.perf_counter()
+    previous_snapshot = _snapshot
+    folder = path_util.resolve_path(CUSTOM_PAGES_FOLDER)
+    pages = []
+    read_count = 0
+    for name, path, state in _scan_folder(folder):
+        previous_page = previous_snapshot.get_page(name) if previous_snapshot is not None else None
+        if previous_page is not None and previous_page.state == state:
+            pages.append(previous_page)
+            continue
+        pages.append(CustomPage(name, path, _read_frontmatter(path), state))
+        read_count += 1
+
+    is_unchanged = previous_snapshot is not None and read_count == 0 and len(pages) == len(previous_snapshot.get_pages())
+    if not is_unchanged:
+        generation = previous_snapshot.get_generation() + 1 if previous_snapshot is not None else 0
+        _snapshot = CustomPagesSnapshot(pages, generation)
+        app_logger.info(
+            f"Custom pages: Indexed {len(pages)} pages ({read_count} headers read) "
+            f"in {(time.perf_counter() - start_time) * 1000:.1f} ms (generation {generation})."
+        )
+    _last_validation_time = validation_time
+    return _snapshot
+
+
+def _scan_folder(folder: str):
+    """Yields the (name, path, (mtime_ns, size)) of every markdown file of the folder and its subfolders."""
+    pending_folders = [(folder, "")]
+    while pending_folders:
+        current_folder, name_prefix = pending_folders.pop()
+        try:
+            with os.scandir(current_folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        pending_folders.append((entry.path, name_prefix + entry.name + "/"))
+                    elif entry.name.endswith(MARKDOWN_EXTENSION) and entry.is_file():
+                        try:
+                            stat_result = entry.stat()
+                        except OSError:
+                            continue  # Removed in the meantime
+                        name = name_prefix + entry.name[: -len(MARKDOWN_EXTENSION)]
+                        yield name, entry.path, (stat_result.st_mtime_ns, stat_result.st_size)
+        except OSError as e:
+            if current_folder == folder and not isinstance(e, FileNotFoundError):
+                app_logger.warning(f"Custom pages: Could not list [{current_folder}]: {e}")
+
+
+def _read_frontmatter(path: str) -> dict[str, str]:
+    try:
+        return frontmatter_util.read_frontmatter(path)
+    except (OSError, UnicodeDecodeError) as e:
+        app_logger.warning(f"Custom pages: Could not read the frontmatter of [{path}]: {e}")
+        return {}
@@ -3,29 +3,42 @@ This module contains helper functions for rendering custom pages and processing
 """
 
 import random
-from flask import render_template
-import markdown
-import markdown.postprocessors
+import re
+from flask import render_template, request, url_for
 
 import app_logger
+import asset_fingerprints
 import config_manager
+import frontmatter_util
+import image_metadata
+import markdown_engine
+import metrics
+import portfolio_api
+import portfolio_index
+import render_cache
+import thumbnails
 from portfolio import Portfolio
 
 CAROUSEL_TAG = "{{pyfolio-carousel}}"
 GALLERY_TAG = "{{pyfolio-gallery}}"
+# The gallery tag optionally filters the elements by facet (see portfolio_index.py), e.g. {{pyfolio-gallery tag="black and white" type=image}}
+GALLERY_TAG_PATTERN = re.compile(r'\{\{pyfolio-gallery((?:\s+\w+=(?:"[^"]*"|[^\s"}]+))*)\s*\}\}')
+GALLERY_FILTER_PATTERN = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s"}]+))')
 
+_gallery_fragment_cache = (None, {})  # (cache key, {(filters, page number): rendered fragment}), see render_gallery_fragment()
 
-def render_custom_page_from_markdown_file(path_to_markdown_file: str):
+
+def render_custom_page_from_markdown_file(path_to_markdown_file: str, expand_carousel: bool = True):
     """
     Processes a markdown file and returns the rendered HTML content to be injected into custom pages.
     Also replaces custom tags found in the markdown with the appropriate content, e.g. {{pyfolio-carousel}} or {{pyfolio-gallery}}.
     Returns None if the file is not found or an error occurs during processing.
     """
     try:
-        with open(path_to_markdown_file, "r", encoding="utf-8") as file:
+        with metrics.time_phase("file_read"), open(path_to_markdown_file, "r", encoding="utf-8") as file:
             markdown_text = file.read()
 
-        return render_custom_page_from_markdown_text(markdown_text, path_to_markdown_file)
+        return render_custom_page_from_markdown_text(markdown_text, path_to_markdown_file, expand_carousel)
     except FileNotFoundError:
         app_logger.error(f"Markdown file not found: {path_to_markdown_file}")
         return None
@@ -34,15 +47,21 @@ def render_custom_page_from_markdown_file(path_to_markdown_file: str):
         return None
 
 
-def render_custom_page_from_markdown_text(markdown_text: str, source_file_path: str | None = None):
+def render_custom_page_from_markdown_text(markdown_text: str, source_file_path: str | None = None, expand_carousel: bool = True):
     """
     Processes a markdown text and returns the rendered HTML content to be injected into custom pages.
     Also replaces custom tags found in the markdown with the appropriate content, e.g. {{pyfolio-carousel}} or {{pyfolio-gallery}}.
+    With expand_carousel=False the carousel tag is left in the page, to be expanded later with expand_carousel_tags(),
+    which lets the rest of the page be cached while the carousel stays random on every request.
     Returns None if an error occurs during processing.
     """
     try:
-        frontmatter_str, content_str = split_frontmatter_from_content(markdown_text)
-        frontmatter_dict = process_frontmatter(frontmatter_str)
+        with metrics.time_phase("frontmatter_parse"):
+            frontmatter_dict, content_str = frontmatter_util.split_frontmatter(markdown_text)
+            # List values, e.g. tags: [landscape, "black and white"], are given to the <meta> tags comma separated
+            for key, value in frontmatter_dict.items():
+                if value.startswith("[") and value.endswith("]"):
+                    frontmatter_dict[key] = ",".join(frontmatter_util.get_list_value(value))
 
         # Provide a default title if none is specified
         if "title" not in frontmatter_dict:
@@ -55,86 +74,131 @@ def render_custom_page_from_markdown_text(markdown_text: str, source_file_path:
                 app_logger.warning("No site title found in config.toml")
             frontmatter_dict["title"] = nameFromPath
 
-        preprocessed_markdown = apply_preprocessing_to_markdown(content_str)
-        rendered_markdown = markdown.markdown(preprocessed_markdown, extensions=["nl2br"])
+        with metrics.time_phase("markdown_conversion"):
+            rendered_markdown = markdown_engine.render_page(content_str)
 
         # process the markdown text to inject carousel elements
-        rendered_markdown = process_custom_pyfolio_tags(rendered_markdown)
-        return render_template("text_page.jinja", rendered_markdown_content=rendered_markdown, frontmatter_dict=frontmatter_dict)
+        with metrics.time_phase("tag_substitution"):
+            rendered_markdown = process_custom_pyfolio_tags(rendered_markdown, expand_carousel)
+        with metrics.time_phase("template_render"):
+            return render_template("text_page.jinja", rendered_markdown_content=rendered_markdown, frontmatter_dict=frontmatter_dict)
     except Exception as e:
         app_logger.error(f"Error processing markdown text: {e}")
         return None
 
 
-def apply_preprocessing_to_markdown(markdown_text: str) -> str:
-    """
-    Applies preprocessing to a markdown text before rendering it.
-    """
-
-    # Respects multiple line breaks in the markdown text by replacing them with <br> tags
-    processed_text = markdown_text.replace("\n\n", "<br>\n")
-
-    return processed_text
-
-
 def get_random_portfolio_image_elements(amount: int):
-    image_elements = [element for element in Portfolio.get_instance().get_elements() if element.get_asset_type() == "image"]
+    image_elements = Portfolio.get_instance().get_elements_by_asset_type("image")
     return random.sample(image_elements, k=min(amount, len(image_elements)))
 
 
-def process_custom_pyfolio_tags(markdown_text: str):
-    processed_markdown = markdown_text.replace(
-        CAROUSEL_TAG, render_template("carousel_component.jinja", carousel_elements=get_random_portfolio_image_elements(3))
-    )
+def process_custom_pyfolio_tags(markdown_text: str, expand_carousel: bool = True):
+    processed_markdown = markdown_text
+    if expand_carousel:
+        processed_markdown = expand_carousel_tags(processed_markdown)
+    elif CAROUSEL_TAG in processed_markdown:
+        render_cache.record_deferred_tags()
 
-    processed_markdown = processed_markdown.replace(
-        GALLERY_TAG, render_template("gallery_component.jinja", portfolio_elements=Portfolio.get_instance().get_elements())
-    )
+    if GALLERY_TAG_PATTERN.search(processed_markdown):
+        render_cache.record_dependency(("portfolio",))
+        render_cache.record_dependency(("template", "gallery_component.jinja"))
+        render_cache.record_dependency(("thumbnails",))
+        render_cache.record_dependency(("image_metadata",))
+        processed_markdown = GALLERY_TAG_PATTERN.sub(lambda match: render_gallery_fragment(parse_gallery_filters(match.group(1))), processed_markdown)
     return processed_markdown
 
 
-def split_frontmatter_from_content(markdown_text: str) -> tuple:
+def parse_gallery_filters(tag_arguments: str) -> dict[str, list[str]]:
     """
-    Splits the frontmatter from the content of a markdown document and returns a (frontmatter, content) strings tuple.
+    Returns the facet filters of a gallery tag, e.g. 'tag="black and white" type=image' -> {"tag": ["black and white"], "type": ["image"]}.
+    Comma separated values must all match, e.g. tag=night,city. Unknown facets are ignored with a warning.
     """
-    if not contains_a_frontmatter_block(markdown_text):
-        return "", markdown_text
+    filters = {}
+    for facet, quoted_value, value in GALLERY_FILTER_PATTERN.findall(tag_arguments):
+        if facet not in portfolio_index.FACETS:
+            app_logger.warning(f"Unknown gallery filter [{facet}], expected one of {portfolio_index.FACETS}.")
+            continue
+        filters.setdefault(facet, []).extend(item.strip() for item in (quoted_value or value).split(",") if item.strip())
+    return filters
 
-    lines = markdown_text.split("\n")
-    frontmatter = "\n".join(lines[: lines.index("---", 1) + 1])
-    content = "\n".join(lines[lines.index("---", 1) + 1 :])
 
-    return frontmatter, content
+def get_gallery_filters_in_text(text: str) -> list[dict[str, list[str]]]:
+    """Returns the filters of every gallery tag found in a markdown or HTML text, an empty dictionary for an unfiltered gallery."""
+    return [parse_gallery_filters(match.group(1)) for match in GALLERY_TAG_PATTERN.finditer(text)]
 
 
-def process_frontmatter(frontmatter_str: str):
+def get_gallery_elements(filters: dict[str, list[str]] | None = None):
+    """Returns the elements shown by a gallery with the given filters, the whole portfolio without filters."""
+    if not filters:
+        return Portfolio.get_instance().get_elements()
+    return portfolio_index.get_element_index().query(filters)
+
+
+def expand_carousel_tags(html: str) -> str:
     """
-    Processes the frontmatter of a markdown document and returns the frontmatter as a dictionary.
+    Replaces the carousel tags with a carousel of random portfolio images.
     """
-    if not contains_a_frontmatter_block(frontmatter_str):
-        return {}
-
-    frontmatterDictionary = {}
-    lines = frontmatter_str.split("\n")
-    for line in lines[1 : lines.index("---", 1)]:
-        key, value = line.split(": ", 1)
-        frontmatterDictionary[key] = value
+    if CAROUSEL_TAG not in html:
+        return html
+    return html.replace(CAROUSEL_TAG, render_template("carousel_component.jinja", carousel_elements=get_random_portfolio_image_elements(3)))
 
-    # Convert incorrectly structured arrays for html
-    for key in frontmatterDictionary:
-        if frontmatterDictionary[key].startswith("[") and frontmatterDictionary[key].endswith("]"):
-            # Remove brackets
-            frontmatterDictionary[key] = frontmatterDictionary[key].replace("[", "").replace("]", "").replace(", ", ",")
-            # remove internal quotes
-            frontmatterDictionary[key] = frontmatterDictionary[key].replace('"', "")
-            print(frontmatterDictionary[key])
 
-    return frontmatterDictionary
+def get_requested_gallery_page() -> int:
+    """
+    Returns the gallery page number requested through the "page" query parameter, 1 if absent or invalid.
+    """
+    try:
+        return max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        return 1
 
 
-def contains_a_frontmatter_block(markdown_text: str):
+def render_gallery_fragment(filters: dict[str, list[str]] | None = None) -> str:
     """
-    Returns True if the markdown text contains a frontmatter block, False otherwise.
+    Returns the requested page of the gallery as an HTML fragment, see portfolio_api.py for the pagination.
+    Filtered galleries only show the elements matching the filters, answered by the facet index (see portfolio_index.py).
+    The fragments are only rendered again when the portfolio, the thumbnails, the image dimensions, the fingerprints
+    or the gallery template change.
     """
-    lines = markdown_text.split("\n")
-    return lines[0] == "---" and "---" in lines[1:]
+    global _gallery_fragment_cache
+    portfolio_snapshot = Portfolio.get_instance().get_snapshot()
+    cache_key = (
+        portfolio_snapshot.get_generation(),
+        thumbnails.get_generation(),
+        image_metadata.get_generation(),
+        asset_fingerprints.get_generation(),  # URLs of the placeholder images
+        config_manager.get_config_generation(),  # Page size
+        render_cache.get_dependency_state(("template", "gallery_component.jinja")),
+        request.script_root,  # URLs in the fragment are absolute
+    )
+
+    elements = get_gallery_elements(filters)
+    page_count = portfolio_api.get_page_count(elements)
+    page_number = min(get_requested_gallery_page(), page_count)
+    fragment_key = (portfolio_index.normalize_filters(filters or {}), page_number)
+
+    cached_key, cached_fragments = _gallery_fragment_cache
+    if cached_key != cache_key:
+        cached_fragments = {}
+        _gallery_fragment_cache = (cache_key, cached_fragments)  # Single assignment, so concurrent readers see a consistent pair
+    elif fragment_key in cached_fragments:
+        return cached_fragments[fragment_key]
+
+    # The visitor's browser loads the following pages as JSON, baked files for the whole portfolio, the query API for filtered galleries
+    next_page_url = None
+    if page_number < page_count:
+        if not filters:
+            next_page_url = url_for("serve_portfolio_api_page", page_number=page_number + 1)
+        else:
+            page_size = portfolio_api.get_page_size()
+            next_page_url = url_for("serve_portfolio_query", **filters, offset=page_number * page_size, limit=page_size)
+
+    fragment = render_template(
+        "gallery_component.jinja",
+        portfolio_elements=portfolio_api.get_page_elements(elements, page_number),
+        page_number=page_number,
+        page_count=page_count,
+        next_page_url=next_page_url,
+    )
+    cached_fragments[fragment_key] = fragment
+    return fragment
@@ -0,0 +1,72 @@
+"""
+This module parses the frontmatter block of markdown documents, e.g. captions and custom pages:
+
+---
+title: A title
+tags: [landscape, "black and white"]
+date: 2024-05-01
+---
+
+Unlike custom_pages_util.py it does not depend on Flask, so it can be used while scanning and by process pool workers.
+"""
+
+FRONTMATTER_DELIMITER = "---"
+MAX_HEADER_LINES = 100  # A longer block is most likely not a frontmatter, e.g. a horizontal rule followed by text
+
+
+def parse_frontmatter_lines(lines) -> dict[str, str]:
+    """Parses "key: value" lines into a dictionary, lines without a separator are ignored."""
+    frontmatter = {}
+    for line in lines:
+        key, separator, value = line.partition(":")
+        if separator and key.strip():
+            frontmatter[key.strip()] = value.strip()
+    return frontmatter
+
+
+def split_frontmatter(markdown_text: str) -> tuple[dict[str, str], str]:
+    """
+    Returns a (frontmatter dictionary, content) tuple, an empty dictionary and the whole text if there is no frontmatter.
+    Only the header is split into lines, never the content.
+    """
+    first_line_end = markdown_text.find("\n")
+    if first_line_end == -1 or markdown_text[:first_line_end].rstrip() != FRONTMATTER_DELIMITER:
+        return {}, markdown_text
+    lines = []
+    line_start = first_line_end + 1
+    while len(lines) <= MAX_HEADER_LINES:
+        line_end = markdown_text.find("\n", line_start)
+        line = markdown_text[line_start:] if line_end == -1 else markdown_text[line_start:line_end]
+        if line.rstrip() == FRONTMATTER_DELIMITER:
+            return parse_frontmatter_lines(lines), "" if line_end == -1 else markdown_text[line_end + 1 :]
+        if line_end == -1:
+            break
+        lines.append(line)
+        line_start = line_end + 1
+    return {}, markdown_text
+
+
+def read_frontmatter(file_path: str) -> dict[str, str]:
+    """
+    Returns the frontmatter of a markdown file, reading only its header rather than the whole file.
+    Returns an empty dictionary if the file has no frontmatter, raises OSError if it cannot be read.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        if file.readline().rstrip() != FRONTMATTER_DELIMITER:
+            return {}
+        lines = []
+        for line in file:
+            if line.rstrip() == FRONTMATTER_DELIMITER:
+                return parse_frontmatter_lines(lines)
+            if len(lines) == MAX_HEADER_LINES:
+                break
+            lines.append(line)
+    return {}
+
+
+def get_list_value(value: str) -> list[str]:
+    """Splits a frontmatter list value, e.g. '[a, "b c"]' or 'a, b c', into its items."""
+    value = value.strip()
+    if value.startswith("[") and value.endswith("]"):
+        value = value[1:-1]
+    return [item.strip().strip("\"'").strip() for item in value.split(",") if item.strip().strip("\"'").strip()]
@@ -0,0 +1,213 @@
+"""
+This module extracts the dimensions of the portfolio images, so that pages can give every <img> its intrinsic width and height
+and browsers reserve its space before it loads, instead of reflowing the layout as images come in.
+
+Only the header of each image is read, as displayed, i.e. with the EXIF orientation applied like the thumbnails (see thumbnails.py).
+The results are kept in a manifest keyed by mtime and size, so unchanged images are never opened again, and extracted
+in the background by default. Until an image is read, its pages simply omit its dimensions.
+Images added or modified while the server runs are read by the portfolio watcher (see Portfolio.apply_changes()).
+
+Requires the optional Pillow package, without it no dimensions are known.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app_logger
+import path_util
+
+try:
+    from PIL import Image
+
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+MANIFEST_PATH = "cache/image_metadata.json"
+BUILD_MODES = ["off", "startup", "background"]
+
+# Formats Pillow reads, vector images (SVG) have no intrinsic size in pixels
+READABLE_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "bmp", "webp", "tiff", "tif", "ico"}
+EXIF_ORIENTATION_TAG = 0x0112
+ROTATED_EXIF_ORIENTATIONS = {5, 6, 7, 8}  # Rotated by 90 or 270 degrees, width and height are swapped when displayed
+
+_metadata = {}  # absolute asset path -> ImageMetadata, replaced as a whole whenever it changes
+_generation = 0  # Incremented every time _metadata changes, lets caches of rendered pages pick up the dimensions
+_build_lock = threading.Lock()
+
+
+class ImageMetadata:
+    """The dimensions of an image as displayed, in pixels, and the size of its file in bytes."""
+
+    __slots__ = ("mtime_ns", "byte_size", "width", "height")
+
+    def __init__(self, mtime_ns: int, byte_size: int, width: int, height: int):
+        self.mtime_ns = mtime_ns
+        self.byte_size = byte_size
+        self.width = width
+        self.height = height
+
+    def get_orientation(self) -> str:
+        """Returns "landscape", "portrait" or "square"."""
+        if self.width > self.height:
+            return "landscape"
+        if self.width < self.height:
+            return "portrait"
+        return "square"
+
+
+def get_image_metadata(absolute_asset_path: str) -> ImageMetadata | None:
+    """Returns the metadata of an image, or None if it is not known (yet)."""
+    return _metadata.get(absolute_asset_path)
+
+
+def get_generation() -> int:
+    return _generation
+
+
+def can_have_metadata(element) -> bool:
+    return PILLOW_AVAILABLE and element.get_asset_type() == "image" and element.get_extension().lower() in READABLE_EXTENSIONS
+
+
+def build_image_metadata(elements, max_workers: int | None = None):
+    """
+    Makes sure every image element has up to date metadata, reading the headers of the new and modified images
+    across a thread pool (reading a header is mostly waiting on the filesystem).
+    """
+    global _metadata, _generation
+
+    if not PILLOW_AVAILABLE:
+        app_logger.warning("Image metadata: Pillow is not installed, pages will not give image dimensions. Install it with 'pip install pillow'.")
+        return
+
+    with _build_lock:
+        start_time = time.perf_counter()
+        manifest = _load_manifest()
+        metadata = {}
+        jobs = []
+        for element in elements:
+            if not can_have_metadata(element):
+                continue
+            asset_path = element.get_absolute_asset_path()
+            try:
+                stat_result = os.stat(asset_path)
+            except OSError:
+                continue
+            entry = manifest.get(asset_path)
+            if entry is not None and entry[0] == stat_result.st_mtime_ns and entry[1] == stat_result.st_size:
+                metadata[asset_path] = ImageMetadata(*entry)
+            else:
+                jobs.append((asset_path, stat_result.st_mtime_ns, stat_result.st_size))
+
+        failed_count = 0
+        if jobs:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-metadata") as executor:
+                for (asset_path, mtime_ns, size), dimensions in zip(jobs, executor.map(_read_dimensions_or_none, (job[0] for job in jobs))):
+                    if dimensions is None:
+                        failed_count += 1
+                        continue
+                    metadata[asset_path] = ImageMetadata(mtime_ns, size, *dimensions)
+
+        _save_manifest(metadata)
+        _metadata = metadata
+        _generation += 1
+
+    app_logger.info(
+        f"Image metadata: {len(metadata)} images known, {len(jobs) - failed_count} read, {failed_count} failed "
+        f"in {(time.perf_counter() - start_time) * 1000:.1f} ms."
+    )
+
+
+def start_background_build(elements, max_workers: int | None = None) -> threading.Thread:
+    """Runs build_image_metadata() on a daemon thread, pages omit the image dimensions in the meantime."""
+
+    def build():
+        try:
+            build_image_metadata(elements, max_workers)
+        except Exception as e:
+            app_logger.error(f"Image metadata: Background extraction failed: {e}")
+
+    thread = threading.Thread(target=build, name="image-metadata", daemon=True)
+    thread.start()
+    return thread
+
+
+def update_image_metadata(elements):
+    """
+    Reads the metadata of a few added or modified images, e.g. reported by the portfolio watcher, without saving the manifest:
+    the next build reads them from it otherwise. Does nothing until a build has run, which will read them anyway.
+    The generation, which invalidates every page showing images, is only bumped if an image's metadata changed.
+    """
+    global _metadata, _generation
+
+    images = [element for element in elements if can_have_metadata(element)]
+    if not images:
+        return
+    with _build_lock:
+        if not _generation:
+            return
+        metadata = dict(_metadata)
+        has_changed = False
+        for element in images:
+            asset_path = element.get_absolute_asset_path()
+            try:
+                stat_result = os.stat(asset_path)
+            except OSError:
+                continue
+            previous_entry = metadata.get(asset_path)
+            previous_dimensions = (previous_entry.width, previous_entry.height) if previous_entry is not None else None
+            dimensions = _read_dimensions_or_none(asset_path)
+            if dimensions is None:
+                metadata.pop(asset_path, None)
+            else:
+                metadata[asset_path] = ImageMetadata(stat_result.st_mtime_ns, stat_result.st_size, *dimensions)
+            has_changed = has_changed or dimensions != previous_dimensions
+        _metadata = metadata
+        if has_changed:
+            _generation += 1
+
+
+def _read_dimensions(path: str) -> tuple[int, int]:
+    """Returns the (width, height) of an image as displayed. Pillow only reads the header until the pixels are accessed."""
+    with Image.open(path) as image:
+        width, height = image.size
+        # For a PNG, getexif() decodes the whole image to look for an EXIF chunk after the pixels, only read one found before them
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG) if image.format != "PNG" or "exif" in image.info else None
+    if orientation in ROTATED_EXIF_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def _read_dimensions_or_none(path: str) -> tuple[int, int] | None:
+    try:
+        return _read_dimensions(path)
+    except Exception as e:  # Pillow raises various errors on corrupted or unsupported files
+        app_logger.warning(f"Image metadata: Could not read [{path}]: {e}")
+        return None
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(path_util.resolve_path(MANIFEST_PATH), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        app_logger.warning(f"Image metadata: Ignoring unreadable manifest, all images will be read again: {e}")
+        return {}
+
+
+def _save_manifest(metadata: dict):
+    manifest_path = path_util.resolve_path(MANIFEST_PATH)
+    manifest = {path: [entry.mtime_ns, entry.byte_size, entry.width, entry.height] for path, entry in metadata.items()}
+    temporary_path = f"{manifest_path}.{os.getpid()}.tmp"  # Other processes (e.g. a bake) may save at the same time
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, manifest_path)
+    except OSError as e:
+        app_logger.warning(f"Image metadata: Could not save the manifest [{manifest_path}]: {e}")
@@ -0,0 +1,110 @@
+"""
+This module renders markdown to HTML for captions and custom pages.
+
+markdown.markdown() builds a new Markdown object and loads its extensions on every call, so instead each thread keeps
+its own instances (Markdown objects are not thread-safe) and resets them between uses.
+Custom pages keep blank lines as line breaks, which is done by a preprocessor working on the lines Markdown splits anyway,
+rather than on a copy of the whole text.
+
+The optional mistune package can be plugged in as an alternative backend, see the [markdown] section of config.toml
+and benchmark_markdown.py to compare their throughput. Its output is close to Python-Markdown's but not identical,
+so Python-Markdown stays the default.
+
+NOTE: Kept free of Flask imports, it is used by the caption process pool workers.
+"""
+
+import threading
+
+import markdown
+from markdown.preprocessors import Preprocessor
+
+import app_logger
+
+try:
+    import mistune
+
+    MISTUNE_AVAILABLE = True
+except ImportError:
+    MISTUNE_AVAILABLE = False
+
+ENGINES = ["python-markdown", "mistune", "auto"]  # "auto" uses mistune when it is installed
+
+_engine = "python-markdown"
+_instances = threading.local()
+
+
+class _BlankLineBreakPreprocessor(Preprocessor):
+    """
+    Turns every blank line into a line break of the previous line, so that consecutive paragraphs stay visibly apart.
+    Same as replacing each "\\n\\n" of the text with "<br>\\n", left to right.
+    """
+
+    def run(self, lines: list[str]) -> list[str]:
+        processed_lines = []
+        index = 0
+        while index < len(lines):
+            # "\n\n" after this line: the next line is blank and followed by another line
+            if index + 2 < len(lines) and lines[index + 1] == "":
+                processed_lines.append(lines[index] + "<br>")
+                index += 2
+            else:
+                processed_lines.append(lines[index])
+                index += 1
+        return processed_lines
+
+
+class _BlankLineBreakExtension(markdown.Extension):
+    def extendMarkdown(self, md):
+        # Before the whitespace normalization (priority 30), like the text replacement it stands for
+        md.preprocessors.register(_BlankLineBreakPreprocessor(md), "blank_line_break", 40)
+
+
+def configure(engine: str):
+    """Selects the rendering backend, one of ENGINES, falling back to Python-Markdown if mistune is not installed."""
+    global _engine
+    if engine not in ENGINES:
+        app_logger.error(f"Invalid markdown engine [{engine}], expected one of {ENGINES}. Using python-markdown.")
+        engine = "python-markdown"
+    if engine == "mistune" and not MISTUNE_AVAILABLE:
+        app_logger.warning("Markdown: mistune is not installed, using python-markdown. Install it with 'pip install mistune'.")
+    if engine in ("mistune", "auto"):
+        engine = "mistune" if MISTUNE_AVAILABLE else "python-markdown"
+    _engine = engine
+
+
+def get_engine() -> str:
+    return _engine
+
+
+def render_caption(markdown_text: str) -> str:
+    """Renders a caption to HTML."""
+    if _engine == "mistune":
+        return _get_instance("mistune_caption", lambda: mistune.create_markdown(escape=False))(markdown_text)
+    return _convert(_get_instance("caption", lambda: markdown.Markdown()), markdown_text)
+
+
+def render_page(markdown_text: str) -> str:
+    """Renders a custom page to HTML, single line breaks and blank lines are kept as line breaks."""
+    if _engine == "mistune":
+        render = _get_instance("mistune_page", lambda: mistune.create_markdown(escape=False, hard_wrap=True))
+        return render(markdown_text.replace("\n\n", "<br>\n"))
+    if not markdown_text.strip():
+        # Markdown returns early on blank texts, before the preprocessors run, while their blank lines still make line breaks
+        markdown_text = markdown_text.replace("\n\n", "<br>\n")
+    return _convert(_get_instance("page", lambda: markdown.Markdown(extensions=["nl2br", _BlankLineBreakExtension()])), markdown_text)
+
+
+def _get_instance(name: str, create):
+    """Returns this thread's instance of a renderer, creating it on first use."""
+    instance = getattr(_instances, name, None)
+    if instance is None:
+        instance = create()
+        setattr(_instances, name, instance)
+    return instance
+
+
+def _convert(markdown_instance: markdown.Markdown, markdown_text: str) -> str:
+    try:
+        return markdown_instance.convert(markdown_text)
+    finally:
+        markdown_instance.reset()  # Clears the state of the conversion (e.g. references) before the next one
@@ -0,0 +1,180 @@
+"""
+This module collects request and rendering metrics, exposed in the Prometheus text format on /metrics (see app.py).
+
+- Histograms record durations, e.g. the latency of each route and of each rendering phase (see time_phase()).
+- Callbacks report values owned by other modules when /metrics is scraped, e.g. the render cache hits or the portfolio size,
+  so they cost nothing on the request path.
+
+Metrics are disabled by default (see the [metrics] section of config.toml): observations then return immediately
+and time_phase() hands out a shared no-op context manager. When enabled, they are only served to the allowed client addresses.
+
+NOTE: Kept free of Flask imports, rendering phases are also timed in process pool workers (where they are simply lost).
+"""
+
+import ipaddress
+import threading
+import time
+from contextlib import nullcontext
+
+import app_logger
+
+NAMESPACE = "pyfolio"
+# Upper bounds in seconds, from cached responses (well under a millisecond) to cold renders of large pages
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RENDER_PHASES = ["file_read", "frontmatter_parse", "markdown_conversion", "tag_substitution", "template_render"]
+DEFAULT_ALLOWED_ADDRESSES = ["127.0.0.1", "::1"]
+
+_enabled = False
+_allowed_networks = []
+_NO_OP_TIMER = nullcontext()
+
+
+class Histogram:
+    """A thread-safe histogram of observations, by label values, with cumulative buckets as Prometheus expects."""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...], buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (not cumulative) + 1 for +Inf, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        bucket_index = len(self.buckets)
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                bucket_index = index
+                break
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket_index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = [(label_values, list(series[0]), series[1], series[2]) for label_values, series in sorted(self._series.items())]
+        for label_values, bucket_counts, total, count in series_items:
+            labels = _format_labels(self.label_names, label_values)
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative_count += bucket_count
+                bucket_labels = _format_labels(self.label_names + ("le",), label_values + (_format_bound(upper_bound),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative_count}")
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Callback:
+    """
+    A metric whose value is read from another module when /metrics is scraped.
+    function returns a number, or a {label values tuple: number} dictionary for labelled metrics, or None to skip the metric.
+    """
+
+    def __init__(self, name: str, metric_type: str, description: str, function, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.metric_type = metric_type  # "counter" or "gauge"
+        self.description = description
+        self.function = function
+        self.label_names = label_names
+
+    def render(self) -> list[str]:
+        value = self.function()
+        if value is None:
+            return []
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        if isinstance(value, dict):
+            for label_values, series_value in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {series_value}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+request_duration = Histogram(f"{NAMESPACE}_request_duration_seconds", "Time to handle a request, by route.", ("endpoint", "method", "status"))
+render_phase_duration = Histogram(f"{NAMESPACE}_render_phase_duration_seconds", "Time spent in each phase of rendering a page.", ("phase",))
+
+_metrics = [request_duration, render_phase_duration]
+
+
+def configure(enabled: bool, allowed_addresses: list[str] = DEFAULT_ALLOWED_ADDRESSES):
+    """allowed_addresses lists the client addresses or networks /metrics is served to, e.g. ["127.0.0.1", "10.0.0.0/8"]."""
+    global _enabled, _allowed_networks
+    allowed_networks = []
+    for address in allowed_addresses:
+        try:
+            allowed_networks.append(ipaddress.ip_network(address, strict=False))
+        except ValueError:
+            app_logger.error(f"Metrics: Invalid allowed address [{address}], ignored.")
+    _allowed_networks = allowed_networks
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def is_allowed_address(address: str | None) -> bool:
+    """Whether /metrics can be served to a client with this address."""
+    try:
+        client_address = ipaddress.ip_address(address or "")
+    except ValueError:
+        return False
+    return any(client_address in network for network in _allowed_networks)
+
+
+def register_callback(name: str, metric_type: str, description: str, function, label_names: tuple[str, ...] = ()):
+    """Adds a metric read when /metrics is scraped, see Callback. The name is prefixed with the namespace."""
+    _metrics.append(Callback(f"{NAMESPACE}_{name}", metric_type, description, function, label_names))
+
+
+def time_phase(phase: str):
+    """
+    Returns a context manager recording the time spent in its block as a rendering phase, one of RENDER_PHASES, e.g.
+    with metrics.time_phase("markdown_conversion"): ...
+    """
+    if not _enabled:
+        return _NO_OP_TIMER
+    return _PhaseTimer(phase)
+
+
+class _PhaseTimer:
+    __slots__ = ("_phase", "_start_time")
+
+    def __init__(self, phase: str):
+        self._phase = phase
+
+    def __enter__(self):
+        self._start_time = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        render_phase_duration.observe(time.perf_counter() - self._start_time, self._phase)
+
+
+def observe_request(duration_seconds: float, endpoint: str, method: str, status: int):
+    if _enabled:
+        request_duration.observe(duration_seconds, endpoint, method, str(status))
+
+
+def render() -> str:
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple) -> str:
+    if not label_names:
+        return ""
+    escaped_values = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in label_values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, escaped_values)) + "}"
+
+
+def _format_bound(upper_bound: float) -> str:
+    return "+Inf" if upper_bound == float("inf") else repr(upper_bound)
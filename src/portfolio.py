@@ -1,12 +1,80 @@
-import asyncio
 import os
-from pathlib import Path
+import threading
 
 import app_logger
+import asset_fingerprints
+import caption_renderer
+import image_metadata
 import path_util
+import portfolio_scanner
+import thumbnails
 from portfolio_element import PortfolioElement
 
 
+class PortfolioSnapshot:
+    """
+    An immutable view of the portfolio elements and their lookup indexes.
+    The portfolio swaps whole snapshots when it changes, so a reader holding a snapshot never observes a partial update.
+    """
+
+    __slots__ = (
+        "_elements",
+        "_elements_by_identifier",
+        "_elements_by_asset_path",
+        "_element_positions",
+        "_elements_by_asset_type",
+        "_generation",
+    )
+
+    def __init__(self, elements: list[PortfolioElement], generation: int = 0):
+        self._elements = tuple(elements)
+        self._elements_by_identifier = {element.get_identifier(): element for element in self._elements}
+        self._elements_by_asset_path = {element.get_absolute_asset_path(): element for element in self._elements}
+        self._element_positions = {element: index for index, element in enumerate(self._elements)}
+        elements_by_asset_type = {}
+        for element in self._elements:
+            elements_by_asset_type.setdefault(element.get_asset_type(), []).append(element)
+        self._elements_by_asset_type = {asset_type: tuple(elements) for asset_type, elements in elements_by_asset_type.items()}
+        self._generation = generation
+
+    def get_generation(self) -> int:
+        """Returns a counter incremented every time the portfolio changes (assets or captions)."""
+        return self._generation
+
+    def get_elements(self) -> tuple[PortfolioElement, ...]:
+        return self._elements
+
+    def get_elements_by_asset_type(self, asset_type: str) -> tuple[PortfolioElement, ...]:
+        """Returns the elements of the given asset type (e.g. "image"), in portfolio order."""
+        return self._elements_by_asset_type.get(asset_type, ())
+
+    def get_element_position(self, element: PortfolioElement) -> int | None:
+        """Returns the index of the element in the portfolio, or None if it is not part of it."""
+        return self._element_positions.get(element)
+
+    def get_element_before(self, element: PortfolioElement) -> PortfolioElement:
+        """Returns the element before the given element in the portfolio."""
+        index = self._element_positions.get(element)
+        if index is None or index == 0:
+            return None
+        return self._elements[index - 1]
+
+    def get_element_after(self, element: PortfolioElement) -> PortfolioElement:
+        """Returns the element after the given element in the portfolio."""
+        index = self._element_positions.get(element)
+        if index is None or index == len(self._elements) - 1:
+            return None
+        return self._elements[index + 1]
+
+    def get_element_by_asset_path(self, absolute_asset_path: str) -> PortfolioElement:
+        """Finds a PortfolioElement by its absolute asset path."""
+        return self._elements_by_asset_path.get(absolute_asset_path)
+
+    def get_element_by_identifier(self, asset_identifier: str) -> PortfolioElement:
+        """Finds a PortfolioElement by its identifier, i.e. the relative path from the portfolio folder, excluding extensions."""
+        return self._elements_by_identifier.get(asset_identifier)
+
+
 class Portfolio:
     """
     The class that builds and holds the "metadata" of the portfolio built from the assets found in the portfolio folder.
@@ -31,42 +99,52 @@ class Portfolio:
         raise Exception("Portfolio is a singleton. Use Portfolio.get_instance() to access the instance.")
 
     IGNORED_EXTENSIONS = [".md", ".txt"]
+    SCAN_SNAPSHOT_PATH = "cache/portfolio_scan.json"  # Spares listing the unchanged directories again on restart, see portfolio_scanner
 
     def __init__(self):
-        self._elements = self._discover_portfolio_elements()
+        self._scan_directory = path_util.resolve_path("portfolio")
+        self._scan_result = None
+        self._write_lock = threading.Lock()  # Serializes writers, readers only ever read self._snapshot
+        # A process forked while another thread writes (e.g. a server worker, see serve.py) would inherit a lock never released.
+        # Writers must therefore never wait, while holding it, on anything held around a fork (e.g. the thumbnails build lock)
+        if hasattr(os, "register_at_fork"):  # POSIX only, spawned processes (e.g. on Windows) start with a fresh lock anyway
+            os.register_at_fork(before=self._write_lock.acquire, after_in_parent=self._write_lock.release, after_in_child=self._write_lock.release)
+        self._snapshot = PortfolioSnapshot(self._discover_portfolio_elements())
 
-        app_logger.info(f"Portfolio: Found {len(self._elements)} supported assets in the portfolio folder.")
+        app_logger.info(f"Portfolio: Found {len(self._snapshot.get_elements())} supported assets in the portfolio folder.")
 
     def _discover_portfolio_elements(self) -> list[PortfolioElement]:
         """
-        Parses the portfolio folder synchronously but uses async for internal processing.
+        Recursively scans the portfolio folder (see portfolio_scanner) and builds the elements for the assets found.
         Returns a list of all the elements found in the portfolio folder.
         """
-        elements = []
-        scan_directory = path_util.resolve_path("portfolio")
+        scan_directory = self._scan_directory
 
         try:
-            # Non-recursive listing
-            files = os.listdir(scan_directory)
+            scan_result = portfolio_scanner.scan_portfolio_folder(
+                scan_directory, self.IGNORED_EXTENSIONS, snapshot_path=path_util.resolve_path(self.SCAN_SNAPSHOT_PATH)
+            )
         except FileNotFoundError:
             app_logger.error(f"Portfolio folder not found: {scan_directory}")
-            return elements
+            return []
 
-        # Define async processing for a single file
-        async def process_file(file):
-            absolute_file_path = path_util.resolve_path(os.path.join(scan_directory, file))
+        self._scan_result = scan_result
+        return self._build_elements(scan_result.asset_paths)
 
-            # Skip ignored extensions early
-            if any(file.endswith(ext) for ext in self.IGNORED_EXTENSIONS):
-                app_logger.debug(f"Portfolio initial scan: Skipping non-asset file: {file}")
-                return None
+    def _build_elements(self, asset_paths: list[str], known_identifiers: dict | None = None) -> list[PortfolioElement]:
+        """
+        Builds the elements for the given asset paths, skipping any whose identifier is already taken.
+        known_identifiers maps identifiers to the elements already in the portfolio and is updated in place.
+        """
+        elements = []
+        if known_identifiers is None:
+            known_identifiers = {}
 
-            # Process valid asset files
-            app_logger.debug(f"Portfolio initial scan: Including asset: {file}")
+        for absolute_file_path in asset_paths:
             new_element = PortfolioElement(absolute_asset_path=absolute_file_path)
 
-            # Check for identifier collisions
-            collision = next((element for element in elements if element.get_identifier() == new_element.get_identifier()), None)
+            # Check for identifier collisions, e.g. "image.jpg" and "image.png"
+            collision = known_identifiers.get(new_element.get_identifier())
             if collision:
                 app_logger.warning(
                     f"Multiple portfolio elements cannot have the same identifier:\n"
@@ -74,47 +152,129 @@ class Portfolio:
                     f"- {new_element.get_absolute_asset_path()}\n"
                     f"{new_element.get_absolute_asset_path()} will not be included."
                 )
-                return None
+                continue
 
-            return new_element
+            known_identifiers[new_element.get_identifier()] = new_element
+            elements.append(new_element)
 
-        # Synchronous wrapper for async processing
-        async def process_all_files():
-            tasks = [process_file(file) for file in files if Path(scan_directory, file).is_file()]
-            results = await asyncio.gather(*tasks)
-            return [result for result in results if result]
-
-        # Run the async processing
-        elements = asyncio.run(process_all_files())
         return elements
 
-    def get_elements(self):
-        return self._elements
+    def apply_changes(self, added_paths: list[str], removed_paths: list[str], modified_paths: list[str] = ()):
+        """
+        Applies filesystem changes to the portfolio without rescanning the whole folder, then swaps in a new snapshot.
+        - added_paths: new files, renamed files are reported as a removal and an addition in the same call
+        - removed_paths: deleted files or directories, removing a directory removes every element below it
+        - modified_paths: files whose content changed, caption (.md) files and assets (whose fingerprints, thumbnails and dimensions are updated)
+        Paths with an ignored extension are caption or text files, they only bump the snapshot generation.
+        """
+        with self._write_lock:
+            snapshot = self._snapshot
+            removed_paths = set(removed_paths)
+            removed_directory_prefixes = tuple(path + os.sep for path in removed_paths)
+
+            kept_elements = [
+                element
+                for element in snapshot.get_elements()
+                if element.get_absolute_asset_path() not in removed_paths
+                and not element.get_absolute_asset_path().startswith(removed_directory_prefixes)
+            ]
+            removed_count = len(snapshot.get_elements()) - len(kept_elements)
+
+            known_identifiers = {element.get_identifier(): element for element in kept_elements}
+            known_asset_paths = {element.get_absolute_asset_path() for element in kept_elements}
+            new_asset_paths = sorted(
+                path
+                for path in set(added_paths)
+                if not path.endswith(tuple(self.IGNORED_EXTENSIONS)) and path not in known_asset_paths and os.path.isfile(path)
+            )
+            new_elements = self._build_elements(new_asset_paths, known_identifiers)
+
+            changed_caption_count = sum(
+                1 for path in (*added_paths, *removed_paths, *modified_paths) if path.endswith(tuple(self.IGNORED_EXTENSIONS))
+            )
+
+            modified_paths = set(modified_paths)
+            changed_elements = new_elements + [element for element in kept_elements if element.get_absolute_asset_path() in modified_paths]
+
+            is_snapshot_changed = bool(removed_count or new_elements or changed_caption_count)
+            if is_snapshot_changed:
+                elements = kept_elements + new_elements
+                elements.sort(key=PortfolioElement.get_absolute_asset_path)  # Mostly sorted already, so this is close to linear
+                self._snapshot = PortfolioSnapshot(elements, snapshot.get_generation() + 1)
+
+        # Outside of the write lock: decoding images and hashing files is slow, and the thumbnails build forks while holding its own lock
+        if changed_elements:
+            image_metadata.update_image_metadata(changed_elements)
+            thumbnails.update_thumbnails(changed_elements)
+            asset_fingerprints.update_asset_fingerprints(changed_elements)
+
+        if not is_snapshot_changed:
+            return
+        app_logger.info(
+            f"Portfolio: Applied changes, {len(new_elements)} added, {removed_count} removed, {changed_caption_count} caption changes. "
+            f"Now {len(elements)} assets (generation {self._snapshot.get_generation()})."
+        )
+
+    def rescan(self):
+        """
+        Scans the whole portfolio folder again and swaps in a new snapshot, e.g. when the server reloads (see app.reload_environment()).
+        Readers keep the previous snapshot until the scan is done.
+        """
+        with self._write_lock:
+            elements = self._discover_portfolio_elements()
+            self._snapshot = PortfolioSnapshot(elements, self._snapshot.get_generation() + 1)
+
+        app_logger.info(f"Portfolio: Rescanned, {len(elements)} assets (generation {self._snapshot.get_generation()}).")
+
+    def prerender_captions(self, in_background: bool = False, max_workers: int | None = None) -> threading.Thread | None:
+        """
+        Renders the captions of all the current elements across a process pool, see caption_renderer.prerender_captions().
+        With in_background=True this returns the rendering thread immediately and captions requested in the meantime are rendered on demand.
+        """
+        snapshot = self._snapshot
+        caption_paths = self._scan_result.caption_paths if self._scan_result is not None else None
+        if in_background:
+            return caption_renderer.start_background_prerender(snapshot.get_elements(), caption_paths, max_workers)
+        caption_renderer.prerender_captions(snapshot.get_elements(), caption_paths, max_workers)
+        return None
+
+    def get_scan_directory(self) -> str:
+        """Returns the absolute path of the portfolio folder."""
+        return self._scan_directory
+
+    def get_scan_result(self) -> portfolio_scanner.ScanResult | None:
+        """Returns the timing and counts of the last portfolio folder scan, or None if the folder could not be scanned."""
+        return self._scan_result
+
+    def get_snapshot(self) -> PortfolioSnapshot:
+        """
+        Returns the current immutable snapshot of the portfolio.
+        Use it when several lookups must be consistent with each other, e.g. an element and its neighbours.
+        """
+        return self._snapshot
+
+    def get_generation(self) -> int:
+        return self._snapshot.get_generation()
+
+    def get_elements(self) -> tuple[PortfolioElement, ...]:
+        return self._snapshot.get_elements()
+
+    def get_elements_by_asset_type(self, asset_type: str) -> tuple[PortfolioElement, ...]:
+        """Returns the elements of the given asset type (e.g. "image"), in portfolio order."""
+        return self._snapshot.get_elements_by_asset_type(asset_type)
 
     def get_element_before(self, element: PortfolioElement) -> PortfolioElement:
         """Returns the element before the given element in the portfolio."""
-        index = self._elements.index(element)
-        if index == 0:
-            return None
-        return self._elements[index - 1]
+        return self._snapshot.get_element_before(element)
 
     def get_element_after(self, element: PortfolioElement) -> PortfolioElement:
         """Returns the element after the given element in the portfolio."""
-        index = self._elements.index(element)
-        if index == len(self._elements) - 1:
-            return None
-        return self._elements[index + 1]
+        return self._snapshot.get_element_after(element)
 
     def get_element_by_asset_path(self, absolute_asset_path: str) -> PortfolioElement:
         """Finds a PortfolioElement by its absolute asset path."""
-        for element in self._elements:
-            if element.get_identifier() == absolute_asset_path:
-                return element
-        return None
+        return self._snapshot.get_element_by_asset_path(absolute_asset_path)
 
     def get_element_by_identifier(self, asset_identifier: str) -> PortfolioElement:
         """Finds a PortfolioElement by its identifier, i.e. the relative path from the portfolio folder, excluding extensions."""
-        for element in self._elements:
-            if element.get_identifier() == asset_identifier:
-                return element
-        return None
+        return self._snapshot.get_element_by_identifier(asset_identifier)
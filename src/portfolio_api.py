@@ -0,0 +1,97 @@
+"""
+This module builds the paginated listings of portfolio elements used by the gallery and the JSON API.
+
+Listings are sliced straight out of a sequence of elements, the whole portfolio snapshot or the result of a query
+(see portfolio_index.py), so a page costs O(page size) whatever the size of the portfolio.
+The baked site gets the same listings as static JSON files, one per gallery page (see bake_website.py).
+"""
+
+from collections.abc import Sequence
+
+from flask import url_for
+
+import config_manager
+from portfolio_element import PortfolioElement
+
+DEFAULT_PAGE_SIZE = 60
+MAX_LIMIT = 500  # Upper bound for the limit parameter of the API
+
+
+def get_page_size() -> int:
+    """
+    Returns the number of elements per gallery page from the configuration, 0 meaning a single page with every element.
+    """
+    return max(0, int(config_manager.get_config().get("gallery", {}).get("page_size", DEFAULT_PAGE_SIZE)))
+
+
+def get_page_count(elements: Sequence[PortfolioElement]) -> int:
+    """Returns the number of gallery pages, at least 1 even without any element."""
+    page_size = get_page_size()
+    element_count = len(elements)
+    if page_size == 0 or element_count == 0:
+        return 1
+    return (element_count + page_size - 1) // page_size
+
+
+def get_page_elements(elements: Sequence[PortfolioElement], page_number: int) -> Sequence[PortfolioElement]:
+    """Returns the elements of a gallery page, numbered from 1."""
+    page_size = get_page_size()
+    if page_size == 0:
+        return elements
+    start = (page_number - 1) * page_size
+    return elements[start : start + page_size]
+
+
+def get_gallery_thumbnail_url(element: PortfolioElement) -> str:
+    """Returns the URL of the image shown on the element's gallery card, a placeholder for non-image assets."""
+    asset_type = element.get_asset_type()
+    if asset_type == "image":
+        return element.get_url_for_thumbnail()
+    placeholder = asset_type if asset_type in ("audio", "video") else "other"
+    return url_for("static", filename=f"assets/missing_thumbnail_{placeholder}.webp")
+
+
+def element_to_listing_entry(element: PortfolioElement) -> dict:
+    """Returns the JSON-serializable metadata of an element, everything needed to render its gallery card."""
+    metadata = element.get_image_metadata()
+    return {
+        "identifier": element.get_identifier(),
+        "title": element.get_file_name_without_extension(),
+        "label": element.get_path_relative_to_portfolio(),
+        "asset_type": element.get_asset_type(),
+        "page_url": element.get_url_for_page(),
+        "asset_url": element.get_url_for_asset(),
+        "thumbnail_url": get_gallery_thumbnail_url(element),
+        "thumbnail_srcset": element.get_thumbnail_srcset() if element.get_asset_type() == "image" else "",
+        "width": metadata.width if metadata is not None else None,
+        "height": metadata.height if metadata is not None else None,
+    }
+
+
+def build_listing(elements: Sequence[PortfolioElement], offset: int, limit: int) -> dict:
+    """
+    Returns a page of element metadata starting at offset.
+    The next_* fields are None on the last page, the caller fills next_url according to how the page was requested.
+    """
+    page = elements[offset : offset + limit]
+    next_offset = offset + len(page) if offset + len(page) < len(elements) else None
+    return {
+        "total": len(elements),
+        "offset": offset,
+        "limit": limit,
+        "elements": [element_to_listing_entry(element) for element in page],
+        "next_offset": next_offset,
+        "next_cursor": page[-1].get_identifier() if page and next_offset is not None else None,
+        "next_url": None,
+    }
+
+
+def build_page_listing(elements: Sequence[PortfolioElement], page_number: int) -> dict:
+    """Returns the listing of a gallery page of all the elements, numbered from 1, with next_url pointing to the following page's JSON."""
+    page_size = get_page_size() or max(1, len(elements))
+    listing = build_listing(elements, (page_number - 1) * page_size, page_size)
+    listing["page"] = page_number
+    listing["page_count"] = get_page_count(elements)
+    if page_number < listing["page_count"]:
+        listing["next_url"] = url_for("serve_portfolio_api_page", page_number=page_number + 1)
+    return listing
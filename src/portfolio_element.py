@@ -1,43 +1,97 @@
 import os
 
 from flask import url_for
-import markdown
 
+import caption_renderer
+import image_metadata
 import path_util
+import thumbnails
 
 IMAGE_FORMATS = ["jpg", "jpeg", "png", "gif", "bmp", "webp", "svg", "ico", "tiff", "tif"]
 VIDEO_FORMATS = ["mp4", "webm", "ogg", "mov", "avi", "mkv", "flv", "wmv", "3gp", "m4v"]
 AUDIO_FORMATS = ["mp3", "wav", "ogg", "flac", "aac", "m4a", "opus", "wma", "aiff"]
 
 
+# Later entries win, so ambiguous extensions (e.g. "ogg") keep the image > video > audio priority
+ASSET_TYPES_BY_EXTENSION = {
+    **{extension: "audio" for extension in AUDIO_FORMATS},
+    **{extension: "video" for extension in VIDEO_FORMATS},
+    **{extension: "image" for extension in IMAGE_FORMATS},
+}
+
+
 class PortfolioElement:
     """
     Represents a single portfolio element.
     All paths are relative to the portfolio folder.
+
+    Elements are immutable records: every value derived from the asset path is computed once at construction.
+    The only exception is the rendered caption, a cache replaced as a whole (see store_rendered_caption()).
     """
 
+    __slots__ = (
+        "_absolute_asset_path",
+        "_path_relative_to_portfolio",
+        "_identifier",
+        "_extension",
+        "_asset_type",
+        "_file_name",
+        "_file_name_without_extension",
+        "_caption_file_path",
+        "_asset_url_path",
+        "_rendered_caption",
+    )
+
     def __init__(self, absolute_asset_path: str):
-        self._absolute_asset_path = absolute_asset_path
+        portfolio_folder = path_util.resolve_path("portfolio")
+        if absolute_asset_path.startswith(portfolio_folder + os.sep):
+            # Paths from the scanner and the watcher are already normalized, which spares os.path.relpath(), the bulk of the startup cost
+            path_relative_to_portfolio = absolute_asset_path[len(portfolio_folder) + 1 :]
+        else:
+            path_relative_to_portfolio = path_util.derive_relative_path(absolute_asset_path, portfolio_folder)
+        identifier, extension_with_dot = os.path.splitext(path_relative_to_portfolio)
+        extension = extension_with_dot[1:]
+        file_name = os.path.basename(absolute_asset_path)
+
+        _set = object.__setattr__  # Bypass the immutability guard below
+        _set(self, "_absolute_asset_path", absolute_asset_path)
+        _set(self, "_path_relative_to_portfolio", path_relative_to_portfolio)
+        _set(self, "_identifier", identifier)
+        _set(self, "_extension", extension)
+        _set(self, "_asset_type", ASSET_TYPES_BY_EXTENSION.get(extension.lower(), "unsupported"))
+        _set(self, "_file_name", file_name)
+        _set(self, "_file_name_without_extension", os.path.splitext(file_name)[0])
+        _set(self, "_caption_file_path", os.path.splitext(absolute_asset_path)[0] + ".md")
+        _set(self, "_asset_url_path", identifier + "." + extension)
+        _set(self, "_rendered_caption", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"PortfolioElement is immutable, cannot set [{name}].")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"PortfolioElement is immutable, cannot delete [{name}].")
+
+    def __eq__(self, other):
+        if not isinstance(other, PortfolioElement):
+            return NotImplemented
+        return self._absolute_asset_path == other._absolute_asset_path
+
+    def __hash__(self):
+        return hash(self._absolute_asset_path)
+
+    def __repr__(self):
+        return f"PortfolioElement({self._absolute_asset_path!r})"
 
     def get_path_relative_to_portfolio(self) -> str:
-        return path_util.derive_relative_path(self._absolute_asset_path, path_util.resolve_path("portfolio"))
+        return self._path_relative_to_portfolio
 
     def get_extension(self) -> str:
         """Return the file extension of the asset."""
-        return os.path.splitext(self._absolute_asset_path)[1][1:]
+        return self._extension
 
     def get_asset_type(self) -> str:
         """Return the type of the asset based on the file extension."""
-        extension = self.get_extension().lower()
-
-        if extension in IMAGE_FORMATS:
-            return "image"
-        elif extension in VIDEO_FORMATS:
-            return "video"
-        elif extension in AUDIO_FORMATS:
-            return "audio"
-        else:
-            return "unsupported"
+        return self._asset_type
 
     def get_absolute_asset_path(self) -> str:
         """Return the absolute asset path."""
@@ -45,37 +99,62 @@ class PortfolioElement:
 
     def get_file_name(self) -> str:
         """Return just the file name without the directory."""
-        return os.path.basename(self._absolute_asset_path)
+        return self._file_name
 
     def get_file_name_without_extension(self) -> str:
         """Return just the file name without the directory and extension."""
-        return os.path.splitext(self.get_file_name())[0]
+        return self._file_name_without_extension
 
     def get_url_for_page(self) -> str:
-        return url_for("serve_portfolio", path=self.get_identifier())
+        return url_for("serve_portfolio", path=self._identifier)
 
     def get_url_for_asset(self) -> str:
-        return url_for("serve_portfolio", path=self.get_identifier() + "." + self.get_extension())
+        return url_for("serve_portfolio", path=self._asset_url_path)
+
+    def get_url_for_thumbnail(self, minimum_width: int | None = None) -> str:
+        """
+        Returns the URL of the smallest thumbnail at least minimum_width wide (the smallest one if None).
+        Falls back to the original asset when the element has no thumbnail (yet), see thumbnails.py.
+        """
+        thumbnail = thumbnails.get_thumbnail(self._absolute_asset_path)
+        if thumbnail is None:
+            return self.get_url_for_asset()
+        return url_for("serve_thumbnail", filename=thumbnail.get_file_name(thumbnail.get_best_width(minimum_width)))
+
+    def get_thumbnail_srcset(self) -> str:
+        """Returns the srcset attribute value listing all the thumbnails of the element, or an empty string if it has none."""
+        thumbnail = thumbnails.get_thumbnail(self._absolute_asset_path)
+        if thumbnail is None:
+            return ""
+        return ", ".join(f"{url_for('serve_thumbnail', filename=thumbnail.get_file_name(width))} {width}w" for width in thumbnail.widths)
+
+    def get_image_metadata(self) -> image_metadata.ImageMetadata | None:
+        """Returns the dimensions of the image, or None for other assets and until they are read, see image_metadata.py."""
+        return image_metadata.get_image_metadata(self._absolute_asset_path)
 
     def get_caption_html(self) -> str:
-        """Returns the content of the markdown caption file rendered as HTML."""
-        raw_markdown = self.get_caption_raw()
-        return markdown.markdown(raw_markdown)
+        """
+        Returns the content of the markdown caption file rendered as HTML.
+        The rendered caption is kept on the element and only rendered again if the caption file changed.
+        """
+        rendered_caption = self._rendered_caption
+        if rendered_caption is None or rendered_caption.file_state != caption_renderer.get_caption_file_state(self._caption_file_path):
+            rendered_caption = caption_renderer.render_caption(self._caption_file_path, self._file_name_without_extension)
+            self.store_rendered_caption(rendered_caption)
+        return rendered_caption.html
+
+    def store_rendered_caption(self, rendered_caption: caption_renderer.RenderedCaption):
+        """Stores a rendered caption on the element, a single assignment so concurrent readers always see a whole caption."""
+        object.__setattr__(self, "_rendered_caption", rendered_caption)
 
     def get_caption_raw(self) -> str:
-        """Return the content of the relevant md file if present, an empty string otherwise."""
-        asset_text_file_path = self.get_caption_file_path()
-        if os.path.isfile(asset_text_file_path):
-            with open(asset_text_file_path, "r") as file:
-                return file.read()
-        else:
-            return "### " + self.get_file_name_without_extension()
+        """Return the content of the relevant md file if present, a heading with the file name otherwise."""
+        return caption_renderer.read_caption_markdown(self._caption_file_path, self._file_name_without_extension)
 
     def get_identifier(self) -> str:
         """Return the identifier of the asset, which is the directories below /portfolio/ and the filename without extension."""
-        relative_path = path_util.derive_relative_path(self._absolute_asset_path, path_util.resolve_path("portfolio"))
-        return os.path.splitext(relative_path)[0]
+        return self._identifier
 
     def get_caption_file_path(self) -> str:
         """Return the path to the optional caption file."""
-        return os.path.splitext(self.get_absolute_asset_path())[0] + ".md"
+        return self._caption_file_path
@@ -0,0 +1,317 @@
+"""
+This module maintains an inverted index of the portfolio elements and custom pages by facet, so that filtered galleries
+and queries are answered with set intersections instead of going through every element.
+
+Facets:
+- "tag": the "tags" of the caption or custom page frontmatter, e.g. "tags: [landscape, night]", case-insensitive
+- "type": the asset type of an element, e.g. "image"
+- "folder": every folder an element is in, e.g. "travels" and "travels/japan" for "travels/japan/tokyo.jpg"
+- "date": the "date" of the frontmatter, indexed by year, month and day so that "2024" and "2024-05" match "2024-05-01"
+
+The element index is built from a portfolio snapshot and rebuilt lazily whenever the snapshot generation changes.
+Only the frontmatter header of captions is read, and it is cached by the caption file's mtime and size,
+so a rebuild after a change only reads the captions that changed.
+The cache is saved to disk after the initial build, so that a restart only reads the captions changed in the meantime.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import app_logger
+import caption_renderer
+import custom_pages_index
+import frontmatter_util
+import path_util
+import portfolio_scanner
+from custom_pages_index import CustomPagesSnapshot
+from portfolio import Portfolio, PortfolioSnapshot
+from portfolio_element import PortfolioElement
+
+FACETS = ("tag", "type", "folder", "date")
+PAGE_FACETS = ("tag", "date")  # Custom pages have no asset type or folder
+DATE_PATTERN = re.compile(r"(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?")
+QUERY_CACHE_SIZE = 128
+PARALLEL_READ_THRESHOLD = 64  # Below this many caption headers to read, a thread pool costs more than it saves
+
+_element_index = None
+_page_index = None
+FRONTMATTER_CACHE_PATH = "cache/caption_frontmatters.json"
+FRONTMATTER_CACHE_VERSION = 1
+
+_caption_frontmatter_cache = None  # caption path -> ((mtime_ns, size), frontmatter), shared between rebuilds, loaded on first build
+_build_lock = threading.Lock()
+
+
+def normalize_filters(filters: dict) -> tuple[tuple[str, tuple[str, ...]], ...]:
+    """
+    Validates and normalizes query filters, a {facet: value or list of values} dictionary, into a hashable form.
+    All the values must match. Raises ValueError for an unknown facet.
+    """
+    normalized_filters = {}
+    for facet, values in filters.items():
+        if facet not in FACETS:
+            raise ValueError(f"Unknown facet [{facet}], expected one of {FACETS}.")
+        values = [values] if isinstance(values, str) else values
+        normalized_values = {_normalize_value(facet, value) for value in values if value.strip()}
+        if normalized_values:
+            normalized_filters[facet] = tuple(sorted(normalized_values))
+    return tuple(sorted(normalized_filters.items()))
+
+
+class _InvertedIndex:
+    """
+    Maps (facet, value) pairs to the positions of the documents having that value.
+    Documents are added in order, so postings are built as sorted lists by appending, and only turned into sets
+    (much more expensive to build) the first time a query needs them.
+    """
+
+    def __init__(self, document_count: int):
+        self._document_count = document_count
+        self._postings = {}
+        self._posting_sets = {}
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
+    def add(self, position: int, facet: str, value: str):
+        posting = self._postings.get((facet, value))
+        if posting is None:
+            self._postings[(facet, value)] = [position]
+        elif posting[-1] != position:
+            posting.append(position)
+
+    def add_frontmatter(self, position: int, frontmatter: dict[str, str]):
+        for tag in frontmatter_util.get_list_value(frontmatter.get("tags", "")):
+            self.add(position, "tag", tag.lower())
+        for date in _get_date_prefixes(frontmatter.get("date", "")):
+            self.add(position, "date", date)
+
+    def query_positions(self, normalized_filters) -> list[int]:
+        """Returns the sorted positions of the documents matching all the filters, from the smallest posting up."""
+        if not normalized_filters:
+            return list(range(self._document_count))
+
+        with self._query_cache_lock:
+            positions = self._query_cache.get(normalized_filters)
+            if positions is not None:
+                self._query_cache.move_to_end(normalized_filters)
+                return positions
+
+        postings = sorted((self._postings.get((facet, value), []) for facet, values in normalized_filters for value in values), key=len)
+        if len(postings) == 1:
+            positions = postings[0]  # Already sorted
+        else:
+            matching_positions = set(postings[0])
+            for posting in postings[1:]:
+                if not matching_positions:
+                    break
+                matching_positions.intersection_update(self._get_posting_set(posting))
+            positions = sorted(matching_positions)
+
+        with self._query_cache_lock:
+            self._query_cache[normalized_filters] = positions
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return positions
+
+    def _get_posting_set(self, posting: list[int]) -> frozenset[int]:
+        posting_set = self._posting_sets.get(id(posting))
+        if posting_set is None:
+            posting_set = self._posting_sets[id(posting)] = frozenset(posting)  # Postings live as long as the index, so their id is stable
+        return posting_set
+
+    def get_facet_counts(self) -> dict[str, dict[str, int]]:
+        """Returns the number of documents for every value of every facet."""
+        facet_counts = {}
+        for (facet, value), positions in self._postings.items():
+            facet_counts.setdefault(facet, {})[value] = len(positions)
+        return {facet: dict(sorted(counts.items())) for facet, counts in sorted(facet_counts.items())}
+
+
+class ElementIndex:
+    """The facet index of the elements of a portfolio snapshot."""
+
+    def __init__(self, snapshot: PortfolioSnapshot, caption_frontmatters: dict[str, dict[str, str]]):
+        self._snapshot = snapshot
+        self._elements = snapshot.get_elements()
+        self._index = _InvertedIndex(len(self._elements))
+        for position, element in enumerate(self._elements):
+            self._index.add(position, "type", element.get_asset_type())
+            # Identifiers use the OS separator, folders are always indexed with "/" (e.g. "travels/japan" on Windows too)
+            folder, separator, _ = element.get_identifier().replace(os.sep, "/").rpartition("/")
+            while separator:
+                self._index.add(position, "folder", folder)
+                folder, separator, _ = folder.rpartition("/")
+            frontmatter = caption_frontmatters.get(element.get_caption_file_path())
+            if frontmatter:
+                self._index.add_frontmatter(position, frontmatter)
+
+    def get_snapshot(self) -> PortfolioSnapshot:
+        return self._snapshot
+
+    def query(self, filters: dict) -> list[PortfolioElement]:
+        """Returns the elements matching all the filters, in portfolio order. Raises ValueError for an unknown facet."""
+        return [self._elements[position] for position in self._index.query_positions(normalize_filters(filters))]
+
+    def get_facet_counts(self) -> dict[str, dict[str, int]]:
+        return self._index.get_facet_counts()
+
+
+class PageIndex:
+    """The facet index of the custom pages, along with their (name, title) for listings."""
+
+    def __init__(self, pages_snapshot: CustomPagesSnapshot):
+        self._pages_snapshot = pages_snapshot
+        pages = pages_snapshot.get_pages()
+        self._pages = [(page.name, page.title) for page in pages]
+        self._index = _InvertedIndex(len(pages))
+        for position, page in enumerate(pages):
+            self._index.add_frontmatter(position, page.frontmatter)
+
+    def get_pages_snapshot(self) -> CustomPagesSnapshot:
+        return self._pages_snapshot
+
+    def query(self, filters: dict) -> list[tuple[str, str]]:
+        """Returns the (name, title) of the custom pages matching all the filters, none if a filter is not about pages."""
+        normalized_filters = normalize_filters(filters)
+        if any(facet not in PAGE_FACETS for facet, _ in normalized_filters):
+            return []
+        return [self._pages[position] for position in self._index.query_positions(normalized_filters)]
+
+    def get_facet_counts(self) -> dict[str, dict[str, int]]:
+        return self._index.get_facet_counts()
+
+
+def get_element_index() -> ElementIndex:
+    """Returns the index of the current portfolio snapshot, building it first if the portfolio changed since the last call."""
+    global _element_index
+    snapshot = Portfolio.get_instance().get_snapshot()
+    element_index = _element_index
+    if element_index is not None and element_index.get_snapshot() is snapshot:
+        return element_index
+
+    with _build_lock:
+        if _element_index is None or _element_index.get_snapshot() is not Portfolio.get_instance().get_snapshot():
+            snapshot = Portfolio.get_instance().get_snapshot()
+            # The scan lists the captions, which spares checking each element for one, but only until the watcher changes something
+            is_initial_snapshot = snapshot.get_generation() == 0
+            caption_file_paths = Portfolio.get_instance().get_scan_result().caption_paths if is_initial_snapshot else None
+            _element_index = _build_element_index(snapshot, caption_file_paths, save_frontmatter_cache=is_initial_snapshot)
+        return _element_index
+
+
+def get_page_index() -> PageIndex:
+    """Returns the index of the custom pages, building it first if a page was added, removed or modified since the last call."""
+    global _page_index
+    pages_snapshot = custom_pages_index.get_snapshot()
+    page_index = _page_index
+    if page_index is None or page_index.get_pages_snapshot() is not pages_snapshot:
+        page_index = _page_index = PageIndex(pages_snapshot)
+    return page_index
+
+
+def _build_element_index(snapshot: PortfolioSnapshot, caption_file_paths: set[str] | None, save_frontmatter_cache: bool = False) -> ElementIndex:
+    """
+    Builds the index of the snapshot, reading the headers of the captions not in the frontmatter cache.
+    With save_frontmatter_cache, the cache is then saved to disk for the next start if any header was read,
+    rebuilds after changes leave it to the next start to read the few captions changed in the meantime.
+    """
+    global _caption_frontmatter_cache
+    start_time = time.perf_counter()
+    if _caption_frontmatter_cache is None:
+        _caption_frontmatter_cache = _load_frontmatter_cache()
+    caption_frontmatters = {}
+    caption_file_states = {}
+    captions_to_read = []
+    for element in snapshot.get_elements():
+        caption_file_path = element.get_caption_file_path()
+        if caption_file_paths is not None and caption_file_path not in caption_file_paths:
+            continue
+        file_state = caption_renderer.get_caption_file_state(caption_file_path)
+        if file_state is None:
+            continue
+        caption_file_states[caption_file_path] = file_state
+        cached_entry = _caption_frontmatter_cache.get(caption_file_path)
+        if cached_entry is not None and cached_entry[0] == file_state:
+            caption_frontmatters[caption_file_path] = cached_entry[1]
+        else:
+            captions_to_read.append((caption_file_path, file_state))
+
+    # Reading headers is I/O bound, worth a thread pool for a full build on slow (e.g. network) filesystems
+    if len(captions_to_read) >= PARALLEL_READ_THRESHOLD:
+        with ThreadPoolExecutor(max_workers=portfolio_scanner.DEFAULT_MAX_WORKERS, thread_name_prefix="portfolio-index") as executor:
+            frontmatters = list(executor.map(_read_caption_frontmatter, (path for path, _ in captions_to_read)))
+    else:
+        frontmatters = [_read_caption_frontmatter(path) for path, _ in captions_to_read]
+    for (caption_file_path, file_state), frontmatter in zip(captions_to_read, frontmatters):
+        _caption_frontmatter_cache[caption_file_path] = (file_state, frontmatter)
+        caption_frontmatters[caption_file_path] = frontmatter
+
+    if save_frontmatter_cache and captions_to_read:
+        _save_frontmatter_cache({path: (file_state, caption_frontmatters[path]) for path, file_state in caption_file_states.items()})
+
+    element_index = ElementIndex(snapshot, caption_frontmatters)
+    app_logger.info(
+        f"Portfolio index: Indexed {len(snapshot.get_elements())} elements ({len(captions_to_read)} caption headers read) "
+        f"in {(time.perf_counter() - start_time) * 1000:.1f} ms."
+    )
+    return element_index
+
+
+def _read_caption_frontmatter(caption_file_path: str) -> dict[str, str]:
+    try:
+        return frontmatter_util.read_frontmatter(caption_file_path)
+    except (OSError, UnicodeDecodeError) as e:
+        app_logger.warning(f"Portfolio index: Could not read the frontmatter of caption [{caption_file_path}]: {e}")
+        return {}
+
+
+def _load_frontmatter_cache() -> dict:
+    try:
+        with open(path_util.resolve_path(FRONTMATTER_CACHE_PATH), "r", encoding="utf-8") as file:
+            saved_cache = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        app_logger.warning(f"Portfolio index: Ignoring unreadable frontmatter cache, all caption headers will be read: {e}")
+        return {}
+    if saved_cache.get("version") != FRONTMATTER_CACHE_VERSION:
+        return {}
+    return {path: ((mtime_ns, size), frontmatter) for path, (mtime_ns, size, frontmatter) in saved_cache["captions"].items()}
+
+
+def _save_frontmatter_cache(frontmatter_cache: dict):
+    """Saves the entries of the captions of the current portfolio, those of removed captions are dropped."""
+    cache_path = path_util.resolve_path(FRONTMATTER_CACHE_PATH)
+    saved_cache = {
+        "version": FRONTMATTER_CACHE_VERSION,
+        "captions": {path: [mtime_ns, size, frontmatter] for path, ((mtime_ns, size), frontmatter) in frontmatter_cache.items()},
+    }
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(saved_cache, file, separators=(",", ":"))
+        os.replace(temporary_path, cache_path)
+    except OSError as e:
+        app_logger.warning(f"Portfolio index: Could not save the frontmatter cache [{cache_path}]: {e}")
+
+
+def _normalize_value(facet: str, value: str) -> str:
+    value = value.strip()
+    if facet == "folder":
+        return value.replace(os.sep, "/").strip("/")  # Folder names are case-sensitive
+    return value.lower()
+
+
+def _get_date_prefixes(date: str) -> list[str]:
+    """e.g. "2024-05-01" -> ["2024", "2024-05", "2024-05-01"]."""
+    match = DATE_PATTERN.match(date.strip())
+    if match is None:
+        return []
+    year, month, day = match.groups()
+    return [prefix for prefix in (year, month and f"{year}-{month}", day and f"{year}-{month}-{day}") if prefix]
@@ -0,0 +1,164 @@
+"""
+This module walks the portfolio folder and lists the asset files it contains.
+
+Directories are listed with os.scandir, which provides the entry types without extra stat calls,
+and each subdirectory is listed as a separate task on a thread pool so that slow (e.g. network) filesystems
+are walked concurrently.
+
+The listing of every directory can be saved to a snapshot file, along with the directory's mtime. Adding, removing or renaming
+an entry changes the mtime of its directory, so the next scan (e.g. after a restart) only stats each directory
+and lists again the ones that changed, rather than walking the whole folder.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import app_logger
+
+# Listing directories is I/O bound, so more threads than cores is fine
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+SNAPSHOT_VERSION = 1
+# A directory modified this shortly before it was listed may have changed again within the same mtime tick
+# (coarse timestamps of some filesystems), so its listing is only trusted once a later scan lists it again
+RACY_WINDOW_NS = 2_000_000_000
+
+
+class ScanResult:
+    """
+    The outcome of a portfolio folder scan.
+    asset_paths are absolute and sorted, so that the portfolio order is stable between scans.
+    caption_paths are the absolute paths of all the markdown files found, which spares checking each asset for a caption.
+    """
+
+    def __init__(self):
+        self.asset_paths = []
+        self.caption_paths = set()
+        self.directory_count = 0
+        self.reused_directory_count = 0  # Directories unchanged since the snapshot, which were not listed again
+        self.skipped_file_count = 0
+        self.duration_seconds = 0.0
+
+
+def scan_portfolio_folder(
+    scan_directory: str, ignored_extensions: list[str], max_workers: int = DEFAULT_MAX_WORKERS, snapshot_path: str | None = None
+) -> ScanResult:
+    """
+    Recursively lists all the asset files below scan_directory, skipping files with one of the ignored extensions.
+    With a snapshot_path, the listings of the directories unchanged since the last scan are read from there, and it is updated.
+    Raises FileNotFoundError if scan_directory does not exist.
+    """
+    if not os.path.isdir(scan_directory):
+        raise FileNotFoundError(f"Portfolio folder not found: {scan_directory}")
+
+    start_time = time.perf_counter()
+    scan_start_time_ns = time.time_ns()
+    result = ScanResult()
+    ignored_extensions = tuple(ignored_extensions)
+    previous_listings, trusted_before_ns = _load_snapshot(snapshot_path, scan_directory, ignored_extensions) if snapshot_path else ({}, 0)
+    listings = {}
+
+    def list_directory(directory: str):
+        return directory, _list_directory(directory, ignored_extensions, previous_listings.get(directory), trusted_before_ns)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="portfolio-scan") as executor:
+        pending = {executor.submit(list_directory, scan_directory)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, (listing, is_reused) = future.result()
+                listings[directory] = listing
+                result.directory_count += 1
+                result.reused_directory_count += is_reused
+                result.skipped_file_count += listing["skipped"]
+                result.asset_paths.extend(os.path.join(directory, name) for name in listing["assets"])
+                result.caption_paths.update(os.path.join(directory, name) for name in listing["captions"])
+                for name in listing["subdirectories"]:
+                    pending.add(executor.submit(list_directory, os.path.join(directory, name)))
+
+    result.asset_paths.sort()
+    result.duration_seconds = time.perf_counter() - start_time
+
+    if snapshot_path and (result.reused_directory_count < result.directory_count or len(listings) != len(previous_listings)):
+        _save_snapshot(snapshot_path, scan_directory, ignored_extensions, scan_start_time_ns, listings)
+
+    app_logger.info(
+        f"Portfolio scan: Found {len(result.asset_paths)} assets in {result.directory_count} directories "
+        f"({result.reused_directory_count} unchanged since the last scan, {result.skipped_file_count} non-asset files skipped) "
+        f"in {result.duration_seconds * 1000:.1f} ms."
+    )
+    return result
+
+
+def _list_directory(directory: str, ignored_extensions: tuple[str, ...], previous_listing: dict | None, trusted_before_ns: int) -> tuple[dict, bool]:
+    """
+    Lists a single directory, unless previous_listing is still valid, and returns a (listing, is_reused) tuple.
+    A listing is a {"mtime_ns", "assets", "captions", "subdirectories", "skipped"} dictionary, with the names of the entries.
+    Symbolic links to directories are not followed to avoid cycles.
+    """
+    listing = {"mtime_ns": 0, "assets": [], "captions": [], "subdirectories": [], "skipped": 0}
+
+    try:
+        # Before listing, so that a change made during the listing is seen by the next scan
+        mtime_ns = os.stat(directory).st_mtime_ns
+        if previous_listing is not None and previous_listing["mtime_ns"] == mtime_ns and mtime_ns < trusted_before_ns:
+            return previous_listing, True
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    listing["subdirectories"].append(entry.name)
+                elif entry.is_file():
+                    if entry.name.endswith(ignored_extensions):
+                        listing["skipped"] += 1
+                        if entry.name.endswith(".md"):
+                            listing["captions"].append(entry.name)
+                        continue
+                    listing["assets"].append(entry.name)
+        listing["mtime_ns"] = mtime_ns  # Left at 0 for a directory that could not be listed, so that it is never reused
+    except OSError as e:
+        app_logger.warning(f"Portfolio scan: Could not list directory [{directory}]: {e}")
+
+    return listing, False
+
+
+def _load_snapshot(snapshot_path: str, scan_directory: str, ignored_extensions: tuple[str, ...]) -> tuple[dict, int]:
+    """
+    Returns the directory listings of the snapshot, and the time before which their mtimes can be trusted.
+    Nothing if there is no snapshot, or it was made by another version or for another folder.
+    """
+    try:
+        with open(snapshot_path, "r", encoding="utf-8") as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return {}, 0
+    except (OSError, ValueError) as e:
+        app_logger.warning(f"Portfolio scan: Ignoring unreadable snapshot, the whole folder will be listed: {e}")
+        return {}, 0
+
+    if (
+        snapshot.get("version") != SNAPSHOT_VERSION
+        or snapshot.get("scan_directory") != scan_directory
+        or snapshot.get("ignored_extensions") != list(ignored_extensions)
+    ):
+        return {}, 0
+    return snapshot["directories"], snapshot["scan_start_time_ns"] - RACY_WINDOW_NS
+
+
+def _save_snapshot(snapshot_path: str, scan_directory: str, ignored_extensions: tuple[str, ...], scan_start_time_ns: int, listings: dict):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "scan_directory": scan_directory,
+        "ignored_extensions": list(ignored_extensions),
+        "scan_start_time_ns": scan_start_time_ns,
+        "directories": listings,
+    }
+    temporary_path = f"{snapshot_path}.{os.getpid()}.tmp"  # Other processes (e.g. a bake) may save at the same time
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file, separators=(",", ":"))
+        os.replace(temporary_path, snapshot_path)
+    except OSError as e:
+        app_logger.warning(f"Portfolio scan: Could not save the snapshot [{snapshot_path}]: {e}")
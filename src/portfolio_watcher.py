@@ -0,0 +1,234 @@
+"""
+This module watches the portfolio folder and applies file additions, removals, renames and caption edits to the
+Portfolio as they happen, so that the server does not need a restart nor a full rescan.
+
+Uses inotify (through the optional inotify_simple package) when available, and falls back to polling mtimes otherwise.
+All the work happens on a background daemon thread; request threads only ever read the portfolio's current snapshot.
+"""
+
+import os
+import threading
+
+import app_logger
+import asset_fingerprints
+import thumbnails
+from portfolio import Portfolio
+
+try:
+    from inotify_simple import INotify, flags
+
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+DEFAULT_POLL_INTERVAL_SECONDS = 2.0
+INOTIFY_BATCH_DELAY_MS = 200  # Lets bursts of events (e.g. copying a folder) be applied as a single change
+
+_watcher = None
+
+
+class PortfolioWatcher(threading.Thread):
+    """
+    Background thread that detects changes in the portfolio folder and forwards them to Portfolio.apply_changes().
+    """
+
+    def __init__(self, portfolio: Portfolio, poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS, use_inotify: bool = INOTIFY_AVAILABLE):
+        super().__init__(name="portfolio-watcher", daemon=True)
+        self._portfolio = portfolio
+        self._root_directory = portfolio.get_scan_directory()
+        self._poll_interval_seconds = poll_interval_seconds
+        self._use_inotify = use_inotify
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Asks the watcher to stop, it exits after its current wait."""
+        self._stop_event.set()
+
+    def run(self):
+        try:
+            if self._use_inotify:
+                app_logger.info(f"Portfolio watcher: Watching [{self._root_directory}] with inotify.")
+                # inotify reports every modified asset, polling only the captions
+                thumbnails.set_changes_watched(True)
+                asset_fingerprints.set_changes_watched(True)
+                try:
+                    self._watch_with_inotify()
+                finally:
+                    thumbnails.set_changes_watched(False)
+                    asset_fingerprints.set_changes_watched(False)
+            else:
+                app_logger.info(f"Portfolio watcher: Polling [{self._root_directory}] every {self._poll_interval_seconds}s.")
+                self._watch_with_polling()
+        except Exception as e:
+            app_logger.error(f"Portfolio watcher: Stopped after an unexpected error: {e}")
+
+    def _apply_changes(self, added_paths: list[str], removed_paths: list[str], modified_paths: list[str]):
+        if not (added_paths or removed_paths or modified_paths):
+            return
+        try:
+            self._portfolio.apply_changes(added_paths, removed_paths, modified_paths)
+        except Exception as e:
+            app_logger.error(f"Portfolio watcher: Could not apply changes to the portfolio: {e}")
+
+    # ---- inotify ----
+
+    def _watch_with_inotify(self):
+        inotify = INotify()
+        watch_mask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE
+        watched_directories = {}  # watch descriptor -> directory
+
+        def add_watches(directory: str):
+            for current_directory, _, _ in os.walk(directory):
+                try:
+                    watched_directories[inotify.add_watch(current_directory, watch_mask)] = current_directory
+                except OSError as e:
+                    app_logger.warning(f"Portfolio watcher: Could not watch directory [{current_directory}]: {e}")
+
+        add_watches(self._root_directory)
+
+        try:
+            while not self._stop_event.is_set():
+                events = inotify.read(timeout=1000, read_delay=INOTIFY_BATCH_DELAY_MS)
+                added_paths, removed_paths, modified_paths = [], [], []
+
+                for event in events:
+                    if event.mask & flags.IGNORED:
+                        watched_directories.pop(event.wd, None)
+                        continue
+                    directory = watched_directories.get(event.wd)
+                    if directory is None or not event.name:
+                        continue
+
+                    path = os.path.join(directory, event.name)
+                    if event.mask & flags.ISDIR:
+                        if event.mask & (flags.CREATE | flags.MOVED_TO):
+                            add_watches(path)
+                            added_paths.extend(_list_files_recursively(path))
+                        elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                            removed_paths.append(path)
+                    elif event.mask & (flags.CREATE | flags.MOVED_TO):
+                        added_paths.append(path)
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                        removed_paths.append(path)
+                    elif event.mask & flags.CLOSE_WRITE:
+                        modified_paths.append(path)
+
+                self._apply_changes(added_paths, removed_paths, modified_paths)
+        finally:
+            inotify.close()
+
+    # ---- polling ----
+
+    def _watch_with_polling(self):
+        """
+        Only directories whose mtime changed are listed again, since adding, removing or renaming an entry updates it.
+        Caption edits do not touch the directory, so caption files are stat'ed individually.
+        """
+        directory_states = {}  # directory -> (mtime_ns, files, subdirectories)
+        caption_states = {}  # caption path -> (mtime_ns, size)
+
+        def list_directory(directory: str):
+            """Records the state of a directory and returns (files, subdirectories), or None if it vanished."""
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+                files, subdirectories = set(), set()
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.add(entry.path)
+                        elif entry.is_file():
+                            files.add(entry.path)
+            except OSError:
+                return None
+            directory_states[directory] = (mtime_ns, files, subdirectories)
+            return files, subdirectories
+
+        def track_new_directory(directory: str, added_paths: list[str]):
+            listing = list_directory(directory)
+            if listing is None:
+                return
+            files, subdirectories = listing
+            added_paths.extend(files)
+            for subdirectory in subdirectories:
+                track_new_directory(subdirectory, added_paths)
+
+        def forget_directory(directory: str, removed_paths: list[str]):
+            state = directory_states.pop(directory, None)
+            if state is None:
+                return
+            removed_paths.extend(state[1])
+            for subdirectory in state[2]:
+                forget_directory(subdirectory, removed_paths)
+
+        def stat_caption(path: str):
+            try:
+                stat_result = os.stat(path)
+                return stat_result.st_mtime_ns, stat_result.st_size
+            except OSError:
+                return None
+
+        # Initial state, the portfolio itself was already built by the scanner
+        track_new_directory(self._root_directory, [])
+        for _, files, _ in directory_states.values():
+            for path in files:
+                if path.endswith(".md"):
+                    caption_states[path] = stat_caption(path)
+
+        while not self._stop_event.wait(self._poll_interval_seconds):
+            added_paths, removed_paths, modified_paths = [], [], []
+
+            for directory, (mtime_ns, old_files, old_subdirectories) in list(directory_states.items()):
+                if directory not in directory_states:
+                    continue  # Forgotten earlier in this pass along with its parent
+                try:
+                    current_mtime_ns = os.stat(directory).st_mtime_ns
+                except OSError:
+                    current_mtime_ns = None
+                if current_mtime_ns == mtime_ns:
+                    continue
+
+                listing = list_directory(directory)
+                if listing is None:
+                    forget_directory(directory, removed_paths)
+                    continue
+                files, subdirectories = listing
+                added_paths.extend(files - old_files)
+                removed_paths.extend(old_files - files)
+                for subdirectory in subdirectories - old_subdirectories:
+                    track_new_directory(subdirectory, added_paths)
+                for subdirectory in old_subdirectories - subdirectories:
+                    forget_directory(subdirectory, removed_paths)
+
+            for path in removed_paths:
+                caption_states.pop(path, None)
+            for path in added_paths:
+                if path.endswith(".md"):
+                    caption_states[path] = stat_caption(path)
+            for path, state in list(caption_states.items()):
+                current_state = stat_caption(path)
+                if current_state != state:
+                    caption_states[path] = current_state
+                    modified_paths.append(path)
+
+            self._apply_changes(added_paths, removed_paths, modified_paths)
+
+
+def _list_files_recursively(directory: str) -> list[str]:
+    return [os.path.join(current_directory, file) for current_directory, _, files in os.walk(directory) for file in files]
+
+
+def start_watching(portfolio: Portfolio, poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS) -> PortfolioWatcher:
+    """Starts the portfolio watcher thread if it is not already running and returns it."""
+    global _watcher
+    if _watcher is None or not _watcher.is_alive():
+        _watcher = PortfolioWatcher(portfolio, poll_interval_seconds)
+        _watcher.start()
+    return _watcher
+
+
+def stop_watching():
+    """Stops the portfolio watcher thread, if any."""
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
@@ -0,0 +1,193 @@
+"""
+This module provides a bounded LRU cache of rendered pages (final HTML), validated against the actual dependencies of each page.
+
+A dependency is a hashable tuple describing something the page was built from:
+- ("file", absolute_path): the mtime and size of a file, e.g. a custom page's markdown or a caption
+- ("template", template_name): the mtime and size of a template in the templates folder
+- ("page", page_name): the mtime and size of a custom page's markdown, as last seen by the custom pages index
+- ("pages",): the custom pages generation, bumped every time a custom page is added, removed or modified
+- ("config",): the configuration generation, bumped every time the configuration is loaded
+- ("portfolio",): the portfolio generation, bumped every time an asset or caption changes
+- ("neighbours", asset_identifier): the identifiers of the elements before and after an element
+- ("thumbnails",): the thumbnails generation, bumped every time a thumbnail build completes
+- ("image_metadata",): the image metadata generation, bumped every time image dimensions are read
+- ("fingerprints",): the fingerprints generation, bumped every time the static or asset fingerprints change
+
+Each entry stores the state of its dependencies at render time and is only served while they are all unchanged,
+so entries are invalidated precisely instead of on a timer.
+Code running inside a render can add dependencies discovered along the way with record_dependency(),
+and flag content that must be expanded on every request (e.g. a random carousel) with record_deferred_tags().
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import asset_fingerprints
+import config_manager
+import custom_pages_index
+import image_metadata
+import path_util
+import thumbnails
+from portfolio import Portfolio
+
+DEFAULT_MAX_ENTRIES = 256
+
+_recordings = threading.local()
+
+
+class _Recording:
+    """What a render running on the current thread discovered about itself."""
+
+    __slots__ = ("dependencies", "has_deferred_tags")
+
+    def __init__(self):
+        self.dependencies = []
+        self.has_deferred_tags = False
+
+
+class CachedRender:
+    """A rendered page along with its strong ETag and the dependency states it was rendered against."""
+
+    __slots__ = ("html", "etag", "has_deferred_tags", "dependency_states")
+
+    def __init__(self, html: str, dependency_states: dict, has_deferred_tags: bool):
+        self.html = html
+        self.etag = hashlib.blake2b(html.encode("utf-8"), digest_size=16).hexdigest()
+        self.has_deferred_tags = has_deferred_tags  # e.g. a carousel that must be expanded on every request
+        self.dependency_states = dependency_states
+
+    def is_fresh(self) -> bool:
+        """Returns True if none of the dependencies changed since the page was rendered."""
+        return all(get_dependency_state(dependency) == state for dependency, state in self.dependency_states.items())
+
+
+class RenderCache:
+    """
+    Thread-safe LRU cache of CachedRender entries.
+    A max_entries of 0 disables the cache, every call then renders.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, dependencies: list[tuple], render_function) -> CachedRender | None:
+        """
+        Returns the cached render for key if all its dependencies are unchanged, otherwise calls render_function() and caches its result.
+        render_function must return the HTML as a string, or None on failure (failures are not cached).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None and entry.is_fresh():
+            self.hits += 1
+            return entry
+        self.misses += 1
+
+        # States are read before rendering so that a change during the render invalidates the entry on the next request
+        dependency_states = {dependency: get_dependency_state(dependency) for dependency in dependencies}
+        recording = _Recording()
+        _recordings.stack = getattr(_recordings, "stack", [])
+        _recordings.stack.append(recording)
+        try:
+            html = render_function()
+        finally:
+            _recordings.stack.pop()
+
+        if html is None:
+            return None
+
+        for dependency in recording.dependencies:
+            dependency_states.setdefault(dependency, get_dependency_state(dependency))
+        entry = CachedRender(html, dependency_states, recording.has_deferred_tags)
+
+        if self._max_entries > 0:
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def record_dependency(dependency: tuple):
+    """Adds a dependency to the render currently being cached on this thread, if any."""
+    stack = getattr(_recordings, "stack", None)
+    if stack:
+        stack[-1].dependencies.append(dependency)
+
+
+def record_deferred_tags():
+    """Flags the render currently being cached on this thread as containing tags to expand on every request."""
+    stack = getattr(_recordings, "stack", None)
+    if stack:
+        stack[-1].has_deferred_tags = True
+
+
+def get_dependency_state(dependency: tuple):
+    """Returns a comparable value that changes whenever the given dependency changes."""
+    kind = dependency[0]
+    if kind == "file":
+        return _get_file_state(dependency[1])
+    elif kind == "template":
+        return _get_file_state(path_util.resolve_path(os.path.join("templates", dependency[1])))
+    elif kind == "page":
+        page = custom_pages_index.get_snapshot().get_page(dependency[1])
+        return page.state if page is not None else None
+    elif kind == "pages":
+        return custom_pages_index.get_snapshot().get_generation()
+    elif kind == "config":
+        return config_manager.get_config_generation()
+    elif kind == "portfolio":
+        return Portfolio.get_instance().get_generation()
+    elif kind == "thumbnails":
+        return thumbnails.get_generation()
+    elif kind == "image_metadata":
+        return image_metadata.get_generation()
+    elif kind == "fingerprints":
+        return asset_fingerprints.get_generation()
+    elif kind == "neighbours":
+        snapshot = Portfolio.get_instance().get_snapshot()
+        element = snapshot.get_element_by_identifier(dependency[1])
+        previous_element = snapshot.get_element_before(element)
+        next_element = snapshot.get_element_after(element)
+        return (
+            previous_element.get_identifier() if previous_element else None,
+            next_element.get_identifier() if next_element else None,
+        )
+    raise ValueError(f"Unknown render cache dependency: {dependency}")
+
+
+def _get_file_state(path: str):
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+_render_cache = RenderCache()
+
+
+def get_render_cache() -> RenderCache:
+    return _render_cache
+
+
+def configure(max_entries: int):
+    """Replaces the render cache with an empty one of the given size, 0 disables caching."""
+    global _render_cache
+    _render_cache = RenderCache(max_entries)
@@ -0,0 +1,201 @@
+"""
+Runs Pyfolio as a production server, instead of the Flask development server of app.py.
+
+The application is set up once, in the master process: the configuration is loaded, the portfolio scanned and indexed,
+and the startup builds (captions, fingerprints, thumbnails) are waited for. Then worker processes are forked from it,
+sharing all of that memory copy-on-write instead of each building their own, and each serves requests on a pool of threads.
+This uses gunicorn when it is installed (pip install gunicorn). Otherwise, or on platforms without fork(),
+a single process serves requests on a pool of threads, with a pure Python server built on Werkzeug's.
+
+- /healthz answers as long as a worker handles requests, /readyz once the startup builds are done (see app.py).
+- SIGHUP reloads config.toml and rescans the portfolio: gunicorn does it in the master, then replaces the workers
+  gracefully, each old one finishing its current requests. The threaded server does it in place, while serving.
+- SIGTERM or SIGINT stop the server once the current requests are done.
+
+The address and the worker and thread counts are read from the [server] section of config.toml,
+and can be overridden on the command line.
+
+Usage: python serve.py [--host 0.0.0.0] [--port 8000] [--workers 4] [--threads 8] [--threaded]
+"""
+
+import argparse
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import app as main_app_module
+import app_logger
+import config_manager
+
+try:
+    from gunicorn.app.base import BaseApplication
+
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    GUNICORN_AVAILABLE = False
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_THREADS = 8
+DEFAULT_TIMEOUT_SECONDS = 30
+KEEP_ALIVE_TIMEOUT_SECONDS = 5  # Idle keep-alive connections hold a thread of the pool, so they are closed quickly
+
+
+def get_worker_count(configured_workers: int | None) -> int:
+    """Returns the number of worker processes, one per CPU core unless configured."""
+    if configured_workers:
+        return configured_workers
+    return os.cpu_count() or 1
+
+
+# ---- gunicorn ----
+
+if GUNICORN_AVAILABLE:
+
+    class PreforkServer(BaseApplication):
+        """A gunicorn server for the already set up Flask app, preloaded so that workers are forked from the master."""
+
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return main_app_module.app
+
+
+def on_worker_forked(server, worker):
+    """gunicorn post_fork hook: restarts, in the new worker, the threads that did not survive the fork."""
+    app_logger.start_listener()
+    main_app_module.start_portfolio_watcher()
+
+
+def on_reload(server):
+    """gunicorn on_reload hook, run in the master on SIGHUP before the new workers are forked."""
+    main_app_module.reload_environment()
+    main_app_module.wait_for_background_tasks()
+
+
+def run_prefork_server(host: str, port: int, workers: int, threads: int, timeout_seconds: int):
+    app_logger.info(f"Serve: Starting gunicorn on {host}:{port} with {workers} workers of {threads} threads.")
+    PreforkServer(
+        {
+            "bind": f"{host}:{port}",
+            "workers": workers,
+            "threads": threads,
+            "worker_class": "gthread",
+            "timeout": timeout_seconds,
+            "graceful_timeout": timeout_seconds,
+            "keepalive": KEEP_ALIVE_TIMEOUT_SECONDS,
+            "preload_app": True,
+            "post_fork": on_worker_forked,
+            "on_reload": on_reload,
+        }
+    ).run()
+
+
+# ---- Threaded fallback ----
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Keeps HTTP/1.1 connections open between requests, up to KEEP_ALIVE_TIMEOUT_SECONDS of inactivity."""
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT_SECONDS
+
+    def log_request(self, code="-", size="-"):
+        pass  # Requests are logged by the application, at the DEBUG level
+
+
+class ThreadPoolWSGIServer(BaseWSGIServer):
+    """
+    A Werkzeug server handling connections on a fixed pool of threads.
+    Werkzeug's threaded server starts a new thread per connection, without bound.
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, wsgi_app, threads: int):
+        super().__init__(host, port, wsgi_app, handler=KeepAliveRequestHandler)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request_in_thread, request, client_address)
+
+    def _process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """Waits for the connections being handled, then closes the listening socket."""
+        self._executor.shutdown(wait=True)
+        super().server_close()
+
+
+def run_threaded_server(host: str, port: int, threads: int):
+    server = ThreadPoolWSGIServer(host, port, main_app_module.app, threads)
+
+    def stop(signal_number, frame):
+        app_logger.info("Serve: Stopping once the current requests are done.")
+        threading.Thread(target=server.shutdown, name="serve-shutdown").start()  # shutdown() waits for serve_forever() to return
+
+    def reload(signal_number, frame):
+        threading.Thread(target=main_app_module.reload_environment, name="serve-reload").start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, reload)
+
+    app_logger.info(f"Serve: Listening on {host}:{server.port} with {threads} threads.")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    app_logger.info("Serve: Stopped.")
+
+
+def main():
+    app_logger.info("Serve: Setting up environment...")
+    main_app_module.setup_environment()
+
+    server_config = config_manager.get_config().get("server", {})
+    parser = argparse.ArgumentParser(description="Serve the portfolio with multiple workers.")
+    parser.add_argument("--host", default=server_config.get("host", DEFAULT_HOST), help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=server_config.get("port", DEFAULT_PORT), help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=server_config.get("workers", 0), help="worker processes, 0 for one per CPU core (default: 0)")
+    parser.add_argument("--threads", type=int, default=server_config.get("threads", DEFAULT_THREADS), help=f"threads per worker (default: {DEFAULT_THREADS})")
+    parser.add_argument("--threaded", action="store_true", help="serve from a single process even if gunicorn is installed")
+    arguments = parser.parse_args()
+
+    use_prefork_server = GUNICORN_AVAILABLE and hasattr(os, "fork") and not arguments.threaded
+    if not use_prefork_server and not arguments.threaded:
+        app_logger.warning("Serve: gunicorn is not available, serving from a single process. Install it with 'pip install gunicorn'.")
+
+    if use_prefork_server:
+        # Workers inherit the finished builds rather than each redoing or missing them
+        app_logger.info("Serve: Waiting for the startup builds before forking the workers...")
+        main_app_module.wait_for_background_tasks()
+        run_prefork_server(
+            arguments.host,
+            arguments.port,
+            get_worker_count(arguments.workers),
+            arguments.threads,
+            server_config.get("timeout_seconds", DEFAULT_TIMEOUT_SECONDS),
+        )
+    else:
+        run_threaded_server(arguments.host, arguments.port, arguments.threads)
+
+
+if __name__ == "__main__":
+    main()
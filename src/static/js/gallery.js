@@ -0,0 +1,102 @@
+document.addEventListener("DOMContentLoaded", () => {
+  // Progressive enhancement of the paginated gallery: load the next pages as the user scrolls instead of following the pagination links
+  const grid = document.querySelector(".gallery-grid[data-next-url]");
+  if (!grid || !("IntersectionObserver" in window) || !window.fetch) {
+    return; // Keep the regular pagination links
+  }
+
+  const pagination = document.querySelector(".gallery-pagination");
+  const existingImage = grid.querySelector("img[sizes]");
+  const imageSizes = existingImage ? existingImage.sizes : "";
+
+  let nextUrl = grid.dataset.nextUrl;
+  let loading = false;
+
+  if (pagination) {
+    pagination.style.display = "none";
+  }
+
+  // Element placed right after the grid, reaching it triggers the loading of the next page
+  const sentinel = document.createElement("div");
+  sentinel.className = "gallery-sentinel";
+  grid.after(sentinel);
+
+  function createCard(element) {
+    const link = document.createElement("a");
+    link.href = element.page_url;
+    link.className = "gallery-item-link";
+
+    const item = document.createElement("div");
+    item.className = "gallery-item";
+
+    const imageContainer = document.createElement("div");
+    imageContainer.className = "gallery-item-image";
+    const image = document.createElement("img");
+    image.src = element.thumbnail_url;
+    if (element.thumbnail_srcset) {
+      image.srcset = element.thumbnail_srcset;
+      image.sizes = imageSizes;
+    }
+    if (element.width && element.height) {
+      image.width = element.width;
+      image.height = element.height;
+    }
+    image.loading = "lazy";
+    image.decoding = "async";
+    image.alt = element.title;
+    imageContainer.appendChild(image);
+
+    const title = document.createElement("div");
+    title.className = "gallery-item-title";
+    const label = document.createElement("p");
+    label.textContent = element.label;
+    title.appendChild(label);
+
+    item.appendChild(imageContainer);
+    item.appendChild(title);
+    link.appendChild(item);
+    return link;
+  }
+
+  async function loadNextPage() {
+    if (loading || !nextUrl) {
+      return;
+    }
+    loading = true;
+    try {
+      const response = await fetch(nextUrl);
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const listing = await response.json();
+      const fragment = document.createDocumentFragment();
+      listing.elements.forEach((element) => fragment.appendChild(createCard(element)));
+      grid.appendChild(fragment);
+      nextUrl = listing.next_url;
+    } catch (error) {
+      // Fall back to the regular pagination links
+      console.error("Could not load the next gallery page:", error);
+      nextUrl = null;
+      if (pagination) {
+        pagination.style.display = "";
+      }
+    } finally {
+      loading = false;
+    }
+
+    if (!nextUrl) {
+      observer.disconnect();
+      sentinel.remove();
+    }
+  }
+
+  const observer = new IntersectionObserver(
+    (entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) {
+        loadNextPage();
+      }
+    },
+    { rootMargin: "600px" } // Start loading before the end of the grid is visible
+  );
+  observer.observe(sentinel);
+});
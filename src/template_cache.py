@@ -0,0 +1,50 @@
+"""
+This module keeps the compiled Jinja templates on disk, in cache/templates, so that new processes (server workers,
+bake workers, restarts) load their bytecode instead of parsing and compiling every template from source.
+
+Jinja checks the bytecode against a checksum of the template's source, so an edited template is simply compiled again.
+precompile_templates() compiles every template ahead of time: at startup, before server or bake workers are forked
+(see the [cache] section of config.toml), or from the command line, e.g. when building a deployment:
+
+Usage: python template_cache.py
+"""
+
+import os
+import time
+
+from jinja2 import Environment, FileSystemBytecodeCache
+
+import app_logger
+import path_util
+
+TEMPLATE_CACHE_FOLDER = "cache/templates"
+
+
+def configure(jinja_environment: Environment, enabled: bool):
+    """Sets, or removes, the bytecode cache of the environment."""
+    if not enabled:
+        jinja_environment.bytecode_cache = None
+        return
+    cache_folder = path_util.resolve_path(TEMPLATE_CACHE_FOLDER)
+    os.makedirs(cache_folder, exist_ok=True)
+    jinja_environment.bytecode_cache = FileSystemBytecodeCache(cache_folder)
+
+
+def precompile_templates(jinja_environment: Environment) -> int:
+    """
+    Loads every template, compiling those missing from the bytecode cache and keeping them all in the environment's memory,
+    which forked processes then inherit. Returns the number of templates.
+    """
+    start_time = time.perf_counter()
+    template_names = jinja_environment.list_templates()
+    for template_name in template_names:
+        jinja_environment.get_template(template_name)
+    app_logger.info(f"Templates: Loaded {len(template_names)} templates in {(time.perf_counter() - start_time) * 1000:.1f} ms.")
+    return len(template_names)
+
+
+if __name__ == "__main__":
+    import app as main_app_module
+
+    configure(main_app_module.app.jinja_env, True)
+    precompile_templates(main_app_module.app.jinja_env)
@@ -0,0 +1,307 @@
+"""
+This module generates resized WebP thumbnails of the portfolio images, used by the gallery, the carousel and the baked site.
+
+Thumbnails are stored in an on-disk cache named after a hash of the source image's content (e.g. "<hash>-400.webp"),
+so they only have to be generated again when the source actually changes, and their URLs can be cached forever.
+A manifest maps each source path to its last known mtime, size and content hash, which spares rehashing unchanged images.
+Generation runs across a process pool, either blocking (e.g. for the bake) or in the background, elements simply use
+their original image until their thumbnails are ready, and as soon as their image is modified.
+Images added or modified while the server runs get their thumbnails from the portfolio watcher (see Portfolio.apply_changes()).
+
+Requires the optional Pillow package, without it every image keeps using the original file.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import app_logger
+import path_util
+
+try:
+    from PIL import Image, ImageOps
+
+    # Import every format plugin now rather than lazily on first use: workers forked while another thread is
+    # importing a plugin would otherwise inherit its held import lock and hang
+    Image.init()
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+THUMBNAIL_CACHE_FOLDER = "cache/thumbnails"
+MANIFEST_FILE_NAME = "manifest.json"
+DEFAULT_WIDTHS = [200, 400, 800]
+DEFAULT_QUALITY = 80
+BUILD_MODES = ["off", "startup", "background"]
+
+# Vector and icon formats are better served as-is
+THUMBNAIL_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "bmp", "webp", "tiff", "tif"}
+
+_thumbnails = {}  # absolute asset path -> Thumbnail, replaced as a whole once a build completes
+_generation = 0  # Incremented every time _thumbnails changes, lets caches of rendered galleries detect new thumbnails
+_build_settings = None  # (requested widths, quality) of the last build, used for the images reported by the portfolio watcher
+_is_changes_watched = False  # See set_changes_watched()
+_build_lock = threading.Lock()
+
+
+class Thumbnail:
+    """The thumbnails available for a source image, identified by the hash of its content, along with the (mtime_ns, size) of the image."""
+
+    __slots__ = ("content_hash", "widths", "source_state")
+
+    def __init__(self, content_hash: str, widths: list[int], source_state: tuple[int, int]):
+        self.content_hash = content_hash
+        self.widths = tuple(sorted(widths))
+        self.source_state = source_state
+
+    def get_file_name(self, width: int) -> str:
+        return f"{self.content_hash}-{width}.webp"
+
+    def get_best_width(self, minimum_width: int | None = None) -> int:
+        """Returns the smallest available width at least minimum_width wide (the largest if none is), or the smallest width if None."""
+        if minimum_width is None:
+            return self.widths[0]
+        for width in self.widths:
+            if width >= minimum_width:
+                return width
+        return self.widths[-1]
+
+
+def get_cache_directory() -> str:
+    return path_util.resolve_path(THUMBNAIL_CACHE_FOLDER)
+
+
+def get_thumbnail(absolute_asset_path: str) -> Thumbnail | None:
+    """Returns the thumbnails of an image, or None if there are none (yet) or the image was modified since."""
+    thumbnail = _thumbnails.get(absolute_asset_path)
+    if thumbnail is None or _is_changes_watched:
+        return thumbnail
+    try:
+        stat_result = os.stat(absolute_asset_path)
+    except OSError:
+        return None
+    if (stat_result.st_mtime_ns, stat_result.st_size) != thumbnail.source_state:
+        return None
+    return thumbnail
+
+
+def set_changes_watched(is_watched: bool):
+    """
+    Set while the portfolio watcher reports every modified image (with inotify) and thumbnails are updated right away,
+    lookups then skip checking whether the image was modified.
+    """
+    global _is_changes_watched
+    _is_changes_watched = is_watched
+
+
+def get_generation() -> int:
+    return _generation
+
+
+def can_have_thumbnail(element) -> bool:
+    return element.get_asset_type() == "image" and element.get_extension().lower() in THUMBNAIL_EXTENSIONS
+
+
+def build_thumbnails(elements, widths: list[int] = DEFAULT_WIDTHS, quality: int = DEFAULT_QUALITY, max_workers: int | None = None):
+    """
+    Makes sure every image element has up to date thumbnails, generating the missing ones across a process pool.
+    Thumbnails no longer referenced by any image are deleted from the cache.
+    """
+    global _thumbnails, _generation, _build_settings
+
+    if not PILLOW_AVAILABLE:
+        app_logger.warning("Thumbnails: Pillow is not installed, the gallery will use the original images. Install it with 'pip install pillow'.")
+        return
+
+    with _build_lock:
+        start_time = time.perf_counter()
+        cache_directory = get_cache_directory()
+        os.makedirs(cache_directory, exist_ok=True)
+        manifest = _load_manifest(cache_directory)
+        cached_file_names = set(os.listdir(cache_directory))
+        requested_widths = sorted(widths)
+
+        ready_thumbnails = {}
+        new_manifest = {}
+        jobs = []
+        for element in elements:
+            if not can_have_thumbnail(element):
+                continue
+            source_path = element.get_absolute_asset_path()
+            try:
+                stat_result = os.stat(source_path)
+            except OSError:
+                continue
+
+            entry = manifest.get(source_path)
+            if (
+                entry is not None
+                and entry["mtime_ns"] == stat_result.st_mtime_ns
+                and entry["size"] == stat_result.st_size
+                and entry["requested_widths"] == requested_widths
+                and all(f"{entry['hash']}-{width}.webp" in cached_file_names for width in entry["widths"])
+            ):
+                new_manifest[source_path] = entry
+                ready_thumbnails[source_path] = Thumbnail(entry["hash"], entry["widths"], (entry["mtime_ns"], entry["size"]))
+            else:
+                jobs.append((source_path, stat_result.st_mtime_ns, stat_result.st_size, requested_widths, quality, cache_directory))
+
+        failed_count = 0
+        if jobs:
+            worker_count = max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=worker_count) as executor:
+                for source_path, entry in zip((job[0] for job in jobs), executor.map(_generate_thumbnails_in_worker, jobs)):
+                    if entry is None:
+                        failed_count += 1
+                        continue
+                    new_manifest[source_path] = entry
+                    ready_thumbnails[source_path] = Thumbnail(entry["hash"], entry["widths"], (entry["mtime_ns"], entry["size"]))
+
+        _save_manifest(cache_directory, new_manifest)
+        removed_count = _remove_unreferenced_files(cache_directory, new_manifest)
+
+        _thumbnails = ready_thumbnails
+        _generation += 1
+        _build_settings = (requested_widths, quality)
+
+    app_logger.info(
+        f"Thumbnails: {len(ready_thumbnails)} images ready, {len(jobs) - failed_count} generated, {failed_count} failed, "
+        f"{removed_count} stale files removed in {(time.perf_counter() - start_time) * 1000:.1f} ms."
+    )
+
+
+def start_background_build(elements, widths: list[int] = DEFAULT_WIDTHS, quality: int = DEFAULT_QUALITY, max_workers: int | None = None):
+    """Runs build_thumbnails() on a daemon thread."""
+
+    def build():
+        try:
+            build_thumbnails(elements, widths, quality, max_workers)
+        except Exception as e:
+            app_logger.error(f"Thumbnails: Background generation failed: {e}")
+
+    thread = threading.Thread(target=build, name="thumbnail-build", daemon=True)
+    thread.start()
+    return thread
+
+
+def update_thumbnails(elements):
+    """
+    Generates the thumbnails of a few added or modified images, e.g. reported by the portfolio watcher, with the settings of the last build
+    and without saving the manifest: the next build finds them in the cache. Does nothing until a build has run, which will generate them anyway.
+    """
+    global _thumbnails, _generation
+
+    images = [element for element in elements if can_have_thumbnail(element)]
+    if not images or not PILLOW_AVAILABLE:
+        return
+    with _build_lock:
+        if _build_settings is None:
+            return
+        requested_widths, quality = _build_settings
+        cache_directory = get_cache_directory()
+        updated_thumbnails = dict(_thumbnails)
+        for element in images:
+            source_path = element.get_absolute_asset_path()
+            try:
+                stat_result = os.stat(source_path)
+            except OSError:
+                continue
+            entry = _generate_thumbnails_in_worker((source_path, stat_result.st_mtime_ns, stat_result.st_size, requested_widths, quality, cache_directory))
+            if entry is None:
+                updated_thumbnails.pop(source_path, None)
+            else:
+                updated_thumbnails[source_path] = Thumbnail(entry["hash"], entry["widths"], (entry["mtime_ns"], entry["size"]))
+        _thumbnails = updated_thumbnails
+        _generation += 1
+
+    app_logger.info(f"Thumbnails: Updated the thumbnails of {len(images)} added or modified images.")
+
+
+def _generate_thumbnails_in_worker(job: tuple) -> dict | None:
+    """
+    Process pool entry point, hashes a source image and generates its thumbnails unless they already exist for that content.
+    Images are never upscaled, an image narrower than every requested width gets a single thumbnail at its own width.
+    Returns the manifest entry for the image, or None if it could not be processed.
+    Everything it needs comes with the job, so it works the same in spawned workers (the default on Windows and macOS).
+    """
+    source_path, mtime_ns, size, requested_widths, quality, cache_directory = job
+    try:
+        content_hash = _hash_file(source_path)
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            widths = [width for width in requested_widths if width < image.width] or [image.width]
+            for width in widths:
+                target_path = os.path.join(cache_directory, f"{content_hash}-{width}.webp")
+                if os.path.isfile(target_path):
+                    continue  # Same content already processed, e.g. the file was only touched or copied
+                resized = image.copy()
+                resized.thumbnail((width, width * 100))
+                if resized.mode not in ("RGB", "RGBA"):
+                    resized = resized.convert("RGBA" if "A" in resized.getbands() or "transparency" in resized.info else "RGB")
+                temporary_path = f"{target_path}.{os.getpid()}.tmp"  # Other processes (e.g. a bake) may generate it at the same time
+                try:
+                    resized.save(temporary_path, "WEBP", quality=quality, method=4)
+                    os.replace(temporary_path, target_path)  # Atomic, a concurrent reader never sees a partial thumbnail
+                except Exception:
+                    _remove_file_if_exists(temporary_path)
+                    raise
+    except Exception as e:
+        app_logger.warning(f"Thumbnails: Could not generate thumbnails for [{source_path}]: {e}")
+        return None
+
+    return {"mtime_ns": mtime_ns, "size": size, "hash": content_hash, "widths": widths, "requested_widths": requested_widths}
+
+
+def _hash_file(path: str) -> str:
+    file_hash = hashlib.blake2b(digest_size=12)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _load_manifest(cache_directory: str) -> dict:
+    try:
+        with open(os.path.join(cache_directory, MANIFEST_FILE_NAME), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        app_logger.warning(f"Thumbnails: Ignoring unreadable manifest, all thumbnails will be checked again: {e}")
+        return {}
+
+
+def _save_manifest(cache_directory: str, manifest: dict):
+    manifest_path = os.path.join(cache_directory, MANIFEST_FILE_NAME)
+    temporary_path = f"{manifest_path}.{os.getpid()}.tmp"  # Other processes (e.g. a bake) may save at the same time
+    try:
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, manifest_path)
+    except OSError as e:
+        app_logger.warning(f"Thumbnails: Could not save the manifest [{manifest_path}]: {e}")
+
+
+def _remove_file_if_exists(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_unreferenced_files(cache_directory: str, manifest: dict) -> int:
+    referenced_file_names = {f"{entry['hash']}-{width}.webp" for entry in manifest.values() for width in entry["widths"]}
+    referenced_file_names.add(MANIFEST_FILE_NAME)
+    removed_count = 0
+    for file_name in os.listdir(cache_directory):
+        # Temporary files are being written by another process, which removes them itself if the write fails
+        if file_name not in referenced_file_names and not file_name.endswith(".tmp"):
+            try:
+                os.remove(os.path.join(cache_directory, file_name))
+                removed_count += 1
+            except OSError:
+                pass
+    return removed_count